@@ -4,30 +4,181 @@ Creates pie charts, bar charts, and comprehensive statistics reports
 """
 
 import csv
-import matplotlib.pyplot as plt
-import matplotlib
 import numpy as np
-from collections import defaultdict
 import json
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dacia_city_store import CityStore
+from dacia_columnar import find_columnar, read_columnar
+from dacia_streaming import CSV_FIELDNAMES
+from dacia_metrics import Metrics, timed
+from dacia_stats import StatisticsAccumulator, DEFAULT_EXACT_LIMIT, DEFAULT_SKETCH_CAPACITY
+from dacia_density import DensityGrid, bin_cities, DEFAULT_RESOLUTION
+from dacia_border_distance import BorderDistanceIndex, DEFAULT_BORDER_BANDS, band_labels, band_indices
+from dacia_admin import AdminCodes, ADMIN1_FILE, ADMIN2_FILE, admin1_key, admin2_key
+from dacia_ranking import RankedIndex
 
-# Use a non-interactive backend for saving figures
-matplotlib.use('Agg')
+# Population ranges of the size histogram, [min, max)
+POPULATION_CATEGORIES = {
+    '< 1K': (0, 1000),
+    '1K-5K': (1000, 5000),
+    '5K-10K': (5000, 10000),
+    '10K-50K': (10000, 50000),
+    '50K-100K': (50000, 100000),
+    '100K-500K': (100000, 500000),
+    '500K+': (500000, float('inf'))
+}
+
+
+# Charts of generate_all_visualizations: method, file name stem, arguments
+CHARTS = [
+    ('create_pie_chart_cities_by_country', 'pie_cities_by_country', {}),
+    ('create_pie_chart_population_by_country', 'pie_population_by_country', {}),
+    ('create_bar_chart_cities_by_country', 'bar_cities_by_country', {}),
+    ('create_bar_chart_population_by_country', 'bar_population_by_country', {}),
+    ('create_avg_population_by_country', 'bar_avg_population_by_country', {}),
+    ('create_population_size_distribution', 'histogram_population_distribution', {}),
+    ('create_elevation_distribution', 'histogram_elevation_distribution', {}),
+    ('create_top_cities_chart', 'bar_top_cities', {'top_n': 20}),
+]
+
+IMAGE_FORMATS = ('png', 'svg')
+
+# Density grid values the heatmap can show, with their colorbar labels
+DENSITY_VALUES = {
+    'density_per_km2': 'Population per km²',
+    'population': 'Population',
+    'settlements': 'Settlements',
+}
+
+
+def pyplot():
+    """matplotlib.pyplot on the non-interactive backend, imported on first use
+    
+    matplotlib takes most of the start-up time, so runs that draw no chart
+    never import it
+    """
+    import matplotlib
+    # Use a non-interactive backend for saving figures
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def factorize(values: np.ndarray):
+    """Unique values in order of first appearance and each row's index into them"""
+    uniques, first, inverse = np.unique(values, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return uniques[order], rank[inverse.ravel()]
+
+
+def _sorted_median(values: np.ndarray) -> int:
+    """int(np.median(values)) for values already sorted ascending"""
+    n = len(values)
+    if n == 0:
+        return 0
+    # Same float arithmetic as np.median: mean of the middle element(s)
+    return int((float(values[(n - 1) // 2]) + float(values[n // 2])) / 2)
+
+
+def accumulate_csv(csv_file: str, chunk_size: int = 100000, exact_limit: int = DEFAULT_EXACT_LIMIT,
+                   capacity: int = DEFAULT_SKETCH_CAPACITY) -> StatisticsAccumulator:
+    """Stream a dacia_cities CSV file into a StatisticsAccumulator
+    
+    Rows are converted like DaciaCitiesAnalyzer.load_data and added chunk by
+    chunk, so memory use is bounded by chunk_size plus the sketches.
+    """
+    edges = [bounds[0] for bounds in POPULATION_CATEGORIES.values()] + [float('inf')]
+    accumulator = StatisticsAccumulator(edges, capacity, exact_limit)
+    
+    def flush(countries, populations, elevations, names):
+        accumulator.add_chunk(countries, np.array(populations, dtype=np.int64),
+                              np.array(elevations, dtype=np.int64), names)
+    
+    countries, populations, elevations, names = [], [], [], []
+    with open(csv_file, 'r', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            try:
+                population = int(row['population']) if row['population'] else 0
+                float(row['latitude'])
+                float(row['longitude'])
+                elevation = int(row['elevation']) if row['elevation'] else 0
+            except (ValueError, KeyError):
+                continue
+            countries.append(row['country_code'])
+            populations.append(population)
+            elevations.append(elevation)
+            names.append(row['name'])
+            
+            if len(populations) >= chunk_size:
+                flush(countries, populations, elevations, names)
+                countries, populations, elevations, names = [], [], [], []
+    
+    flush(countries, populations, elevations, names)
+    return accumulator
 
 class DaciaCitiesAnalyzer:
     """Analyze and visualize Dacia cities data"""
     
-    def __init__(self, csv_file: str):
+    def __init__(self, csv_file: str, metrics: Metrics = None):
         self.csv_file = csv_file
         self.cities = []
         self.stats = {}
+        self.columns = None
+        # Top cities overall and per country, built with the columns
+        self.ranked_index = None
+        self.population_buckets = None
+        self.density_grid = None
+        self.region_polygon = None
+        self.border_distances = None
+        # Admin division names (see load_admin_codes) and the admin1/admin2
+        # rollups computed with the country statistics
+        self.admin_codes = None
+        self.admin_stats = {}
+        self.dpi = 300
+        # Stage timers and counters, see dacia_metrics.py
+        self.metrics = metrics or Metrics()
+        
+    @timed('load')
+    def load_data(self, compact: bool = False, country: str = None):
+        """Load cities data from CSV
+        
+        With compact=True the cities are kept in a CityStore (typed columns
+        and interned strings) instead of one dict per row. When the filter
+        wrote a columnar copy of the CSV (see dacia_columnar.py) that still
+        matches it, the typed columns are loaded instead of parsing text.
+        country loads only that country's cities, which for the columnar copy
+        reads just its row group.
+        """
+        columnar = find_columnar(self.csv_file)
+        if columnar is not None:
+            print(f"Loading data from {columnar}...")
+            store = read_columnar(columnar, country, missing_elevation=0)
+            self.cities = store if compact else list(store)
+            self.metrics.add_rows('load', len(self.cities))
+            print(f"Loaded {len(self.cities):,} cities")
+            return
         
-    def load_data(self):
-        """Load cities data from CSV"""
         print(f"Loading data from {self.csv_file}...")
         
+        if compact:
+            self.cities = CityStore.from_csv(self.csv_file, missing_elevation=0)
+            if country is not None:
+                self.cities = self.cities.take(np.flatnonzero(self.cities.country_codes() == country))
+            self.metrics.add_rows('load', len(self.cities))
+            print(f"Loaded {len(self.cities):,} cities")
+            return
+        
         with open(self.csv_file, 'r', encoding='utf-8') as f:
             reader = csv.DictReader(f)
             for row in reader:
+                if country is not None and row.get('country_code') != country:
+                    continue
                 # Convert numeric fields
                 try:
                     row['population'] = int(row['population']) if row['population'] else 0
@@ -39,59 +190,457 @@ class DaciaCitiesAnalyzer:
                 
                 self.cities.append(row)
         
+        self.metrics.add_rows('load', len(self.cities))
         print(f"Loaded {len(self.cities):,} cities")
         
+    @timed('load')
+    def load_from_filter(self, filter_obj, compact: bool = False):
+        """Take the cities straight from a DaciaCityFilter run
+        
+        Gives the same rows, in the same order and with the same field
+        conversion as load_data on the dacia_cities_all.csv that
+        filter_obj.save_to_csv would write, without writing or parsing it,
+        so the statistics and charts match the two-script flow.
+        """
+        cities = filter_obj.cities_in_polygon
+        print(f"Loading {len(cities):,} cities from the filter...")
+        
+        if isinstance(cities, CityStore):
+            self.cities = cities.take(cities.sorted_indices(), missing_elevation=0)
+            self.metrics.add_rows('load', len(self.cities))
+            print(f"Loaded {len(self.cities):,} cities")
+            return
+        
+        # Same order as save_to_csv: country, then population descending
+        ordered = sorted(cities, key=lambda x: (x['country_code'], -x['population']))
+        self.cities = CityStore(missing_elevation=0) if compact else []
+        for city in ordered:
+            try:
+                elevation = int(city['elevation']) if city['elevation'] else 0
+            except ValueError:
+                continue
+            row = {field: city[field] for field in CSV_FIELDNAMES}
+            row['elevation'] = elevation
+            if compact:
+                self.cities.append_city(row)
+            else:
+                self.cities.append(row)
+        
+        self.metrics.add_rows('load', len(self.cities))
+        print(f"Loaded {len(self.cities):,} cities")
+    
+    @timed('stats')
     def calculate_statistics(self):
         """Calculate comprehensive statistics"""
         print("\nCalculating statistics...")
         
-        # Group by country
-        by_country = defaultdict(list)
-        for city in self.cities:
-            by_country[city['country_code']].append(city)
+        country_stats, overall = self._aggregate()
         
-        # Calculate statistics
         self.stats = {
             'total_cities': len(self.cities),
-            'total_population': sum(c['population'] for c in self.cities),
-            'countries': {}
+            'total_population': sum(data['total_population'] for data in country_stats.values()),
+            'countries': country_stats,
+            'overall': overall
         }
+        self.stats.update(self.admin_stats)
         
-        # Country-level statistics
-        for country, cities in by_country.items():
-            populations = [c['population'] for c in cities]
-            elevations = [c['elevation'] for c in cities if c['elevation'] > 0]
-            
-            self.stats['countries'][country] = {
-                'city_count': len(cities),
-                'total_population': sum(populations),
-                'avg_population': int(np.mean(populations)) if populations else 0,
-                'median_population': int(np.median(populations)) if populations else 0,
-                'max_population': max(populations) if populations else 0,
-                'min_population': min(populations) if populations else 0,
-                'avg_elevation': int(np.mean(elevations)) if elevations else 0,
-                'max_elevation': max(elevations) if elevations else 0,
-                'largest_city': max(cities, key=lambda x: x['population'])['name'] if cities else 'N/A'
-            }
+        return self.stats
+    
+    def load_admin_codes(self, admin1_file: str = ADMIN1_FILE, admin2_file: str = ADMIN2_FILE) -> AdminCodes:
+        """Load the GeoNames admin1/admin2 code files that name the admin rollups
+        
+        Each file is parsed once per process into a hash table keyed like
+        'RO.10' and 'RO.10.123' (see dacia_admin.py). Without the files the
+        rollups are still computed, with empty names.
+        """
+        self.admin_codes = AdminCodes.load(admin1_file, admin2_file)
+        for path, table in ((admin1_file, self.admin_codes.admin1), (admin2_file, self.admin_codes.admin2)):
+            if table:
+                print(f"Loaded {len(table):,} admin codes from {path}")
+            else:
+                print(f"No admin codes in {path}, admin rollups will be unnamed")
+        return self.admin_codes
+    
+    @timed('stats')
+    def calculate_statistics_streaming(self, csv_files=None, chunk_size: int = 100000,
+                                       exact_limit: int = DEFAULT_EXACT_LIMIT, workers: int = 1):
+        """Calculate statistics without loading the cities into memory
+        
+        Each CSV file (default: self.csv_file) is streamed into a mergeable
+        accumulator, in parallel processes when workers > 1, and the
+        accumulators are merged in file order. Shards of one dataset, e.g.
+        the per-country CSV files, give the same result as their
+        concatenation. Medians come from a quantile sketch that stays exact
+        up to exact_limit values; every median is followed by a
+        median_population_error entry bounding its rank error as a fraction
+        of the city count (0.0 when exact). Apart from those entries the
+        result matches calculate_statistics when exact.
+        """
+        csv_files = list(csv_files or [self.csv_file])
+        print(f"\nCalculating streaming statistics over {len(csv_files)} file(s)...")
+        
+        if workers > 1 and len(csv_files) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                parts = list(executor.map(accumulate_csv, csv_files,
+                                          [chunk_size] * len(csv_files), [exact_limit] * len(csv_files)))
+        else:
+            parts = [accumulate_csv(csv_file, chunk_size, exact_limit) for csv_file in csv_files]
+        
+        accumulator = parts[0]
+        for part in parts[1:]:
+            accumulator.merge(part)
+        
+        self.stats = accumulator.to_statistics()
+        self.metrics.add_rows('stats', self.stats['total_cities'])
+        self.population_buckets = {label: int(count) for label, count
+                                   in zip(POPULATION_CATEGORIES, accumulator.bucket_counts)}
+        return self.stats
+    
+    @timed('stats')
+    def update_statistics(self, countries):
+        """Recompute the statistics of the given countries only
+        
+        self.stats must hold the previous statistics (e.g. loaded from
+        statistics.json) and self.cities the updated cities. Countries that
+        are not listed keep their previous entry; totals and the overall
+        figures are recomputed from self.cities, and so are the admin rollups.
+        """
+        print(f"\nUpdating statistics for {', '.join(sorted(countries)) or 'no countries'}...")
+        
+        computed, overall = self._aggregate()
+        
+        previous = self.stats.get('countries', {})
+        country_stats = {}
+        for country, data in computed.items():
+            if country in countries or country not in previous:
+                country_stats[country] = data
+            else:
+                country_stats[country] = previous[country]
         
-        # Overall statistics
-        all_populations = [c['population'] for c in self.cities]
-        all_elevations = [c['elevation'] for c in self.cities if c['elevation'] > 0]
-        
-        self.stats['overall'] = {
-            'avg_population': int(np.mean(all_populations)) if all_populations else 0,
-            'median_population': int(np.median(all_populations)) if all_populations else 0,
-            'avg_elevation': int(np.mean(all_elevations)) if all_elevations else 0,
-            'max_elevation': max(all_elevations) if all_elevations else 0,
-            'cities_over_100k': sum(1 for c in self.cities if c['population'] > 100000),
-            'cities_over_50k': sum(1 for c in self.cities if c['population'] > 50000),
-            'cities_over_10k': sum(1 for c in self.cities if c['population'] > 10000),
+        self.stats = {
+            'total_cities': sum(data['city_count'] for data in country_stats.values()),
+            'total_population': sum(data['total_population'] for data in country_stats.values()),
+            'countries': country_stats,
+            'overall': overall
         }
+        self.stats.update(self.admin_stats)
         
         return self.stats
     
+    def _load_columns(self) -> dict:
+        """Country and admin codes, populations and elevations of all cities as arrays"""
+        if isinstance(self.cities, CityStore):
+            countries = self.cities.country_codes()
+            admin1 = self.cities.admin_codes('admin1')
+            admin2 = self.cities.admin_codes('admin2')
+            populations = self.cities.column('population').astype(np.int64)
+            elevations = self.cities.elevations().astype(np.int64)
+        else:
+            n = len(self.cities)
+            countries = np.array([c['country_code'] for c in self.cities], dtype=str)
+            # CSV files written before the admin columns existed have none
+            admin1 = np.array([c.get('admin1_code') or '' for c in self.cities], dtype=str)
+            admin2 = np.array([c.get('admin2_code') or '' for c in self.cities], dtype=str)
+            populations = np.fromiter((c['population'] for c in self.cities), dtype=np.int64, count=n)
+            elevations = np.fromiter((c['elevation'] for c in self.cities), dtype=np.int64, count=n)
+        
+        codes, groups = factorize(countries)
+        self.columns = {
+            'codes': codes,
+            'groups': groups,
+            'admin1': admin1,
+            'admin2': admin2,
+            'population': populations,
+            'elevation': elevations,
+        }
+        self.ranked_index = RankedIndex.from_columns(populations, groups, codes, self.cities)
+        return self.columns
+    
+    def top_cities(self, k: int = 20, country: str = None, min_population: int = None) -> list:
+        """The k most populous cities, largest first, ties in input order
+        
+        Optionally only those of one country and with at least min_population
+        people. Read from the ranked index (see dacia_ranking.py), which
+        keeps the top DEFAULT_TOP_K cities overall and per country; a larger
+        k rebuilds it with that many.
+        """
+        if self.ranked_index is None:
+            self._load_columns()
+        if k > self.ranked_index.k:
+            columns = self.columns
+            self.ranked_index = RankedIndex.from_columns(columns['population'], columns['groups'],
+                                                         columns['codes'], self.cities, k)
+        return self.ranked_index.top(k, country, min_population)
+    
+    def _aggregate(self):
+        """Per-country and overall statistics in one vectorized pass
+        
+        Countries are factorized in order of first appearance. One lexsort
+        by (country, population, row descending) puts every country's
+        populations in a contiguous sorted run, so counts, sums, min, max and
+        medians are read off the run boundaries. The largest city (first row
+        with the maximum) comes from the ranked index built with the
+        columns. The population buckets for the size histogram are kept in
+        self.population_buckets, and the admin1/admin2 rollups, which reuse
+        the same grouping and order, in self.admin_stats.
+        """
+        columns = self._load_columns()
+        self.metrics.add_rows('stats', len(columns['population']))
+        codes, groups = columns['codes'], columns['groups']
+        populations, elevations = columns['population'], columns['elevation']
+        n, n_groups = len(populations), len(codes)
+        
+        order = np.lexsort((-np.arange(n), populations, groups))
+        sorted_pops = populations[order]
+        counts = np.bincount(groups, minlength=n_groups)
+        ends = np.cumsum(counts)
+        starts = ends - counts
+        totals = np.add.reduceat(sorted_pops, starts) if n else np.zeros(0, dtype=np.int64)
+        
+        # Elevation figures only use positive values, as 0 means unknown
+        positive = elevations > 0
+        elevation_counts = np.bincount(groups[positive], minlength=n_groups)
+        elevation_sums = np.bincount(groups[positive], weights=elevations[positive], minlength=n_groups)
+        elevation_max = np.zeros(n_groups, dtype=np.int64)
+        np.maximum.at(elevation_max, groups[positive], elevations[positive])
+        
+        country_stats = {}
+        for g, country in enumerate(codes):
+            start, end = starts[g], ends[g]
+            country_stats[str(country)] = {
+                'city_count': int(counts[g]),
+                'total_population': int(totals[g]),
+                'avg_population': int(totals[g] / counts[g]),
+                'median_population': _sorted_median(sorted_pops[start:end]),
+                'max_population': int(sorted_pops[end - 1]),
+                'min_population': int(sorted_pops[start]),
+                'avg_elevation': int(elevation_sums[g] / elevation_counts[g]) if elevation_counts[g] else 0,
+                'max_elevation': int(elevation_max[g]),
+                'largest_city': self.ranked_index.largest(str(country))['name']
+            }
+        
+        all_pops = np.sort(populations)
+        total_elevation_count = int(elevation_counts.sum())
+        
+        # Threshold counts and histogram buckets from the sorted populations
+        over = n - np.searchsorted(all_pops, [100000, 50000, 10000], side='right')
+        edges = np.searchsorted(all_pops, [bounds[0] for bounds in POPULATION_CATEGORIES.values()] + [np.inf])
+        self.population_buckets = {label: int(edges[i + 1] - edges[i])
+                                   for i, label in enumerate(POPULATION_CATEGORIES)}
+        
+        overall = {
+            'avg_population': int(all_pops.sum() / n) if n else 0,
+            'median_population': _sorted_median(all_pops),
+            'avg_elevation': int(elevation_sums.sum() / total_elevation_count) if total_elevation_count else 0,
+            'max_elevation': int(elevation_max.max()) if total_elevation_count else 0,
+            'cities_over_100k': int(over[0]),
+            'cities_over_50k': int(over[1]),
+            'cities_over_10k': int(over[2]),
+        }
+        
+        self.admin_stats = self._aggregate_admin(columns, order)
+        
+        return country_stats, overall
+    
+    def _aggregate_admin(self, columns: dict, order: np.ndarray) -> dict:
+        """admin1 and admin2 rollups from the country grouping of _aggregate
+        
+        Each level's codes are factorized and combined with the parent
+        level's group into one integer key, so a level costs a factorize of
+        integers and a few bincounts. Admin divisions nest in countries, so
+        the last row of a division in order (country, population ascending,
+        row descending) is its largest city. Entries are keyed like GeoNames
+        ('RO.10', 'RO.10.123') and named from self.admin_codes when loaded.
+        Returns {} when no city has an admin1 code.
+        """
+        admin1, admin2 = columns['admin1'], columns['admin2']
+        if not np.any(admin1 != ''):
+            return {}
+        
+        codes, populations = columns['codes'], columns['population']
+        n = len(populations)
+        # Position of every row in the sorted order
+        rank = np.empty(n, dtype=np.int64)
+        rank[order] = np.arange(n)
+        names = self.admin_codes or AdminCodes()
+        
+        rollups = {}
+        parent = columns['groups']
+        for level, values in (('admin1', admin1), ('admin2', admin2)):
+            level_codes, code_ids = factorize(values)
+            _, groups = factorize(parent * len(level_codes) + code_ids)
+            n_groups = int(groups.max()) + 1 if n else 0
+            counts = np.bincount(groups, minlength=n_groups)
+            # Integer weights are summed exactly as floats below 2**53
+            totals = np.rint(np.bincount(groups, weights=populations, minlength=n_groups)).astype(np.int64)
+            last = np.full(n_groups, -1, dtype=np.int64)
+            np.maximum.at(last, groups, rank)
+            largest = order[last]
+            
+            # Per-group values as lists: indexing NumPy scalars per group is slow
+            countries = codes[columns['groups'][largest]].tolist()
+            codes1, codes2 = admin1[largest].tolist(), admin2[largest].tolist()
+            counts, totals = counts.tolist(), totals.tolist()
+            max_populations = populations[largest].tolist()
+            entries = {}
+            for g, row in enumerate(largest.tolist()):
+                if level == 'admin1':
+                    key = admin1_key(countries[g], codes1[g])
+                    entry = {'country_code': countries[g], 'admin1_code': codes1[g]}
+                else:
+                    key = admin2_key(countries[g], codes1[g], codes2[g])
+                    entry = {'country_code': countries[g], 'admin1_code': codes1[g], 'admin2_code': codes2[g]}
+                entry.update({
+                    'name': names.name(level, key),
+                    'city_count': counts[g],
+                    'total_population': totals[g],
+                    'avg_population': int(totals[g] / counts[g]),
+                    'max_population': max_populations[g],
+                    'largest_city': self.cities[row]['name'],
+                })
+                entries[key] = entry
+            rollups[level] = entries
+            parent = groups
+        
+        return rollups
+    
+    def _coordinate_columns(self):
+        """Longitudes, latitudes and populations of all cities as arrays"""
+        if isinstance(self.cities, CityStore):
+            return (self.cities.column('longitude'), self.cities.column('latitude'),
+                    self.cities.column('population').astype(np.int64))
+        n = len(self.cities)
+        return (np.fromiter((c['longitude'] for c in self.cities), dtype=np.float64, count=n),
+                np.fromiter((c['latitude'] for c in self.cities), dtype=np.float64, count=n),
+                np.fromiter((c['population'] for c in self.cities), dtype=np.int64, count=n))
+    
+    @timed('density')
+    def calculate_density_grid(self, resolution: float = DEFAULT_RESOLUTION, shape: str = 'square',
+                               polygon_file: str = 'dacia_border.txt') -> DensityGrid:
+        """Bin settlements and population onto a grid clipped to the Dacia polygon
+        
+        shape is 'square' (lat/lon cells of resolution degrees) or 'hex'
+        (hexagons resolution degrees wide); see dacia_density.py. Every
+        city is binned in one vectorized scatter-add; each cell's coverage
+        is the share of its area inside the polygon, which the density per
+        km² accounts for. With polygon_file=None the grid covers the cities
+        and is not clipped.
+        """
+        print(f"\nBinning cities onto a {shape} grid of {resolution} degrees...")
+        
+        if polygon_file:
+            self._load_region_polygon(polygon_file)
+        
+        lons, lats, populations = self._coordinate_columns()
+        self.density_grid = bin_cities(lons, lats, populations, resolution, shape, self.region_polygon)
+        self.metrics.add_rows('density', len(lons))
+        
+        summary = self.density_grid.summary()
+        print(f"  {summary['rows']} x {summary['columns']} cells, {summary['cells_inside']:,} in the region, "
+              f"{summary['occupied_cells']:,} with settlements")
+        if summary['points_outside']:
+            print(f"  {summary['points_outside']:,} cities fall outside the grid")
+        return self.density_grid
+    
+    def _load_region_polygon(self, polygon_file: str):
+        """Read the border polygon into self.region_polygon"""
+        # Imported here: only the density and border stages need the polygon and shapely
+        from shapely.geometry import Polygon
+        from filter_dacia_cities import DaciaCityFilter
+        self.region_polygon = Polygon(DaciaCityFilter(polygon_file, '')._read_polygon_coords(polygon_file))
+        return self.region_polygon
+    
+    @timed('stats')
+    def calculate_border_statistics(self, polygon_file: str = 'dacia_border.txt', bands=DEFAULT_BORDER_BANDS):
+        """Add distance-to-border figures to the statistics
+        
+        Every city's great-circle distance to the polygon boundary is
+        computed in one vectorized pass (see dacia_border_distance.py) and
+        kept in self.border_distances. Cities and population per band
+        (bands are the upper band edges in km) are counted with the same
+        country grouping as calculate_statistics, which must run first.
+        """
+        print(f"\nCalculating border distances from {polygon_file}...")
+        
+        lons, lats, populations = self._coordinate_columns()
+        index = BorderDistanceIndex.from_polygon(self._load_region_polygon(polygon_file))
+        distances = index.distances_km(lons, lats)
+        self.border_distances = distances
+        
+        columns = self.columns or self._load_columns()
+        groups, n_groups = columns['groups'], len(columns['codes'])
+        labels = band_labels(bands)
+        n_bands = len(labels)
+        cells = groups * n_bands + band_indices(distances, bands)
+        counts = np.bincount(cells, minlength=n_groups * n_bands).reshape(n_groups, n_bands)
+        band_pops = np.bincount(cells, weights=populations, minlength=n_groups * n_bands).reshape(n_groups, n_bands)
+        distance_sums = np.bincount(groups, weights=distances, minlength=n_groups)
+        
+        for g, country in enumerate(columns['codes']):
+            data = self.stats['countries'][str(country)]
+            data['avg_border_distance_km'] = round(float(distance_sums[g] / data['city_count']), 1)
+            data['border_bands'] = {label: int(count) for label, count in zip(labels, counts[g])}
+        
+        n = len(distances)
+        self.stats['border'] = {
+            'bands_km': [float(band) for band in bands],
+            'cities': {label: int(count) for label, count in zip(labels, counts.sum(axis=0))},
+            'population': {label: int(round(pop)) for label, pop in zip(labels, band_pops.sum(axis=0))},
+            'avg_distance_km': round(float(distances.sum() / n), 1) if n else 0.0,
+            'max_distance_km': round(float(distances.max()), 1) if n else 0.0,
+        }
+        
+        for label in labels:
+            print(f"  {label:>12s}: {self.stats['border']['cities'][label]:,} cities")
+        return distances
+    
+    def save_density_grid(self, output_file='density_grid.npz'):
+        """Save the density grid arrays (see DensityGrid.save)"""
+        self.density_grid.save(output_file)
+        print(f"Density grid saved to: {output_file}")
+    
+    def create_density_heatmap(self, output_file='heatmap_population_density.png', value='density_per_km2'):
+        """Create heatmap of the density grid; value is a key of DENSITY_VALUES"""
+        print(f"Creating heatmap: {output_file}")
+        
+        plt = pyplot()
+        from matplotlib.collections import PolyCollection
+        from matplotlib.colors import LogNorm
+        
+        grid = self.density_grid
+        inside = grid.inside
+        values = grid.to_arrays()[value][inside].astype(np.float64)
+        positive = values[values > 0]
+        
+        # Log scale: populations span several orders of magnitude
+        cmap = plt.get_cmap('YlOrRd').copy()
+        cmap.set_bad('#f2f2f2')
+        norm = LogNorm(vmin=positive.min(), vmax=positive.max()) if len(positive) else None
+        cells = PolyCollection(grid.cell_vertices()[inside], cmap=cmap, norm=norm, edgecolors='none')
+        cells.set_array(np.ma.masked_less_equal(values, 0))
+        
+        fig, ax = plt.subplots(figsize=(12, 9))
+        ax.add_collection(cells)
+        if self.region_polygon is not None:
+            x, y = self.region_polygon.exterior.xy
+            ax.plot(x, y, color='black', linewidth=1)
+        ax.autoscale_view()
+        ax.set_aspect(1 / np.cos(np.radians(grid.reference_lat)))
+        fig.colorbar(cells, ax=ax, label=DENSITY_VALUES[value], shrink=0.8)
+        
+        ax.set_xlabel('Longitude', fontsize=12, fontweight='bold')
+        ax.set_ylabel('Latitude', fontsize=12, fontweight='bold')
+        ax.set_title(f'{DENSITY_VALUES[value]} ({grid.resolution}° {grid.shape} cells) - Dacia Region',
+                     fontsize=14, fontweight='bold')
+        plt.tight_layout()
+        plt.savefig(output_file, dpi=self.dpi, bbox_inches='tight')
+        plt.close()
+        
+        print(f"  Saved: {output_file}")
+    
     def create_pie_chart_cities_by_country(self, output_file='pie_cities_by_country.png'):
         """Create pie chart of cities distribution by country"""
+        plt = pyplot()
         print(f"Creating pie chart: {output_file}")
         
         # Count cities by country
@@ -113,13 +662,14 @@ class DaciaCitiesAnalyzer:
         plt.title('Distribution of Cities by Country\nDacia Region', fontsize=16, fontweight='bold')
         plt.axis('equal')
         plt.tight_layout()
-        plt.savefig(output_file, dpi=300, bbox_inches='tight')
+        plt.savefig(output_file, dpi=self.dpi, bbox_inches='tight')
         plt.close()
         
         print(f"  Saved: {output_file}")
     
     def create_pie_chart_population_by_country(self, output_file='pie_population_by_country.png'):
         """Create pie chart of population distribution by country"""
+        plt = pyplot()
         print(f"Creating pie chart: {output_file}")
         
         # Get population by country
@@ -141,13 +691,14 @@ class DaciaCitiesAnalyzer:
         plt.title('Distribution of Total Population by Country\nDacia Region', fontsize=16, fontweight='bold')
         plt.axis('equal')
         plt.tight_layout()
-        plt.savefig(output_file, dpi=300, bbox_inches='tight')
+        plt.savefig(output_file, dpi=self.dpi, bbox_inches='tight')
         plt.close()
         
         print(f"  Saved: {output_file}")
     
     def create_bar_chart_cities_by_country(self, output_file='bar_cities_by_country.png'):
         """Create bar chart of cities by country"""
+        plt = pyplot()
         print(f"Creating bar chart: {output_file}")
         
         # Get data
@@ -173,13 +724,14 @@ class DaciaCitiesAnalyzer:
         plt.title('Number of Cities by Country - Dacia Region', fontsize=14, fontweight='bold')
         plt.grid(axis='y', alpha=0.3)
         plt.tight_layout()
-        plt.savefig(output_file, dpi=300, bbox_inches='tight')
+        plt.savefig(output_file, dpi=self.dpi, bbox_inches='tight')
         plt.close()
         
         print(f"  Saved: {output_file}")
     
     def create_bar_chart_population_by_country(self, output_file='bar_population_by_country.png'):
         """Create bar chart of total population by country"""
+        plt = pyplot()
         print(f"Creating bar chart: {output_file}")
         
         # Get data
@@ -205,30 +757,20 @@ class DaciaCitiesAnalyzer:
         plt.title('Total Population by Country - Dacia Region', fontsize=14, fontweight='bold')
         plt.grid(axis='y', alpha=0.3)
         plt.tight_layout()
-        plt.savefig(output_file, dpi=300, bbox_inches='tight')
+        plt.savefig(output_file, dpi=self.dpi, bbox_inches='tight')
         plt.close()
         
         print(f"  Saved: {output_file}")
     
     def create_population_size_distribution(self, output_file='histogram_population_distribution.png'):
         """Create histogram of population size distribution"""
+        plt = pyplot()
         print(f"Creating histogram: {output_file}")
         
-        # Define population categories
-        categories = {
-            '< 1K': (0, 1000),
-            '1K-5K': (1000, 5000),
-            '5K-10K': (5000, 10000),
-            '10K-50K': (10000, 50000),
-            '50K-100K': (50000, 100000),
-            '100K-500K': (100000, 500000),
-            '500K+': (500000, float('inf'))
-        }
-        
-        # Count cities in each category
-        counts = {}
-        for label, (min_pop, max_pop) in categories.items():
-            counts[label] = sum(1 for c in self.cities if min_pop <= c['population'] < max_pop)
+        # Cities per population category, counted by calculate_statistics
+        if self.population_buckets is None:
+            self._aggregate()
+        counts = self.population_buckets
         
         # Create bar chart
         plt.figure(figsize=(12, 6))
@@ -250,19 +792,21 @@ class DaciaCitiesAnalyzer:
         plt.xticks(rotation=45)
         plt.grid(axis='y', alpha=0.3)
         plt.tight_layout()
-        plt.savefig(output_file, dpi=300, bbox_inches='tight')
+        plt.savefig(output_file, dpi=self.dpi, bbox_inches='tight')
         plt.close()
         
         print(f"  Saved: {output_file}")
     
     def create_elevation_distribution(self, output_file='histogram_elevation_distribution.png'):
         """Create histogram of elevation distribution"""
+        plt = pyplot()
         print(f"Creating histogram: {output_file}")
         
         # Get elevations (filter out 0 values)
-        elevations = [c['elevation'] for c in self.cities if c['elevation'] > 0]
+        columns = self.columns or self._load_columns()
+        elevations = columns['elevation'][columns['elevation'] > 0]
         
-        if not elevations:
+        if not len(elevations):
             print("  Skipped: No elevation data available")
             return
         
@@ -275,17 +819,18 @@ class DaciaCitiesAnalyzer:
         plt.title('Elevation Distribution - Dacia Region', fontsize=14, fontweight='bold')
         plt.grid(axis='y', alpha=0.3)
         plt.tight_layout()
-        plt.savefig(output_file, dpi=300, bbox_inches='tight')
+        plt.savefig(output_file, dpi=self.dpi, bbox_inches='tight')
         plt.close()
         
         print(f"  Saved: {output_file}")
     
     def create_top_cities_chart(self, top_n=20, output_file='bar_top_cities.png'):
         """Create bar chart of top N cities by population"""
+        plt = pyplot()
         print(f"Creating bar chart: {output_file}")
         
         # Get top cities
-        top_cities = sorted(self.cities, key=lambda x: x['population'], reverse=True)[:top_n]
+        top_cities = self.top_cities(top_n)
         
         # Prepare data
         names = [f"{c['name']} ({c['country_code']})" for c in top_cities]
@@ -307,13 +852,14 @@ class DaciaCitiesAnalyzer:
         plt.title(f'Top {top_n} Cities by Population - Dacia Region', fontsize=14, fontweight='bold')
         plt.grid(axis='x', alpha=0.3)
         plt.tight_layout()
-        plt.savefig(output_file, dpi=300, bbox_inches='tight')
+        plt.savefig(output_file, dpi=self.dpi, bbox_inches='tight')
         plt.close()
         
         print(f"  Saved: {output_file}")
     
     def create_avg_population_by_country(self, output_file='bar_avg_population_by_country.png'):
         """Create bar chart of average population by country"""
+        plt = pyplot()
         print(f"Creating bar chart: {output_file}")
         
         # Get data
@@ -339,11 +885,12 @@ class DaciaCitiesAnalyzer:
         plt.title('Average City Population by Country - Dacia Region', fontsize=14, fontweight='bold')
         plt.grid(axis='y', alpha=0.3)
         plt.tight_layout()
-        plt.savefig(output_file, dpi=300, bbox_inches='tight')
+        plt.savefig(output_file, dpi=self.dpi, bbox_inches='tight')
         plt.close()
         
         print(f"  Saved: {output_file}")
     
+    @timed('report')
     def save_statistics_report(self, output_file='statistics_report.txt'):
         """Save comprehensive statistics report to text file"""
         print(f"\nSaving statistics report: {output_file}")
@@ -369,6 +916,18 @@ class DaciaCitiesAnalyzer:
         report.append(f"Cities > 10K population:   {self.stats['overall']['cities_over_10k']:,}")
         report.append("")
         
+        # Distance to the border, when calculated
+        if 'border' in self.stats:
+            border = self.stats['border']
+            report.append("-"*80)
+            report.append("DISTANCE TO BORDER")
+            report.append("-"*80)
+            report.append(f"Average Distance:          {border['avg_distance_km']:,} km")
+            report.append(f"Maximum Distance:          {border['max_distance_km']:,} km")
+            for label, count in border['cities'].items():
+                report.append(f"  {label + ':':<24s} {count:,} cities, {border['population'][label]:,} people")
+            report.append("")
+        
         # Country statistics
         report.append("-"*80)
         report.append("STATISTICS BY COUNTRY")
@@ -390,6 +949,8 @@ class DaciaCitiesAnalyzer:
             report.append(f"  Average Elevation:       {data['avg_elevation']:,} meters")
             report.append(f"  Max Elevation:           {data['max_elevation']:,} meters")
             report.append(f"  Largest City:            {data['largest_city']}")
+            if 'avg_border_distance_km' in data:
+                report.append(f"  Avg Distance to Border:  {data['avg_border_distance_km']:,} km")
             
             # Calculate percentage
             pct_cities = (data['city_count'] / self.stats['total_cities']) * 100
@@ -397,6 +958,18 @@ class DaciaCitiesAnalyzer:
             report.append(f"  % of Total Cities:       {pct_cities:.1f}%")
             report.append(f"  % of Total Population:   {pct_pop:.1f}%")
         
+        # First-level divisions (judete, oblasts, megyek...), when rolled up
+        if self.stats.get('admin1'):
+            report.append("")
+            report.append("-"*80)
+            report.append("STATISTICS BY ADMIN1 DIVISION")
+            report.append("-"*80)
+            divisions = sorted(self.stats['admin1'].items(),
+                               key=lambda x: (x[1]['country_code'], -x[1]['total_population']))
+            for key, data in divisions:
+                report.append(f"{key:<8s} {data['name'][:24]:<24s} {data['city_count']:>7,} cities "
+                              f"{data['total_population']:>12,} people  Largest: {data['largest_city']}")
+        
         report.append("")
         report.append("="*80)
         
@@ -409,6 +982,7 @@ class DaciaCitiesAnalyzer:
         # Also print to console
         print('\n'.join(report))
     
+    @timed('report')
     def save_statistics_json(self, output_file='statistics.json'):
         """Save statistics as JSON"""
         print(f"\nSaving statistics JSON: {output_file}")
@@ -418,21 +992,18 @@ class DaciaCitiesAnalyzer:
         
         print(f"  Saved: {output_file}")
     
-    def generate_all_visualizations(self):
-        """Generate all visualizations and reports"""
+    def generate_all_visualizations(self, parallel: bool = False, workers: int = None, dpi: int = 300,
+                                    image_format: str = 'png', manifest_file: str = None):
+        """Generate all visualizations and reports
+        
+        The chart options are those of render_charts.
+        """
         print("\n" + "="*80)
         print("GENERATING VISUALIZATIONS AND REPORTS")
         print("="*80)
         
         # Create visualizations
-        self.create_pie_chart_cities_by_country()
-        self.create_pie_chart_population_by_country()
-        self.create_bar_chart_cities_by_country()
-        self.create_bar_chart_population_by_country()
-        self.create_avg_population_by_country()
-        self.create_population_size_distribution()
-        self.create_elevation_distribution()
-        self.create_top_cities_chart(top_n=20)
+        manifest = self.render_charts(parallel, workers, dpi, image_format, manifest_file)
         
         # Create reports
         self.save_statistics_report()
@@ -441,6 +1012,126 @@ class DaciaCitiesAnalyzer:
         print("\n" + "="*80)
         print("ALL VISUALIZATIONS AND REPORTS COMPLETED")
         print("="*80)
+        
+        return manifest
+    
+    @timed('render')
+    def render_charts(self, parallel: bool = False, workers: int = None, dpi: int = 300,
+                      image_format: str = 'png', manifest_file: str = None, output_dir: str = ''):
+        """Render every chart in CHARTS; returns the render manifest
+        
+        parallel=True renders the charts in a process pool of the given
+        number of workers. With a manifest_file, a chart is skipped when the
+        hash of its input data (and dpi/format) matches the previous render
+        recorded there and the image still exists; the manifest is then
+        rewritten with each chart's hash and render time.
+        """
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unsupported image format '{image_format}', use one of {IMAGE_FORMATS}")
+        
+        self.dpi = dpi
+        if self.population_buckets is None:
+            self._aggregate()
+        
+        previous = {}
+        if manifest_file and os.path.exists(manifest_file):
+            with open(manifest_file, 'r', encoding='utf-8') as f:
+                previous = json.load(f).get('charts', {})
+        
+        # Decide which charts need rendering
+        inputs = self._chart_inputs()
+        # Entries of other formats are kept so switching back can skip too
+        manifest = {'dpi': dpi, 'format': image_format, 'workers': workers if parallel else 1,
+                    'charts': dict(previous)}
+        pending = []
+        for method, stem, kwargs in CHARTS:
+            output_file = f"{output_dir}{stem}.{image_format}"
+            input_hash = hashlib.sha256(json.dumps([method, kwargs, inputs[method], dpi, image_format])
+                                        .encode('utf-8')).hexdigest()
+            entry = manifest['charts'][output_file] = {'method': method, 'input_hash': input_hash}
+            if (manifest_file and previous.get(output_file, {}).get('input_hash') == input_hash
+                    and os.path.exists(output_file)):
+                print(f"Unchanged, skipping: {output_file}")
+                entry.update(status='skipped', seconds=0.0)
+            else:
+                pending.append((method, output_file, kwargs))
+        
+        # Render
+        start = time.perf_counter()
+        if parallel and len(pending) > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_render_worker,
+                                     initargs=(self._render_snapshot(),)) as executor:
+                timings = list(executor.map(_render_chart, pending))
+        else:
+            timings = [_render_chart(job, self) for job in pending]
+        for (method, output_file, kwargs), seconds in zip(pending, timings):
+            manifest['charts'][output_file].update(status='rendered', seconds=round(seconds, 4))
+        self.metrics.count('charts_rendered', len(pending))
+        self.metrics.count('charts_skipped', len(CHARTS) - len(pending))
+        manifest['total_seconds'] = round(time.perf_counter() - start, 4)
+        print(f"Rendered {len(pending)} of {len(CHARTS)} charts in {manifest['total_seconds']:.2f}s")
+        
+        if manifest_file:
+            with open(manifest_file, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=2)
+        
+        return manifest
+    
+    def _chart_inputs(self, top_n: int = 20) -> dict:
+        """The data each chart is drawn from, for change detection"""
+        countries = self.stats['countries']
+        columns = self.columns or self._load_columns()
+        elevations = columns['elevation'][columns['elevation'] > 0]
+        return {
+            'create_pie_chart_cities_by_country': {c: d['city_count'] for c, d in countries.items()},
+            'create_pie_chart_population_by_country': {c: d['total_population'] for c, d in countries.items()},
+            'create_bar_chart_cities_by_country': {c: d['city_count'] for c, d in countries.items()},
+            'create_bar_chart_population_by_country': {c: d['total_population'] for c, d in countries.items()},
+            'create_avg_population_by_country': {c: d['avg_population'] for c, d in countries.items()},
+            'create_population_size_distribution': self.population_buckets,
+            'create_elevation_distribution': hashlib.sha256(elevations.astype(np.int64).tobytes()).hexdigest(),
+            'create_top_cities_chart': [(c['name'], c['country_code'], int(c['population']))
+                                        for c in self.top_cities(top_n)],
+        }
+    
+    def _render_snapshot(self, top_n: int = 20) -> 'DaciaCitiesAnalyzer':
+        """Minimal copy of this analyzer holding just what the charts read
+        
+        Sent once to each render worker instead of the full city list: the
+        statistics, the population buckets, the positive elevations and the
+        top cities.
+        """
+        snapshot = DaciaCitiesAnalyzer(self.csv_file)
+        snapshot.stats = self.stats
+        snapshot.population_buckets = self.population_buckets
+        snapshot.dpi = self.dpi
+        
+        columns = self.columns or self._load_columns()
+        top = [{'name': c['name'], 'country_code': c['country_code'], 'population': int(c['population'])}
+               for c in self.top_cities(top_n)]
+        snapshot.ranked_index = RankedIndex.from_cities(top, max(top_n, 1))
+        snapshot.columns = {
+            'elevation': columns['elevation'][columns['elevation'] > 0],
+        }
+        return snapshot
+
+
+# Analyzer snapshot of the current render worker process
+_render_analyzer = None
+
+
+def _init_render_worker(analyzer: DaciaCitiesAnalyzer):
+    """Process pool initializer: keep the analyzer snapshot for all jobs"""
+    global _render_analyzer
+    _render_analyzer = analyzer
+
+
+def _render_chart(job, analyzer: DaciaCitiesAnalyzer = None) -> float:
+    """Render one (method, output_file, kwargs) chart job; returns seconds"""
+    method, output_file, kwargs = job
+    start = time.perf_counter()
+    getattr(analyzer or _render_analyzer, method)(output_file=output_file, **kwargs)
+    return time.perf_counter() - start
 
 
 def main():
@@ -458,11 +1149,22 @@ def main():
     # Load data
     analyzer.load_data()
     
-    # Calculate statistics
+    # Calculate statistics, with admin1/admin2 rollups named from the
+    # GeoNames code files when present
+    analyzer.load_admin_codes()
     analyzer.calculate_statistics()
+    analyzer.calculate_border_statistics()
     
     # Generate all visualizations and reports
     analyzer.generate_all_visualizations()
+    
+    # Population density grid and heatmap
+    analyzer.calculate_density_grid()
+    analyzer.save_density_grid()
+    analyzer.create_density_heatmap()
+    
+    # Stage timings and counters
+    analyzer.metrics.write_json('analyzer_metrics.json')
 
 
 if __name__ == '__main__':
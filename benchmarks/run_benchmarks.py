@@ -0,0 +1,222 @@
+"""
+Benchmark suite for the Dacia cities filter and analyzer
+Times each stage on synthetic GeoNames files (scan, parse, containment,
+rules, write, load, stats, render, and the columnar write and load) and
+saves rows/sec and peak RSS as JSON so runs can be compared across commits
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Benchmark sizes: name -> rows
+SIZES = {'10k': 10_000, '1m': 1_000_000, '12m': 12_000_000}
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far, in MB"""
+    from dacia_metrics import peak_rss
+
+    return round(peak_rss() / (1024 * 1024), 1)
+
+
+def git_commit() -> str:
+    """Current commit of the repository, if available"""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def data_file(size: str, seed: int) -> str:
+    """Path of the synthetic input for a size, generated on first use"""
+    from synthetic_geonames import GENERATOR_VERSION, generate
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    path = os.path.join(DATA_DIR, f"geonames_{size}_seed{seed}_v{GENERATOR_VERSION}.txt")
+    if not os.path.exists(path):
+        print(f"Generating {SIZES[size]:,} rows into {path}...", file=sys.stderr)
+        generate(path + '.tmp', SIZES[size], seed)
+        os.replace(path + '.tmp', path)
+    return path
+
+
+class StageTimer:
+    """Collects wall time, rows/sec and peak RSS per stage"""
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name: str, seconds: float, rows: int):
+        """Add the time and rows of one (partial) run of a stage"""
+        stage = self.stages.setdefault(name, {'seconds': 0.0, 'rows': 0})
+        stage['seconds'] += seconds
+        stage['rows'] += rows
+        stage['rows_per_sec'] = round(stage['rows'] / stage['seconds']) if stage['seconds'] > 0 else None
+        stage['peak_rss_mb'] = peak_rss_mb()
+
+    def run(self, name: str, rows_of, func, *args, **kwargs):
+        """Time func(*args, **kwargs); rows_of(result) gives the rows processed"""
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.add(name, time.perf_counter() - start, rows_of(result))
+        return result
+
+    def report(self):
+        """Print the stages and round the timings"""
+        for name, stage in self.stages.items():
+            stage['seconds'] = round(stage['seconds'], 4)
+            print(f"  {name:<16} {stage['seconds']:8.3f}s  {stage['rows_per_sec'] or 0:>12,} rows/s",
+                  file=sys.stderr)
+
+
+def city_rows(cities) -> list:
+    """(geonameid, population) of each city, in order"""
+    return [(int(city['geonameid']), int(city['population'])) for city in cities]
+
+
+def check_same_rows(mode: str, expected: list, actual: list):
+    """Fail the benchmark when a filter mode kept different rows"""
+    if actual != expected:
+        missing = len(set(expected) - set(actual))
+        extra = len(set(actual) - set(expected))
+        raise RuntimeError(f"{mode} kept {len(actual):,} rows instead of {len(expected):,} "
+                           f"({missing:,} missing, {extra:,} extra)")
+
+
+def benchmark_size(size: str, seed: int, dpi: int, chunk_size: int = 100000) -> dict:
+    """Run every stage on one input size in this process
+
+    Parse, containment and rules run chunk by chunk like filter_cities_batch
+    so only the kept cities are held in memory; their times are summed.
+    """
+    import contextlib
+    import io
+    from itertools import islice
+    import numpy as np
+    from filter_dacia_cities import DaciaCityFilter
+    from analyze_dacia_cities import DaciaCitiesAnalyzer
+    from dacia_readers import iter_line_chunks
+    from dacia_columnar import columnar_path
+
+    cities_file = data_file(size, seed)
+    polygon_file = os.path.join(ROOT, 'dacia_border.txt')
+    rules_file = os.path.join(ROOT, 'dacia_rules.json')
+    timer = StageTimer()
+    quiet = contextlib.redirect_stdout(io.StringIO())
+
+    with tempfile.TemporaryDirectory() as out_dir, quiet:
+        out_dir += os.sep
+        filter_obj = DaciaCityFilter(polygon_file, cities_file, rules_file=rules_file)
+        filter_obj.load_polygon()
+        # Mapped byte scan: line splitting and coordinates, nothing decoded
+        timer.run('scan', lambda n: n, lambda: sum(len(chunk) for chunk in iter_line_chunks(cities_file, chunk_size)))
+        counts = filter_obj.rules.new_counts()
+        kept = []
+
+        with open(cities_file, 'r', encoding='utf-8') as f:
+            while True:
+                lines = list(islice(f, chunk_size))
+                if not lines:
+                    break
+
+                start = time.perf_counter()
+                cities = [city for city in map(filter_obj.parse_city_line, lines) if city is not None]
+                timer.add('parse', time.perf_counter() - start, len(lines))
+
+                start = time.perf_counter()
+                lons = np.fromiter((c['longitude'] for c in cities), dtype=np.float64, count=len(cities))
+                lats = np.fromiter((c['latitude'] for c in cities), dtype=np.float64, count=len(cities))
+                inside = filter_obj.grid_index.contains_xy(lons, lats)
+                contained = [city for city, keep in zip(cities, inside) if keep]
+                timer.add('containment', time.perf_counter() - start, len(cities))
+
+                start = time.perf_counter()
+                kept.extend(city for city in contained if filter_obj.rules.apply(city, counts))
+                timer.add('rules', time.perf_counter() - start, len(contained))
+
+        filter_obj.cities_in_polygon = kept
+        timer.run('border_distance', len, filter_obj.calculate_border_distances)
+        output_file = out_dir + 'dacia_cities_all.csv'
+        timer.run('write', lambda _: len(kept), filter_obj.write_outputs, output_file, out_dir)
+        # Under its own name, so the CSV load below does not pick it up
+        typed_file = out_dir + 'typed.csv'
+        timer.run('write_columnar', lambda _: len(kept), filter_obj.save_columnar, typed_file)
+        n_kept = len(kept)
+        kept_rows = city_rows(kept)
+        del filter_obj, kept
+
+        # The production path end to end, for comparison with the stages above
+        batch_filter = DaciaCityFilter(polygon_file, cities_file, rules_file=rules_file)
+        batch_filter.load_polygon()
+        batch = timer.run('filter_batch', lambda _: SIZES[size], batch_filter.filter_cities_batch)
+        # Untimed: the array rules and the compact store must keep the same
+        # rows as the per-row rules above
+        check_same_rows('filter_batch', kept_rows, city_rows(batch))
+        check_same_rows('filter_batch compact', kept_rows,
+                        city_rows(batch_filter.filter_cities_batch(compact=True)))
+        del batch_filter, batch
+
+        analyzer = DaciaCitiesAnalyzer(output_file)
+        timer.run('load', lambda _: len(analyzer.cities), analyzer.load_data)
+        typed = DaciaCitiesAnalyzer(columnar_path(typed_file))
+        timer.run('load_columnar', lambda _: len(typed.cities), typed.load_data, compact=True)
+        del typed
+        timer.run('stats', lambda _: len(analyzer.cities), analyzer.calculate_statistics)
+        timer.run('render', lambda _: len(analyzer.cities), analyzer.render_charts,
+                  dpi=dpi, output_dir=out_dir)
+
+    timer.report()
+    return {'rows': SIZES[size], 'kept': n_kept, 'stages': timer.stages}
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Benchmark the Dacia cities pipeline")
+    parser.add_argument('--sizes', nargs='+', default=['10k', '1m'], choices=list(SIZES))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--dpi', type=int, default=300)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--single', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        # Child process: one size, so peak RSS is not shared between sizes
+        print(json.dumps(benchmark_size(args.single, args.seed, args.dpi)))
+        return
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'dpi': args.dpi,
+        'sizes': {},
+    }
+    for size in args.sizes:
+        print(f"Benchmarking {size} ({SIZES[size]:,} rows)...", file=sys.stderr)
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), '--single', size,
+                                '--seed', str(args.seed), '--dpi', str(args.dpi)],
+                               capture_output=True, text=True, check=True)
+        sys.stderr.write(child.stderr)
+        results['sizes'][size] = json.loads(child.stdout.strip().splitlines()[-1])
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved benchmark results to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Deterministic synthetic GeoNames generator
+Writes cities500-format TSV files whose points cluster around urban centers
+inside and around the Dacia border, so containment, rules and output see a
+realistic mix of inside, outside and boundary rows
+"""
+
+import os
+import sys
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Rough country anchors (lon, lat): each row takes the nearest one's code
+COUNTRY_ANCHORS = {
+    'RO': (25.0, 45.9), 'MD': (28.5, 47.2), 'UA': (29.5, 48.8), 'HU': (19.5, 47.2),
+    'RS': (20.8, 44.1), 'BG': (25.2, 42.8), 'SK': (19.7, 48.7), 'HR': (16.4, 45.4),
+    'SI': (14.8, 46.1), 'PL': (21.0, 50.5), 'AT': (15.5, 47.6),
+}
+
+FEATURE_CODES = np.array(['PPL', 'PPL', 'PPL', 'PPL', 'PPLA2', 'PPLA', 'PPLC'])
+
+# Share of rows scattered uniformly instead of around a center
+BACKGROUND_SHARE = 0.2
+
+# Share of malformed rows (bad coordinates or too few fields)
+MALFORMED_SHARE = 0.001
+
+# Bumped whenever the generated rows change, so cached files are regenerated
+GENERATOR_VERSION = 2
+
+
+def generate(output_file: str, rows: int, seed: int = 42, polygon_file: str = None,
+             chunk_size: int = 500000):
+    """Write rows synthetic GeoNames lines to output_file
+
+    The same rows, seed and polygon always give the same bytes.
+    """
+    polygon_file = polygon_file or os.path.join(ROOT, 'dacia_border.txt')
+    from filter_dacia_cities import DaciaCityFilter
+
+    coords = DaciaCityFilter(polygon_file, '')._read_polygon_coords(polygon_file)
+    lons = [lon for lon, lat in coords]
+    lats = [lat for lon, lat in coords]
+    # Area around the border, 25% wider on every side
+    pad_lon, pad_lat = (max(lons) - min(lons)) * 0.25, (max(lats) - min(lats)) * 0.25
+    bounds = (min(lons) - pad_lon, min(lats) - pad_lat, max(lons) + pad_lon, max(lats) + pad_lat)
+
+    rng = np.random.default_rng(seed)
+    n_centers = 2000
+    centers = np.column_stack([rng.uniform(bounds[0], bounds[2], n_centers),
+                               rng.uniform(bounds[1], bounds[3], n_centers)])
+    weights = rng.pareto(1.2, n_centers) + 1
+    weights /= weights.sum()
+
+    codes = np.array(list(COUNTRY_ANCHORS))
+    anchors = np.array(list(COUNTRY_ANCHORS.values()))
+
+    with open(output_file, 'w', encoding='utf-8', newline='\n') as f:
+        for start in range(0, rows, chunk_size):
+            n = min(chunk_size, rows - start)
+            ids = np.arange(start, start + n)
+
+            # Points around weighted centers, plus uniform background
+            center = rng.choice(n_centers, n, p=weights)
+            lon = centers[center, 0] + rng.normal(0, 0.25, n)
+            lat = centers[center, 1] + rng.normal(0, 0.18, n)
+            background = rng.random(n) < BACKGROUND_SHARE
+            lon[background] = rng.uniform(bounds[0], bounds[2], background.sum())
+            lat[background] = rng.uniform(bounds[1], bounds[3], background.sum())
+
+            distance = (lon[:, None] - anchors[None, :, 0]) ** 2 + (lat[:, None] - anchors[None, :, 1]) ** 2
+            country = codes[np.argmin(distance, axis=1)]
+
+            # Heavy-tailed populations, many small places
+            population = np.minimum(rng.pareto(1.1, n) * 400, 3_000_000).astype(np.int64)
+            population[rng.random(n) < 0.05] = 0
+            elevation = rng.integers(-10, 2200, n)
+            has_elevation = rng.random(n) < 0.7
+            feature = FEATURE_CODES[rng.integers(0, len(FEATURE_CODES), n)]
+            sector = rng.random(n) < 0.005
+            malformed = rng.random(n)
+
+            lines = []
+            for i in range(n):
+                gid = 1000000 + ids[i]
+                if sector[i]:
+                    # 'İstanbul Sector' gets longer when lowercased, which the
+                    # name rules must not trip over
+                    name = 'İstanbul Sector' if ids[i] % 2 == 0 else f"Sector {ids[i] % 6 + 1}"
+                else:
+                    name = f"Town{gid}"
+                fields = [str(gid), name, name, f"{name} Alt,{name}-Nou", f"{lat[i]:.5f}", f"{lon[i]:.5f}",
+                          'P', feature[i], country[i], '', f"{ids[i] % 42 + 1:02d}", str(ids[i] % 900 + 1),
+                          '', '', str(population[i]), str(elevation[i]) if has_elevation[i] else '',
+                          str(max(elevation[i], 0)), 'Europe/Bucharest', '2024-01-01']
+                if malformed[i] < MALFORMED_SHARE / 2:
+                    fields[4] = 'n/a'
+                elif malformed[i] < MALFORMED_SHARE:
+                    fields = fields[:12]
+                lines.append('\t'.join(fields))
+            f.write('\n'.join(lines))
+            f.write('\n')
+
+
+def main():
+    """Main function"""
+    if len(sys.argv) < 3:
+        print("Usage: python synthetic_geonames.py <output_file> <rows> [seed]")
+        sys.exit(1)
+    generate(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]) if len(sys.argv) > 3 else 42)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+GeoNames admin1/admin2 division names for the filtered cities
+Reads admin1CodesASCII.txt and admin2Codes.txt once per process into dict
+hash tables keyed like GeoNames ('RO.10', 'RO.10.123'), so rollups only look
+up the names of their group keys
+"""
+
+import os
+from typing import Dict, Tuple
+
+ADMIN1_FILE = 'admin1CodesASCII.txt'
+ADMIN2_FILE = 'admin2Codes.txt'
+
+# Parsed tables by path, with the (size, mtime) they were read at
+_TABLES: Dict[str, Tuple[Tuple[int, int], Dict[str, str]]] = {}
+
+
+def admin1_key(country_code: str, admin1_code: str) -> str:
+    """GeoNames key of an admin1 division, e.g. 'RO.10'"""
+    return f"{country_code}.{admin1_code}"
+
+
+def admin2_key(country_code: str, admin1_code: str, admin2_code: str) -> str:
+    """GeoNames key of an admin2 division, e.g. 'RO.10.123'"""
+    return f"{country_code}.{admin1_code}.{admin2_code}"
+
+
+def read_code_table(path: str) -> Dict[str, str]:
+    """code -> name of a GeoNames admin code file, {} when it does not exist
+
+    Lines are code, name, ascii name and geonameid separated by tabs. A
+    file is parsed once; later calls reuse the table while its size and
+    mtime are unchanged.
+    """
+    if not os.path.exists(path):
+        return {}
+    stat = os.stat(path)
+    signature = (stat.st_size, stat.st_mtime_ns)
+    cached = _TABLES.get(path)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    table = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) >= 2 and fields[0]:
+                table[fields[0]] = fields[1]
+    _TABLES[path] = (signature, table)
+    return table
+
+
+class AdminCodes:
+    """Names of admin1 and admin2 divisions by GeoNames key"""
+
+    def __init__(self, admin1: Dict[str, str] = None, admin2: Dict[str, str] = None):
+        self.admin1 = admin1 or {}
+        self.admin2 = admin2 or {}
+
+    @classmethod
+    def load(cls, admin1_file: str = ADMIN1_FILE, admin2_file: str = ADMIN2_FILE) -> 'AdminCodes':
+        """Tables of the given files; a missing file gives an empty table"""
+        return cls(read_code_table(admin1_file), read_code_table(admin2_file))
+
+    def name(self, level: str, key: str) -> str:
+        """Name of the 'admin1' or 'admin2' division with the given key, '' when unknown"""
+        return (self.admin1 if level == 'admin1' else self.admin2).get(key, '')
@@ -0,0 +1,180 @@
+"""
+Distance from each city to the border of the Dacia polygon
+Treats every polygon edge as a great-circle arc and computes exact spherical
+point-to-arc distances for whole coordinate arrays at once; a grid index over
+the edges limits each point to the few edges that can be nearest to it
+"""
+
+from typing import Iterable, List, Sequence, Tuple
+import numpy as np
+
+# Mean Earth radius in km, as in dacia_spatial_index
+EARTH_RADIUS_KM = 6371.0088
+
+# Upper edges of the border bands in km; the last band is open-ended
+DEFAULT_BORDER_BANDS = (10.0, 25.0, 50.0)
+
+# Cell size of the edge index in degrees
+DEFAULT_CELL_DEG = 0.1
+
+# Points converted to distances per NumPy pass
+DEFAULT_CHUNK_SIZE = 100000
+
+
+def unit_vectors(lons, lats) -> np.ndarray:
+    """(n, 3) unit vectors of points given in degrees"""
+    lon = np.radians(np.asarray(lons, dtype=np.float64))
+    lat = np.radians(np.asarray(lats, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def _angle_from_dot(dot: np.ndarray) -> np.ndarray:
+    """Angle between unit vectors from their dot product, through the chord length"""
+    return 2 * np.arcsin(np.sqrt(np.clip(2 - 2 * dot, 0.0, 4.0)) / 2)
+
+
+def band_labels(bands: Sequence[float] = DEFAULT_BORDER_BANDS) -> List[str]:
+    """Labels of the bands delimited by bands, e.g. '0-10 km' ... '50+ km'"""
+    edges = [0] + list(bands)
+    labels = [f"{_format_km(low)}-{_format_km(high)} km" for low, high in zip(edges, edges[1:])]
+    return labels + [f"{_format_km(edges[-1])}+ km"]
+
+
+def _format_km(value: float) -> str:
+    return f"{value:g}"
+
+
+def band_indices(distances: np.ndarray, bands: Sequence[float] = DEFAULT_BORDER_BANDS) -> np.ndarray:
+    """Index into band_labels(bands) of every distance; a band includes its lower edge"""
+    return np.searchsorted(np.asarray(bands, dtype=np.float64), distances, side='right')
+
+
+class BorderDistanceIndex:
+    """Great-circle distance from points to the edges of a polygon
+
+    A point's nearest point on an edge is its projection onto the edge's
+    great circle when that falls between the end points, and the nearer end
+    point otherwise. Both follow from the dot products of the point with
+    five vectors per edge, so a group of points is compared with a group of
+    edges in one matrix product.
+
+    The index covers the polygon's bounds with cells of cell_deg degrees.
+    For every cell it keeps the edges whose distance from the cell centre,
+    minus the cell's radius, is at most the smallest such distance plus the
+    radius: by the triangle inequality only those can be nearest to a point
+    in the cell. Points off the grid are compared with every edge.
+    """
+
+    def __init__(self, rings: Iterable[Sequence[Tuple[float, float]]], cell_deg: float = DEFAULT_CELL_DEG):
+        starts, ends = [], []
+        for ring in rings:
+            ring = np.asarray(ring, dtype=np.float64)
+            if len(ring) < 2:
+                continue
+            if not np.array_equal(ring[0], ring[-1]):
+                ring = np.vstack([ring, ring[:1]])
+            starts.append(ring[:-1])
+            ends.append(ring[1:])
+        if not starts:
+            raise ValueError("The polygon has no edges")
+        starts, ends = np.concatenate(starts), np.concatenate(ends)
+
+        self.cell_deg = float(cell_deg)
+        self.bounds = (starts[:, 0].min(), starts[:, 1].min(), starts[:, 0].max(), starts[:, 1].max())
+        a = unit_vectors(starts[:, 0], starts[:, 1])
+        b = unit_vectors(ends[:, 0], ends[:, 1])
+        normal = np.cross(a, b)
+        length = np.linalg.norm(normal, axis=1, keepdims=True)
+        # Zero-length edges have no great circle: only their end points count
+        self._has_circle = length[:, 0] > 0
+        normal = np.divide(normal, length, out=np.zeros_like(normal), where=length > 0)
+        # p . (n x a) >= 0 and p . (b x n) >= 0 when p projects inside the arc
+        self._vectors = np.stack([a, b, normal, np.cross(normal, a), np.cross(b, normal)])
+        self._build_cells()
+
+    @classmethod
+    def from_polygon(cls, polygon, cell_deg: float = DEFAULT_CELL_DEG) -> 'BorderDistanceIndex':
+        """Index over the exterior and interior rings of a shapely Polygon"""
+        rings = [polygon.exterior.coords] + [interior.coords for interior in polygon.interiors]
+        return cls(rings, cell_deg)
+
+    def __len__(self) -> int:
+        """Number of edges"""
+        return self._vectors.shape[1]
+
+    def _build_cells(self):
+        min_lon, min_lat, max_lon, max_lat = self.bounds
+        self.n_rows = int(np.floor((max_lat - min_lat) / self.cell_deg)) + 1
+        self.n_cols = int(np.floor((max_lon - min_lon) / self.cell_deg)) + 1
+        rows, cols = np.indices((self.n_rows, self.n_cols)).reshape(2, -1)
+        center_lon = min_lon + (cols + 0.5) * self.cell_deg
+        center_lat = min_lat + (rows + 0.5) * self.cell_deg
+
+        # Radius: the farthest corner, with a margin for rounding
+        half = self.cell_deg / 2
+        centers = unit_vectors(center_lon, center_lat)
+        radius = np.zeros(len(centers))
+        for d_lon, d_lat in ((-half, -half), (-half, half), (half, -half), (half, half)):
+            corner = unit_vectors(center_lon + d_lon, center_lat + d_lat)
+            radius = np.maximum(radius, _angle_from_dot(np.einsum('ij,ij->i', centers, corner)))
+        radius = radius * (1 + 1e-6) + 1e-9
+
+        all_edges = np.arange(len(self))
+        candidates = []
+        for start in range(0, len(centers), 4096):
+            distances = self._distances(centers[start:start + 4096], all_edges)
+            r = radius[start:start + 4096, None]
+            candidates.append(distances - r <= (distances + r).min(axis=1, keepdims=True))
+        candidates = np.concatenate(candidates)
+
+        # Edges of cell c are _cell_edges[_cell_starts[c]:_cell_starts[c + 1]]
+        cells, edges = np.nonzero(candidates)
+        self._cell_edges = edges
+        self._cell_starts = np.searchsorted(cells, np.arange(len(centers) + 1))
+
+    def _distances(self, points: np.ndarray, edges: np.ndarray) -> np.ndarray:
+        """(n, k) angular distances of points (n, 3) to the edges with the given indices"""
+        vectors = self._vectors[:, edges].reshape(-1, 3)
+        dots = (points @ vectors.T).reshape(len(points), 5, len(edges))
+        p_a, p_b, p_normal, p_after_a, p_before_b = (dots[:, i] for i in range(5))
+        inside = (p_after_a >= 0) & (p_before_b >= 0) & self._has_circle[edges]
+        to_circle = np.arcsin(np.minimum(np.abs(p_normal), 1.0))
+        to_ends = _angle_from_dot(np.maximum(p_a, p_b))
+        return np.where(inside, to_circle, to_ends)
+
+    def cell_indices(self, lons: np.ndarray, lats: np.ndarray) -> np.ndarray:
+        """Flat cell of every point, -1 for points off the grid"""
+        rows = np.floor((lats - self.bounds[1]) / self.cell_deg).astype(np.int64)
+        cols = np.floor((lons - self.bounds[0]) / self.cell_deg).astype(np.int64)
+        on_grid = (rows >= 0) & (rows < self.n_rows) & (cols >= 0) & (cols < self.n_cols)
+        return np.where(on_grid, rows * self.n_cols + cols, -1)
+
+    def distances_km(self, lons, lats, chunk_size: int = DEFAULT_CHUNK_SIZE) -> np.ndarray:
+        """Distance in km from every point to the nearest edge
+
+        Points are grouped by cell and each group is compared with its
+        cell's edges only.
+        """
+        lons = np.asarray(lons, dtype=np.float64)
+        lats = np.asarray(lats, dtype=np.float64)
+        points = unit_vectors(lons, lats)
+        angles = np.empty(len(lons), dtype=np.float64)
+
+        cells = self.cell_indices(lons, lats)
+        order = np.argsort(cells, kind='stable')
+        sorted_cells = cells[order]
+        first = np.searchsorted(sorted_cells, 0)
+        groups, group_starts = np.unique(sorted_cells[first:], return_index=True)
+        group_stops = np.append(group_starts[1:], len(order) - first)
+        for cell, start, stop in zip(groups, group_starts + first, group_stops + first):
+            rows = order[start:stop]
+            edges = self._cell_edges[self._cell_starts[cell]:self._cell_starts[cell + 1]]
+            angles[rows] = self._distances(points[rows], edges).min(axis=1)
+
+        # Off the grid: every edge
+        all_edges = np.arange(len(self))
+        for start in range(0, first, chunk_size):
+            rows = order[start:min(start + chunk_size, first)]
+            angles[rows] = self._distances(points[rows], all_edges).min(axis=1)
+        return angles * EARTH_RADIUS_KM
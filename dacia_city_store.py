@@ -0,0 +1,246 @@
+"""
+Compact columnar storage for filtered cities
+Keeps only the output columns in typed arrays, with interned country and
+admin codes and a shared string table for names, instead of one dict per city
+"""
+
+import csv
+from array import array
+from typing import Dict, Iterable, Iterator, List
+import numpy as np
+from dacia_streaming import CSV_FIELDNAMES
+
+# Sentinel stored for cities without an elevation value
+ELEVATION_MISSING = np.iinfo(np.int32).min
+
+
+class StringTable:
+    """Interned strings addressed by a small integer index"""
+
+    def __init__(self):
+        self.strings = []
+        self._index = {}
+
+    @classmethod
+    def from_strings(cls, strings: List[str]) -> 'StringTable':
+        """Table of distinct strings, indexed by position"""
+        table = cls()
+        table.strings = list(strings)
+        table._index = {value: i for i, value in enumerate(table.strings)}
+        return table
+
+    def intern(self, value: str) -> int:
+        """Return the index of value, adding it on first use"""
+        index = self._index.get(value)
+        if index is None:
+            index = self._index[value] = len(self.strings)
+            self.strings.append(value)
+        return index
+
+    def __getitem__(self, index: int) -> str:
+        return self.strings[index]
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+
+class CityStore:
+    """Array-backed store of the city fields that are written to CSV
+
+    Rows are appended into typed arrays (about 54 bytes per city plus the
+    unique name strings). The store behaves like a read-only sequence of
+    city dicts, so code written for cities_in_polygon or the analyzer's
+    cities list keeps working; the dicts are built on access only.
+    """
+
+    def __init__(self, missing_elevation=''):
+        # Value used for the elevation of rows without one: '' matches the
+        # raw GeoNames field written by the filter, 0 matches the analyzer
+        self.missing_elevation = missing_elevation
+        self.names = StringTable()
+        self.country_table = StringTable()
+        # admin1 and admin2 codes share one table
+        self.admin_table = StringTable()
+        self._geonameid = array('q')
+        self._name = array('I')
+        self._asciiname = array('I')
+        self._country = array('H')
+        self._latitude = array('d')
+        self._longitude = array('d')
+        self._population = array('q')
+        self._elevation = array('i')
+        self._admin1 = array('I')
+        self._admin2 = array('I')
+
+    @classmethod
+    def from_cities(cls, cities: Iterable[Dict], missing_elevation='') -> 'CityStore':
+        """Build a store from city dicts (parsed lines or CSV rows)"""
+        store = cls(missing_elevation)
+        for city in cities:
+            store.append_city(city)
+        return store
+
+    @classmethod
+    def from_csv(cls, csv_file: str, missing_elevation=0) -> 'CityStore':
+        """Load a dacia_cities CSV file, converting fields like the analyzer"""
+        store = cls(missing_elevation)
+        with open(csv_file, 'r', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                try:
+                    store.append(row['geonameid'], row['name'], row['asciiname'], row['country_code'],
+                                 float(row['latitude']), float(row['longitude']),
+                                 int(row['population']) if row['population'] else 0,
+                                 row['elevation'], row.get('admin1_code', ''), row.get('admin2_code', ''))
+                except (ValueError, KeyError):
+                    continue
+        return store
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, np.ndarray], names: List[str], country_codes: List[str],
+                     missing_elevation='', admin_codes: List[str] = None) -> 'CityStore':
+        """Build a store from arrays laid out like column()
+
+        names, country_codes and admin_codes are the string tables the
+        name/asciiname, country and admin1/admin2 columns index into.
+        """
+        store = cls(missing_elevation)
+        store.names = StringTable.from_strings(names)
+        store.country_table = StringTable.from_strings(country_codes)
+        store.admin_table = StringTable.from_strings(admin_codes or [])
+        for name, values in columns.items():
+            typecode = getattr(store, '_' + name).typecode
+            setattr(store, '_' + name, array(typecode, np.ascontiguousarray(values, dtype=typecode).tobytes()))
+        return store
+
+    def append(self, geonameid, name: str, asciiname: str, country_code: str,
+               latitude: float, longitude: float, population: int, elevation,
+               admin1_code: str = '', admin2_code: str = ''):
+        """Append one city; elevation may be an int, a numeric string or empty"""
+        # Convert everything first so a bad value leaves the store unchanged
+        geonameid = int(geonameid)
+        elevation = int(elevation) if elevation not in ('', None) else ELEVATION_MISSING
+
+        self._geonameid.append(geonameid)
+        self._name.append(self.names.intern(name))
+        self._asciiname.append(self.names.intern(asciiname))
+        self._country.append(self.country_table.intern(country_code))
+        self._latitude.append(latitude)
+        self._longitude.append(longitude)
+        self._population.append(population)
+        self._elevation.append(elevation)
+        self._admin1.append(self.admin_table.intern(admin1_code))
+        self._admin2.append(self.admin_table.intern(admin2_code))
+
+    def append_city(self, city: Dict):
+        """Append a city dict"""
+        self.append(city['geonameid'], city['name'], city['asciiname'], city['country_code'],
+                    city['latitude'], city['longitude'], city['population'], city['elevation'],
+                    city.get('admin1_code', ''), city.get('admin2_code', ''))
+
+    def take(self, indices: Iterable[int], missing_elevation=None) -> 'CityStore':
+        """New store holding the given rows in that order
+
+        The string tables are shared with this store, the columns copied.
+        """
+        store = CityStore(self.missing_elevation if missing_elevation is None else missing_elevation)
+        store.names = self.names
+        store.country_table = self.country_table
+        store.admin_table = self.admin_table
+        indices = np.asarray(indices, dtype=np.int64)
+        for name in ('geonameid', 'name', 'asciiname', 'country', 'latitude', 'longitude',
+                     'population', 'elevation', 'admin1', 'admin2'):
+            data = getattr(self, '_' + name)
+            setattr(store, '_' + name, array(data.typecode, self.column(name)[indices].tobytes()))
+        return store
+
+    def __len__(self) -> int:
+        return len(self._geonameid)
+
+    def __getitem__(self, index: int) -> Dict:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("CityStore index out of range")
+        return self.row(index)
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(len(self)):
+            yield self.row(i)
+
+    def row(self, i: int) -> Dict:
+        """Materialize row i as a city dict"""
+        elevation = self._elevation[i]
+        return {
+            'geonameid': str(self._geonameid[i]),
+            'name': self.names[self._name[i]],
+            'asciiname': self.names[self._asciiname[i]],
+            'country_code': self.country_table[self._country[i]],
+            'latitude': self._latitude[i],
+            'longitude': self._longitude[i],
+            'population': self._population[i],
+            'elevation': self.missing_elevation if elevation == ELEVATION_MISSING else elevation,
+            'admin1_code': self.admin_table[self._admin1[i]],
+            'admin2_code': self.admin_table[self._admin2[i]],
+        }
+
+    def column(self, name: str) -> np.ndarray:
+        """Zero-copy NumPy view of a column
+
+        name is one of geonameid, name, asciiname, country (code indices),
+        latitude, longitude, population, elevation, admin1 or admin2 (code
+        indices).
+        """
+        data = getattr(self, '_' + name)
+        return np.frombuffer(data, dtype=data.typecode) if len(data) else np.array([], dtype=data.typecode)
+
+    def country_codes(self) -> np.ndarray:
+        """Country code of every row as a string array"""
+        table = np.array(self.country_table.strings or [''])
+        return table[self.column('country')]
+
+    def admin_codes(self, level: str) -> np.ndarray:
+        """admin1 or admin2 code of every row as a string array"""
+        table = np.array(self.admin_table.strings or [''])
+        return table[self.column(level)]
+
+    def elevations(self) -> np.ndarray:
+        """Elevation of every row with missing values as 0"""
+        elevation = self.column('elevation')
+        return np.where(elevation == ELEVATION_MISSING, 0, elevation)
+
+    def sorted_indices(self) -> np.ndarray:
+        """Row order by country code, then population descending (stable)"""
+        # Rank of every interned code in alphabetical order
+        ranks = np.argsort(np.argsort(np.array(self.country_table.strings or [''])))
+        return np.lexsort((-self.column('population'), ranks[self.column('country')]))
+
+    def indices_by_country(self) -> Dict[str, np.ndarray]:
+        """Row indices of each country, in order of first appearance"""
+        country = self.column('country')
+        order = np.argsort(country, kind='stable')
+        counts = np.bincount(country, minlength=len(self.country_table))
+        groups = np.split(order, np.cumsum(counts)[:-1])
+        first_seen = sorted(range(len(self.country_table)),
+                            key=lambda c: groups[c][0] if len(groups[c]) else len(country))
+        return {self.country_table[c]: groups[c] for c in first_seen if len(groups[c])}
+
+    def write_csv(self, output_file: str, indices: Iterable[int] = None):
+        """Write rows (all, or the given indices in order) as a CSV file"""
+        if indices is None:
+            indices = range(len(self))
+        with open(output_file, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_FIELDNAMES)
+            for i in indices:
+                row = self.row(int(i))
+                writer.writerow([row[field] for field in CSV_FIELDNAMES])
+
+    def nbytes(self) -> int:
+        """Approximate memory used by the columns and string tables"""
+        columns = (self._geonameid, self._name, self._asciiname, self._country,
+                   self._latitude, self._longitude, self._population, self._elevation,
+                   self._admin1, self._admin2)
+        size = sum(c.itemsize * len(c) for c in columns)
+        size += sum(len(s.encode('utf-8')) + 49 for s in self.names.strings + self.admin_table.strings)
+        return size
@@ -0,0 +1,329 @@
+"""
+Command line interface for the Dacia cities workflow
+One entry point with filter, stats, charts, summary, top and query subcommands
+and configurable paths. Each subcommand imports only the modules it needs:
+summary and top use the standard library alone, stats and query load NumPy,
+only charts loads matplotlib and only filter loads shapely
+"""
+
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+from typing import Dict, List
+
+# Libraries whose import dominates start-up, reported by --profile-startup
+HEAVY_LIBRARIES = ('numpy', 'shapely', 'matplotlib', 'pyarrow')
+
+# Modules each subcommand imports before it runs, in order
+COMMAND_MODULES = {
+    'filter': ['filter_dacia_cities'],
+    'stats': ['analyze_dacia_cities'],
+    'charts': ['analyze_dacia_cities', 'matplotlib.pyplot'],
+    'summary': ['dacia_streaming'],
+    'top': ['dacia_ranking'],
+    'query': ['dacia_spatial_index'],
+}
+
+FILTER_MODES = ('batch', 'compact', 'streaming', 'parallel', 'cached')
+
+# Border band edges in km, as dacia_border_distance.DEFAULT_BORDER_BANDS
+DEFAULT_BORDER_BANDS = [10.0, 25.0, 50.0]
+
+_START = time.perf_counter()
+
+
+def _load_pyplot():
+    # Through the analyzer, which selects the non-interactive backend first
+    from analyze_dacia_cities import pyplot
+    return pyplot()
+
+
+# Modules that need more than a plain import
+_LOADERS = {'matplotlib.pyplot': _load_pyplot}
+
+
+class StartupProfile:
+    """Time spent importing the modules of a subcommand"""
+
+    def __init__(self):
+        # (module, seconds, number of modules the import loaded)
+        self.imports = []
+
+    def load(self, name: str):
+        """Import a module and record how long it took"""
+        loaded = len(sys.modules)
+        start = time.perf_counter()
+        module = _LOADERS[name]() if name in _LOADERS else importlib.import_module(name)
+        self.imports.append((name, time.perf_counter() - start, len(sys.modules) - loaded))
+        return module
+
+    def render(self, command: str) -> str:
+        """Format the import times and the heavy libraries now loaded"""
+        lines = [f"Startup profile ({command}):"]
+        for name, seconds, modules in self.imports:
+            lines.append(f"  import {name:<24s} {seconds:7.3f}s  ({modules} modules)")
+        heavy = [name for name in HEAVY_LIBRARIES if name in sys.modules]
+        lines.append(f"  heavy libraries loaded:       {', '.join(heavy) or 'none'}")
+        lines.append(f"  ready after                 {time.perf_counter() - _START:7.3f}s")
+        return "\n".join(lines)
+
+
+def _output_prefix(output_dir: str) -> str:
+    """Create output_dir and return it as the file name prefix the writers expect"""
+    if not output_dir:
+        return ''
+    os.makedirs(output_dir, exist_ok=True)
+    return os.path.join(output_dir, '')
+
+
+def run_filter(args, modules: Dict):
+    """Filter the cities file and write the CSV (and columnar) outputs"""
+    filter_dacia_cities = modules['filter_dacia_cities']
+    cities_file = args.cities
+    if cities_file is None:
+        cities_file = 'cities500/cities500.txt'
+        if not os.path.exists(cities_file) and os.path.exists('cities500.zip'):
+            # Read straight from the downloaded archive
+            cities_file = 'cities500.zip'
+
+    filter_obj = filter_dacia_cities.DaciaCityFilter(args.polygon, cities_file, rules_file=args.rules or None,
+                                                     quiet=args.quiet)
+    filter_obj.load_polygon()
+
+    output_dir = _output_prefix(args.output_dir)
+    border_bands = None if args.no_border_distance else args.border_bands
+    if args.mode == 'streaming':
+        summary = filter_obj.filter_cities_streaming(args.output, output_dir, chunk_size=args.chunk_size,
+                                                     border_bands=border_bands)
+    else:
+        if args.mode == 'parallel':
+            filter_obj.filter_cities_parallel(workers=args.workers, chunk_size=args.chunk_size)
+        elif args.mode == 'cached':
+            filter_obj.filter_cities_cached(chunk_size=args.chunk_size)
+        else:
+            filter_obj.filter_cities_batch(chunk_size=args.chunk_size, compact=args.mode == 'compact')
+        if border_bands is not None:
+            filter_obj.calculate_border_distances(border_bands)
+        summary = filter_obj.write_outputs(args.output, output_dir, threads=args.workers or 1,
+                                           columnar=not args.no_columnar)
+
+    print(filter_obj.generate_summary(summary))
+    if args.metrics:
+        filter_obj.metrics.write_json(args.metrics)
+
+
+def _load_analyzer(args, modules: Dict, admin_codes: bool = False):
+    """Analyzer over args.csv with its statistics calculated"""
+    analyzer = modules['analyze_dacia_cities'].DaciaCitiesAnalyzer(args.csv)
+    analyzer.load_data(compact=args.compact)
+    if admin_codes:
+        analyzer.load_admin_codes(args.admin1_codes, args.admin2_codes)
+    analyzer.calculate_statistics()
+    return analyzer
+
+
+def run_stats(args, modules: Dict):
+    """Calculate the statistics and write the JSON and text reports"""
+    if args.streaming:
+        analyzer = modules['analyze_dacia_cities'].DaciaCitiesAnalyzer(args.csv)
+        analyzer.calculate_statistics_streaming(args.shards or None, workers=args.workers or 1)
+    else:
+        analyzer = _load_analyzer(args, modules, admin_codes=True)
+        if not args.no_border_distance:
+            analyzer.calculate_border_statistics(args.polygon, args.border_bands)
+
+    analyzer.save_statistics_json(args.json)
+    if args.report:
+        analyzer.save_statistics_report(args.report)
+    if args.metrics:
+        analyzer.metrics.write_json(args.metrics)
+
+
+def run_charts(args, modules: Dict):
+    """Render the charts, and optionally the density grid and heatmap"""
+    analyzer = _load_analyzer(args, modules)
+    output_dir = _output_prefix(args.output_dir)
+
+    analyzer.render_charts(parallel=args.workers is not None, workers=args.workers, dpi=args.dpi,
+                           image_format=args.format, manifest_file=args.manifest, output_dir=output_dir)
+    if args.density:
+        analyzer.calculate_density_grid(args.resolution, args.shape, args.polygon)
+        analyzer.save_density_grid(f"{output_dir}density_grid.npz")
+        analyzer.create_density_heatmap(f"{output_dir}heatmap_population_density.{args.format}")
+    if args.metrics:
+        analyzer.metrics.write_json(args.metrics)
+
+
+def run_summary(args, modules: Dict):
+    """Print the filter summary report from the combined CSV"""
+    import csv
+
+    summary = modules['dacia_streaming'].CitySummary(args.top)
+    with open(args.csv, 'r', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            row['population'] = int(row['population']) if row['population'] else 0
+            summary.add(row)
+    print(summary.render())
+
+
+def run_top(args, modules: Dict):
+    """Print the most populous cities, overall or of one country"""
+    import csv
+
+    index = modules['dacia_ranking'].RankedIndex(args.top)
+    with open(args.csv, 'r', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            row['population'] = int(row['population']) if row['population'] else 0
+            index.add(row)
+
+    cities = index.top(args.top, args.country, args.min_population)
+    if args.json:
+        print(json.dumps(cities, indent=2, ensure_ascii=False))
+        return
+    for i, city in enumerate(cities, 1):
+        print(f"{i:3d}. {city['name']:30s} ({city['country_code']}) - Pop: {city['population']:,}")
+
+
+def run_query(args, modules: Dict):
+    """Print the cities within a radius of, or nearest to, a point"""
+    CitySpatialIndex = modules['dacia_spatial_index'].CitySpatialIndex
+    if args.index and os.path.exists(args.index):
+        index = CitySpatialIndex.load(args.index)
+    else:
+        index = CitySpatialIndex.from_csv(args.csv)
+        if args.index:
+            index.save(args.index)
+
+    if args.radius is not None:
+        results = index.radius(args.lat, args.lon, args.radius, args.min_population, args.country)
+    else:
+        results = index.nearest(args.lat, args.lon, args.nearest, args.min_population, args.country)
+    if args.limit:
+        results = results[:args.limit]
+
+    if args.json:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+        return
+    for city in results:
+        print(f"{city['distance_km']:8.2f} km  {city['name']:30s} ({city['country_code']}) "
+              f"- Pop: {city['population']:,}")
+    print(f"{len(results):,} cities")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Argument parser with one subparser per command"""
+    parser = argparse.ArgumentParser(description="Dacia cities workflow")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="report the time spent importing each module to stderr "
+                             "(python -X importtime gives a per-module breakdown)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    filter_parser = commands.add_parser('filter', help="filter the cities inside the border polygon")
+    filter_parser.add_argument('--polygon', default='dacia_border.txt', help="border polygon (.txt or .json)")
+    filter_parser.add_argument('--cities', default=None,
+                               help="GeoNames file, plain or .zip/.gz/.zst "
+                                    "(default: cities500/cities500.txt, else cities500.zip)")
+    filter_parser.add_argument('--rules', default='dacia_rules.json', help="rules file, '' for the built-in rules")
+    filter_parser.add_argument('--output', default='dacia_cities_all.csv', help="combined CSV file")
+    filter_parser.add_argument('--output-dir', default='', help="directory of the country CSV files")
+    filter_parser.add_argument('--mode', choices=FILTER_MODES, default='batch')
+    filter_parser.add_argument('--chunk-size', type=int, default=100000)
+    filter_parser.add_argument('--workers', type=int, default=None,
+                               help="processes of the parallel mode, threads writing the country files")
+    filter_parser.add_argument('--no-columnar', action='store_true', help="skip the typed columnar copy")
+    filter_parser.add_argument('--metrics', default='filter_metrics.json', help="metrics JSON file, '' to skip")
+    filter_parser.add_argument('--quiet', action='store_true', help="no progress lines while filtering")
+    filter_parser.add_argument('--border-bands', type=float, nargs='+', default=DEFAULT_BORDER_BANDS,
+                               help="upper edges of the border distance bands in km")
+    filter_parser.add_argument('--no-border-distance', action='store_true',
+                               help="write the CSVs without the border distance columns")
+    filter_parser.set_defaults(run=run_filter)
+
+    stats_parser = commands.add_parser('stats', help="calculate statistics without drawing charts")
+    stats_parser.add_argument('--csv', default='dacia_cities_all.csv')
+    stats_parser.add_argument('--json', default='statistics.json')
+    stats_parser.add_argument('--report', default='statistics_report.txt', help="text report, '' to skip")
+    stats_parser.add_argument('--compact', action='store_true', help="load the cities into a CityStore")
+    stats_parser.add_argument('--streaming', action='store_true', help="stream the CSV instead of loading it")
+    stats_parser.add_argument('--shards', nargs='*', help="CSV shards of the streaming mode")
+    stats_parser.add_argument('--workers', type=int, default=None, help="processes of the streaming mode")
+    stats_parser.add_argument('--metrics', default=None, help="metrics JSON file")
+    stats_parser.add_argument('--polygon', default='dacia_border.txt', help="border polygon for the distances")
+    stats_parser.add_argument('--border-bands', type=float, nargs='+', default=DEFAULT_BORDER_BANDS,
+                              help="upper edges of the border distance bands in km")
+    stats_parser.add_argument('--no-border-distance', action='store_true',
+                              help="skip the distance to border figures (implied by --streaming)")
+    stats_parser.add_argument('--admin1-codes', default='admin1CodesASCII.txt',
+                              help="GeoNames admin1 names for the admin rollups (not with --streaming)")
+    stats_parser.add_argument('--admin2-codes', default='admin2Codes.txt',
+                              help="GeoNames admin2 names for the admin rollups")
+    stats_parser.set_defaults(run=run_stats)
+
+    charts_parser = commands.add_parser('charts', help="render the charts")
+    charts_parser.add_argument('--csv', default='dacia_cities_all.csv')
+    charts_parser.add_argument('--output-dir', default='')
+    charts_parser.add_argument('--format', choices=('png', 'svg'), default='png')
+    charts_parser.add_argument('--dpi', type=int, default=300)
+    charts_parser.add_argument('--workers', type=int, default=None, help="render on a process pool")
+    charts_parser.add_argument('--manifest', default=None, help="skip charts whose inputs are unchanged")
+    charts_parser.add_argument('--compact', action='store_true', help="load the cities into a CityStore")
+    charts_parser.add_argument('--density', action='store_true', help="also write the density grid and heatmap")
+    charts_parser.add_argument('--polygon', default='dacia_border.txt')
+    charts_parser.add_argument('--resolution', type=float, default=0.1, help="density cell size in degrees")
+    charts_parser.add_argument('--shape', choices=('square', 'hex'), default='square')
+    charts_parser.add_argument('--metrics', default=None, help="metrics JSON file")
+    charts_parser.set_defaults(run=run_charts)
+
+    summary_parser = commands.add_parser('summary', help="print the summary report of the filtered cities")
+    summary_parser.add_argument('--csv', default='dacia_cities_all.csv')
+    summary_parser.add_argument('--top', type=int, default=20, help="number of top cities listed")
+    summary_parser.set_defaults(run=run_summary)
+
+    top_parser = commands.add_parser('top', help="most populous cities, overall or of one country")
+    top_parser.add_argument('--csv', default='dacia_cities_all.csv')
+    top_parser.add_argument('-k', '--top', type=int, default=20, help="number of cities listed")
+    top_parser.add_argument('--country', default=None, help="only cities of this country code")
+    top_parser.add_argument('--min-population', type=int, default=None)
+    top_parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    top_parser.set_defaults(run=run_top)
+
+    query_parser = commands.add_parser('query', help="cities near a point")
+    query_parser.add_argument('lat', type=float)
+    query_parser.add_argument('lon', type=float)
+    search = query_parser.add_mutually_exclusive_group(required=True)
+    search.add_argument('--radius', type=float, help="cities within this many km")
+    search.add_argument('--nearest', type=int, help="this many nearest cities")
+    query_parser.add_argument('--csv', default='dacia_cities_all.csv')
+    query_parser.add_argument('--index', default=None,
+                              help="saved spatial index (.npz); built from the CSV and saved if missing")
+    query_parser.add_argument('--min-population', type=int, default=None)
+    query_parser.add_argument('--country', action='append', default=None, help="repeat for several countries")
+    query_parser.add_argument('--limit', type=int, default=None)
+    query_parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    query_parser.set_defaults(run=run_query)
+
+    return parser
+
+
+def main(argv: List[str] = None):
+    """Main function"""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'filter' and args.mode == 'compact' and not args.no_border_distance:
+        parser.error("--mode compact keeps no city dicts for the border distances, add --no-border-distance")
+    if args.command == 'top' and args.top < 1:
+        parser.error("--top must be at least 1")
+
+    profile = StartupProfile()
+    modules = {name: profile.load(name) for name in COMMAND_MODULES[args.command]}
+    if args.profile_startup:
+        print(profile.render(args.command), file=sys.stderr)
+
+    args.run(args, modules)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,287 @@
+"""
+Typed columnar output for the filtered cities
+Writes the cities of dacia_cities_all.csv with their types intact, sorted by
+country with one row group per country, as Parquet when pyarrow is installed
+and otherwise as a directory of memory-mappable NumPy arrays
+
+NumPy layout (<name>.columns/):
+    geonameid.npy   int64     one value per row
+    latitude.npy    float64
+    longitude.npy   float64
+    population.npy  int64
+    elevation.npy   int32     ELEVATION_MISSING (-2**31) for no elevation
+    country.npy     uint16    index into meta['countries']
+    name.npy        uint32    index into the string table
+    asciiname.npy   uint32    index into the string table
+    admin1.npy      uint32    index into meta['admin_codes']
+    admin2.npy      uint32    index into meta['admin_codes']
+    strings.npy     uint8     the string table: UTF-8 strings, each followed by a NUL
+    offsets.npy     int64     start of every string in strings.npy, plus the end
+    meta.json       version, rows, countries, admin_codes, row_groups and the
+                    source CSV fingerprint; written last, so it marks a
+                    complete output
+
+Rows are in the order of dacia_cities_all.csv (country code, then population
+descending); row_groups lists {country, start, stop} so one country is a
+slice of every column. The Parquet file has the same columns (name and
+asciiname as strings, country_code, admin1_code and admin2_code
+dictionary-encoded, nullable elevation), one row group per country and the
+same meta under the 'dacia' key of the schema metadata.
+"""
+
+import json
+import os
+import shutil
+from typing import Dict, List, Optional
+import numpy as np
+from dacia_city_store import CityStore, ELEVATION_MISSING
+
+# Bump when the layout changes
+COLUMNAR_VERSION = 2
+
+COLUMNAR_FORMATS = ('parquet', 'npy')
+
+# Typed columns of the NumPy layout
+NUMERIC_COLUMNS = {
+    'geonameid': np.int64,
+    'latitude': np.float64,
+    'longitude': np.float64,
+    'population': np.int64,
+    'elevation': np.int32,
+    'country': np.uint16,
+    'name': np.uint32,
+    'asciiname': np.uint32,
+    'admin1': np.uint32,
+    'admin2': np.uint32,
+}
+
+
+def pyarrow_available() -> bool:
+    """Whether Parquet output is possible"""
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def columnar_path(csv_file: str, fmt: str = None) -> str:
+    """Columnar output path next to a CSV file, for the given or default format"""
+    fmt = fmt or ('parquet' if pyarrow_available() else 'npy')
+    if fmt not in COLUMNAR_FORMATS:
+        raise ValueError(f"Unknown columnar format {fmt!r}, expected one of {COLUMNAR_FORMATS}")
+    base = os.path.splitext(csv_file)[0]
+    return base + ('.parquet' if fmt == 'parquet' else '.columns')
+
+
+def write_columnar(store: CityStore, output_path: str, source_file: str = None) -> List[str]:
+    """Write a CityStore in the columnar layout; returns the files written
+
+    The format follows the path: .parquet needs pyarrow, anything else is a
+    NumPy layout directory. Rows are sorted like dacia_cities_all.csv. With
+    source_file (the CSV written from the same cities), readers can tell
+    when the CSV has changed since and the columnar copy is stale.
+    """
+    store = store.take(store.sorted_indices())
+    countries = store.country_codes()
+    boundaries = np.flatnonzero(countries[1:] != countries[:-1]) + 1
+    starts = np.concatenate([[0], boundaries]) if len(store) else np.array([], dtype=np.int64)
+    stops = np.append(starts[1:], len(store))
+    meta = {
+        'version': COLUMNAR_VERSION,
+        'rows': len(store),
+        'countries': list(store.country_table.strings),
+        'admin_codes': list(store.admin_table.strings),
+        'row_groups': [{'country': str(countries[start]), 'start': int(start), 'stop': int(stop)}
+                       for start, stop in zip(starts, stops)],
+        'source': _source_fingerprint(source_file) if source_file else None,
+    }
+
+    if output_path.endswith('.parquet'):
+        return [_write_parquet(store, output_path, meta)]
+    return _write_npy(store, output_path, meta)
+
+
+def _write_npy(store: CityStore, output_dir: str, meta: Dict) -> List[str]:
+    strings = store.names.strings
+    if any('\x00' in value for value in strings):
+        raise ValueError("City names contain NUL characters, which the NumPy layout cannot store")
+    encoded = [value.encode('utf-8') + b'\x00' for value in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+
+    arrays = {name: store.column(name).astype(dtype, copy=False) for name, dtype in NUMERIC_COLUMNS.items()}
+    arrays['strings'] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    arrays['offsets'] = offsets
+
+    # Written next to the target and swapped in, so readers never see a mix
+    temp_dir = f"{output_dir}.{os.getpid()}.tmp"
+    if os.path.isdir(temp_dir):
+        shutil.rmtree(temp_dir)
+    os.makedirs(temp_dir)
+    for name, values in arrays.items():
+        np.save(os.path.join(temp_dir, f"{name}.npy"), values)
+    with open(os.path.join(temp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    if os.path.isdir(output_dir):
+        shutil.rmtree(output_dir)
+    os.replace(temp_dir, output_dir)
+    return [os.path.join(output_dir, f"{name}.npy") for name in arrays] + [os.path.join(output_dir, 'meta.json')]
+
+
+def _write_parquet(store: CityStore, output_file: str, meta: Dict) -> str:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    names = pa.array(store.names.strings, type=pa.string())
+    admin_codes = pa.array(store.admin_table.strings, type=pa.string())
+    elevation = store.column('elevation')
+    table = pa.table({
+        'geonameid': pa.array(store.column('geonameid')),
+        'name': names.take(pa.array(store.column('name'))),
+        'asciiname': names.take(pa.array(store.column('asciiname'))),
+        'country_code': pa.DictionaryArray.from_arrays(
+            pa.array(store.column('country').astype(np.int16)),
+            pa.array(store.country_table.strings, type=pa.string())),
+        'latitude': pa.array(store.column('latitude')),
+        'longitude': pa.array(store.column('longitude')),
+        'population': pa.array(store.column('population')),
+        'elevation': pa.array(elevation, mask=elevation == ELEVATION_MISSING),
+        'admin1_code': pa.DictionaryArray.from_arrays(pa.array(store.column('admin1').astype(np.int32)),
+                                                      admin_codes),
+        'admin2_code': pa.DictionaryArray.from_arrays(pa.array(store.column('admin2').astype(np.int32)),
+                                                      admin_codes),
+    })
+    table = table.replace_schema_metadata({'dacia': json.dumps(meta)})
+
+    temp_file = f"{output_file}.{os.getpid()}.tmp"
+    with pq.ParquetWriter(temp_file, table.schema) as writer:
+        for group in meta['row_groups']:
+            length = group['stop'] - group['start']
+            writer.write_table(table.slice(group['start'], length), row_group_size=length)
+    os.replace(temp_file, output_file)
+    return output_file
+
+
+def read_meta(path: str) -> Dict:
+    """Metadata of a columnar output"""
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        return json.loads(pq.read_schema(path).metadata[b'dacia'])
+    with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def find_columnar(csv_file: str) -> Optional[str]:
+    """Current columnar copy of a CSV file, or None
+
+    csv_file may also name a columnar output itself. A copy written from the
+    CSV is current while the CSV's size and mtime match its record; if only
+    the mtime changed, the content hash decides.
+    """
+    candidates = [csv_file] if not csv_file.endswith('.csv') else \
+        [columnar_path(csv_file, fmt) for fmt in COLUMNAR_FORMATS]
+    for path in candidates:
+        if path.endswith('.parquet'):
+            if not os.path.isfile(path) or not pyarrow_available():
+                continue
+        elif not os.path.isfile(os.path.join(path, 'meta.json')):
+            continue
+        meta = read_meta(path)
+        if meta.get('version') != COLUMNAR_VERSION:
+            continue
+        if path == csv_file or _is_current(meta.get('source'), csv_file):
+            return path
+    return None
+
+
+def read_columnar(path: str, country: str = None, missing_elevation=0) -> CityStore:
+    """Load a columnar output (or one country's row group) into a CityStore
+
+    Only the rows of the requested country are read: a slice of the
+    memory-mapped arrays, or a single Parquet row group.
+    """
+    meta = read_meta(path)
+    start, stop = 0, meta['rows']
+    if country is not None:
+        groups = [group for group in meta['row_groups'] if group['country'] == country]
+        if not groups:
+            return CityStore(missing_elevation)
+        start, stop = groups[0]['start'], groups[0]['stop']
+
+    if path.endswith('.parquet'):
+        return _read_parquet(path, meta, country, missing_elevation)
+
+    columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')[start:stop]
+               for name in NUMERIC_COLUMNS}
+    strings = np.load(os.path.join(path, 'strings.npy'), mmap_mode='r')
+    offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode='r')
+
+    if country is None:
+        names = bytes(strings).decode('utf-8').split('\x00')[:-1]
+    else:
+        # Decode only the strings this slice refers to and renumber them
+        used, inverse = np.unique(np.concatenate([columns['name'], columns['asciiname']]),
+                                  return_inverse=True)
+        names = [bytes(strings[offsets[i]:offsets[i + 1] - 1]).decode('utf-8') for i in used]
+        inverse = inverse.ravel().astype(np.uint32)
+        columns['name'], columns['asciiname'] = inverse[:stop - start], inverse[stop - start:]
+
+    return CityStore.from_columns(columns, names, meta['countries'], missing_elevation, meta['admin_codes'])
+
+
+def _read_parquet(path: str, meta: Dict, country: Optional[str], missing_elevation) -> CityStore:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    parquet = pq.ParquetFile(path)
+    if country is None:
+        table = parquet.read()
+    else:
+        index = [group['country'] for group in meta['row_groups']].index(country)
+        table = parquet.read_row_group(index)
+
+    n = table.num_rows
+    admin_codes = pa.array(meta['admin_codes'], type=pa.string())
+    both = pa.concat_arrays([table.column('name').combine_chunks(),
+                             table.column('asciiname').combine_chunks()]).dictionary_encode()
+    indices = both.indices.to_numpy(zero_copy_only=False).astype(np.uint32)
+    columns = {
+        'geonameid': table.column('geonameid').to_numpy(),
+        'latitude': table.column('latitude').to_numpy(),
+        'longitude': table.column('longitude').to_numpy(),
+        'population': table.column('population').to_numpy(),
+        'elevation': pc.fill_null(table.column('elevation'), ELEVATION_MISSING).to_numpy(),
+        'country': pc.index_in(table.column('country_code').cast(pa.string()),
+                               value_set=pa.array(meta['countries'], type=pa.string())).to_numpy(),
+        'name': indices[:n],
+        'asciiname': indices[n:],
+        'admin1': pc.index_in(table.column('admin1_code').cast(pa.string()), value_set=admin_codes).to_numpy(),
+        'admin2': pc.index_in(table.column('admin2_code').cast(pa.string()), value_set=admin_codes).to_numpy(),
+    }
+    return CityStore.from_columns(columns, both.dictionary.to_pylist(), meta['countries'], missing_elevation,
+                                  meta['admin_codes'])
+
+
+def _source_fingerprint(path: str) -> Dict:
+    from dacia_parse_cache import file_sha256
+
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_sha256(path)}
+
+
+def _is_current(recorded: Optional[Dict], csv_file: str) -> bool:
+    """Whether csv_file still is the CSV the columnar copy was written with"""
+    if not recorded:
+        return False
+    if not os.path.exists(csv_file):
+        # Only the columnar copy was kept
+        return True
+    stat = os.stat(csv_file)
+    if stat.st_size != recorded['size']:
+        return False
+    if stat.st_mtime_ns == recorded['mtime_ns']:
+        return True
+    from dacia_parse_cache import file_sha256
+    return file_sha256(csv_file) == recorded['sha256']
@@ -0,0 +1,245 @@
+"""
+Population density grid for the filtered cities
+Bins city points onto a regular lat/lon grid or a hexagonal grid with one
+NumPy scatter-add per quantity, and clips the cells to the Dacia polygon so
+each cell knows how much of its area lies inside the region
+"""
+
+import json
+from typing import Dict, Sequence, Tuple
+import numpy as np
+
+# Default cell size in degrees (square cell side, or hexagon width)
+DEFAULT_RESOLUTION = 0.1
+
+GRID_SHAPES = ('square', 'hex')
+
+# Mean Earth radius in km, as in dacia_spatial_index
+EARTH_RADIUS_KM = 6371.0088
+
+_SQRT3 = np.sqrt(3.0)
+
+
+class DensityGrid:
+    """Settlement counts and population per cell of a grid over a region
+
+    All per-cell arrays have the grid's 2D shape (rows, columns). For the
+    square grid, row i and column j cover latitudes origin_lat + i*res and
+    longitudes origin_lon + j*res. The hexagonal grid uses pointy-top
+    hexagons of width res (in degrees of latitude) on a plane where
+    longitudes are scaled by cos(reference latitude), so cells are close to
+    regular in km; row and column are the axial coordinates r and q, offset
+    to start at 0 (summary() records the offsets). Cells of that
+    parallelogram that do not touch the region have inside=False.
+    """
+
+    def __init__(self, shape: str, resolution: float, bounds: Tuple[float, float, float, float],
+                 n_rows: int, n_cols: int):
+        if shape not in GRID_SHAPES:
+            raise ValueError(f"Unknown grid shape {shape!r}, use one of {GRID_SHAPES}")
+        self.shape = shape
+        self.resolution = float(resolution)
+        # Region bounds (min_lon, min_lat, max_lon, max_lat); the grid origin
+        self.bounds = tuple(float(b) for b in bounds)
+        self.n_rows = n_rows
+        self.n_cols = n_cols
+        self.reference_lat = (self.bounds[1] + self.bounds[3]) / 2
+        self._x_scale = np.cos(np.radians(self.reference_lat))
+        # Axial (r, q) of row 0 and column 0 on the hexagonal grid
+        self._offsets = (0, 0)
+        self.settlements = np.zeros((n_rows, n_cols), dtype=np.int64)
+        self.population = np.zeros((n_rows, n_cols), dtype=np.int64)
+        self.coverage = np.ones((n_rows, n_cols), dtype=np.float64)
+        self.points_outside = 0
+
+    @classmethod
+    def for_region(cls, bounds: Tuple[float, float, float, float], resolution: float = DEFAULT_RESOLUTION,
+                   shape: str = 'square') -> 'DensityGrid':
+        """Empty grid covering bounds (min_lon, min_lat, max_lon, max_lat)"""
+        min_lon, min_lat, max_lon, max_lat = bounds
+        if shape == 'square':
+            # +1 so points on the maximum edge still fall on the grid
+            n_rows = int(np.floor((max_lat - min_lat) / resolution)) + 1
+            n_cols = int(np.floor((max_lon - min_lon) / resolution)) + 1
+            return cls(shape, resolution, bounds, n_rows, n_cols)
+
+        grid = cls(shape, resolution, bounds, 1, 1)
+        # Axial coordinates of the bounding box corners give the parallelogram
+        x = (np.array([min_lon, max_lon, min_lon, max_lon]) - min_lon) * grid._x_scale
+        y = np.array([min_lat, min_lat, max_lat, max_lat]) - min_lat
+        q, r = grid._axial(x, y)
+        q_min, q_max = int(np.floor(q.min())) - 1, int(np.ceil(q.max())) + 1
+        r_min, r_max = int(np.floor(r.min())) - 1, int(np.ceil(r.max())) + 1
+        grid = cls(shape, resolution, bounds, r_max - r_min + 1, q_max - q_min + 1)
+        grid._offsets = (r_min, q_min)
+        return grid
+
+    @property
+    def _size(self) -> float:
+        """Hexagon centre-to-vertex distance"""
+        return self.resolution / _SQRT3
+
+    def _axial(self, x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Fractional axial coordinates of projected points"""
+        size = self._size
+        return (_SQRT3 / 3 * x - y / 3) / size, (2 / 3 * y) / size
+
+    def cell_indices(self, lons: np.ndarray, lats: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Row and column of the cell holding each point (may be off the grid)"""
+        min_lon, min_lat = self.bounds[0], self.bounds[1]
+        if self.shape == 'square':
+            rows = np.floor((lats - min_lat) / self.resolution).astype(np.int64)
+            cols = np.floor((lons - min_lon) / self.resolution).astype(np.int64)
+            return rows, cols
+
+        q, r = self._axial((lons - min_lon) * self._x_scale, lats - min_lat)
+        # Cube rounding: round all three cube coordinates and recompute the
+        # one with the largest rounding error from the other two
+        s = -q - r
+        rq, rr, rs = np.rint(q), np.rint(r), np.rint(s)
+        dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+        fix_q = (dq > dr) & (dq > ds)
+        fix_r = ~fix_q & (dr > ds)
+        rq = np.where(fix_q, -rr - rs, rq)
+        rr = np.where(fix_r, -rq - rs, rr)
+        return rr.astype(np.int64) - self._offsets[0], rq.astype(np.int64) - self._offsets[1]
+
+    def add_points(self, lons: np.ndarray, lats: np.ndarray, populations: np.ndarray):
+        """Scatter-add points into the grid; points off the grid are counted, not binned"""
+        rows, cols = self.cell_indices(np.asarray(lons, dtype=np.float64), np.asarray(lats, dtype=np.float64))
+        on_grid = (rows >= 0) & (rows < self.n_rows) & (cols >= 0) & (cols < self.n_cols)
+        self.points_outside += int(np.count_nonzero(~on_grid))
+        flat = rows[on_grid] * self.n_cols + cols[on_grid]
+        size = self.n_rows * self.n_cols
+        self.settlements += np.bincount(flat, minlength=size).reshape(self.n_rows, self.n_cols)
+        # Integer weights are summed exactly as floats below 2**53
+        weights = np.asarray(populations, dtype=np.float64)[on_grid]
+        population = np.rint(np.bincount(flat, weights=weights, minlength=size)).astype(np.int64)
+        self.population += population.reshape(self.n_rows, self.n_cols)
+
+    def centers(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Longitude and latitude of every cell centre"""
+        rows, cols = np.indices((self.n_rows, self.n_cols))
+        min_lon, min_lat = self.bounds[0], self.bounds[1]
+        if self.shape == 'square':
+            return (min_lon + (cols + 0.5) * self.resolution, min_lat + (rows + 0.5) * self.resolution)
+        r, q = rows + self._offsets[0], cols + self._offsets[1]
+        x = self._size * (_SQRT3 * q + _SQRT3 / 2 * r)
+        y = self._size * 1.5 * r
+        return min_lon + x / self._x_scale, min_lat + y
+
+    def cell_vertices(self) -> np.ndarray:
+        """(rows, columns, corners, 2) array of cell outlines as (lon, lat)"""
+        lons, lats = self.centers()
+        if self.shape == 'square':
+            half = self.resolution / 2
+            dx = np.array([-half, half, half, -half])
+            dy = np.array([-half, -half, half, half])
+        else:
+            angles = np.radians(30 + 60 * np.arange(6))
+            dx = self._size * np.cos(angles) / self._x_scale
+            dy = self._size * np.sin(angles)
+        return np.stack([lons[..., None] + dx, lats[..., None] + dy], axis=-1)
+
+    def clip(self, polygon):
+        """Set each cell's coverage to the share of its area inside polygon
+
+        Cells wholly inside get 1 without computing an intersection; only
+        the cells crossing the boundary are intersected.
+        """
+        import shapely
+
+        cells = shapely.polygons(self.cell_vertices().reshape(-1, 4 if self.shape == 'square' else 6, 2))
+        shapely.prepare(polygon)
+        touching = shapely.intersects(polygon, cells)
+        inside = touching & shapely.contains_properly(polygon, cells)
+        boundary = np.flatnonzero(touching & ~inside)
+        coverage = inside.astype(np.float64)
+        coverage[boundary] = (shapely.area(shapely.intersection(cells[boundary], polygon))
+                              / shapely.area(cells[boundary]))
+        self.coverage = coverage.reshape(self.n_rows, self.n_cols)
+
+    @property
+    def inside(self) -> np.ndarray:
+        """Cells that overlap the region or hold a settlement"""
+        return (self.coverage > 0) | (self.settlements > 0)
+
+    def cell_area_km2(self) -> np.ndarray:
+        """Area of every full cell in km²"""
+        if self.shape == 'square':
+            _, lats = self.centers()
+            low = np.radians(lats - self.resolution / 2)
+            high = np.radians(lats + self.resolution / 2)
+            return EARTH_RADIUS_KM ** 2 * np.radians(self.resolution) * (np.sin(high) - np.sin(low))
+        _, lats = self.centers()
+        # Hexagon area on the plane, scaled back from projected degrees
+        km_per_degree = EARTH_RADIUS_KM * np.pi / 180
+        area = 3 * _SQRT3 / 2 * self._size ** 2
+        return area * km_per_degree ** 2 * np.cos(np.radians(lats)) / self._x_scale
+
+    def density(self) -> np.ndarray:
+        """Population per km² of the part of each cell inside the region (0 outside)"""
+        area = self.cell_area_km2() * self.coverage
+        return np.divide(self.population, area, out=np.zeros(self.population.shape), where=area > 0)
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Per-cell arrays for export"""
+        lons, lats = self.centers()
+        return {
+            'settlements': self.settlements,
+            'population': self.population,
+            'density_per_km2': self.density(),
+            'coverage': self.coverage,
+            'area_km2': self.cell_area_km2(),
+            'inside': self.inside,
+            'center_lon': lons,
+            'center_lat': lats,
+        }
+
+    def summary(self) -> Dict:
+        """Grid parameters and totals"""
+        return {
+            'shape': self.shape,
+            'resolution': self.resolution,
+            'bounds': list(self.bounds),
+            'rows': self.n_rows,
+            'columns': self.n_cols,
+            'axial_offsets': list(self._offsets),
+            'cells_inside': int(np.count_nonzero(self.inside)),
+            'occupied_cells': int(np.count_nonzero(self.settlements)),
+            'settlements': int(self.settlements.sum()),
+            'population': int(self.population.sum()),
+            'points_outside': self.points_outside,
+            'max_density_per_km2': float(self.density().max()) if self.settlements.size else 0.0,
+        }
+
+    def save(self, output_file: str):
+        """Save the per-cell arrays and the grid parameters as .npz
+
+        The 'meta' entry holds summary() as a JSON string.
+        """
+        np.savez_compressed(output_file, meta=np.array(json.dumps(self.summary())), **self.to_arrays())
+
+
+def bin_cities(lons: Sequence[float], lats: Sequence[float], populations: Sequence[int],
+               resolution: float = DEFAULT_RESOLUTION, shape: str = 'square',
+               polygon=None) -> DensityGrid:
+    """Density grid of the given points, over the polygon's bounds when given
+
+    Without a polygon the grid covers the points and every cell counts as
+    fully inside.
+    """
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    if polygon is not None:
+        bounds = polygon.bounds
+    elif len(lons):
+        bounds = (lons.min(), lats.min(), lons.max(), lats.max())
+    else:
+        bounds = (0.0, 0.0, resolution, resolution)
+
+    grid = DensityGrid.for_region(bounds, resolution, shape)
+    grid.add_points(lons, lats, populations)
+    if polygon is not None:
+        grid.clip(polygon)
+    return grid
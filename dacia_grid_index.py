@@ -0,0 +1,133 @@
+"""
+Raster acceptance index for fast point-in-polygon tests
+Classifies a fixed-resolution grid over the polygon bounds once so that most
+points are resolved without an exact geometry test
+"""
+
+from typing import Dict
+import numpy as np
+import shapely
+from shapely.geometry import Polygon
+
+# Cell states
+CELL_OUTSIDE = 0
+CELL_INSIDE = 1
+CELL_BOUNDARY = 2
+
+# Default number of grid cells along each axis of the polygon bounds
+DEFAULT_GRID_RESOLUTION = 256
+
+
+class PolygonGridIndex:
+    """Bounding box reject plus a grid of inside/outside/boundary cells
+
+    Points in fully inside or fully outside cells are answered from the grid.
+    Only points in boundary cells fall through to shapely, so the result is
+    always identical to polygon.contains.
+    """
+
+    def __init__(self, polygon: Polygon, resolution: int = DEFAULT_GRID_RESOLUTION):
+        self.polygon = polygon
+        self.resolution = resolution
+        self.minx, self.miny, self.maxx, self.maxy = polygon.bounds
+        self.dx = (self.maxx - self.minx) / resolution
+        self.dy = (self.maxy - self.miny) / resolution
+        self.cells = self._classify_cells()
+        # Flat list copy for fast scalar lookups
+        self._cells_flat = self.cells.ravel().tolist()
+        self.reset_counters()
+
+    def _classify_cells(self) -> np.ndarray:
+        """Classify every grid cell as inside, outside or boundary"""
+        n = self.resolution
+        shapely.prepare(self.polygon)
+
+        ix, iy = np.meshgrid(np.arange(n), np.arange(n))
+        # Grow each cell slightly so points rounded into a neighbouring cell
+        # are still covered by the classification of the cell they land in
+        eps_x = self.dx * 1e-6
+        eps_y = self.dy * 1e-6
+        boxes = shapely.box(self.minx + ix * self.dx - eps_x,
+                            self.miny + iy * self.dy - eps_y,
+                            self.minx + (ix + 1) * self.dx + eps_x,
+                            self.miny + (iy + 1) * self.dy + eps_y)
+
+        cells = np.full((n, n), CELL_BOUNDARY, dtype=np.uint8)
+        # contains_properly keeps cells touching the boundary out of "inside",
+        # since polygon.contains is False for points on the boundary
+        cells[shapely.contains_properly(self.polygon, boxes)] = CELL_INSIDE
+        cells[~shapely.intersects(self.polygon, boxes)] = CELL_OUTSIDE
+        return cells
+
+    def reset_counters(self):
+        """Reset the hit/miss counters"""
+        self.bbox_rejects = 0
+        self.inside_hits = 0
+        self.outside_hits = 0
+        self.boundary_tests = 0
+
+    def contains(self, lon: float, lat: float) -> bool:
+        """Check whether a single point is inside the polygon"""
+        # Written positively so NaN coordinates are rejected as well
+        if not (self.minx <= lon <= self.maxx and self.miny <= lat <= self.maxy):
+            self.bbox_rejects += 1
+            return False
+
+        n = self.resolution
+        ix = min(int((lon - self.minx) / self.dx), n - 1)
+        iy = min(int((lat - self.miny) / self.dy), n - 1)
+        state = self._cells_flat[iy * n + ix]
+
+        if state == CELL_INSIDE:
+            self.inside_hits += 1
+            return True
+        if state == CELL_OUTSIDE:
+            self.outside_hits += 1
+            return False
+
+        self.boundary_tests += 1
+        return bool(shapely.contains_xy(self.polygon, lon, lat))
+
+    def contains_xy(self, lons: np.ndarray, lats: np.ndarray) -> np.ndarray:
+        """Vectorized containment test for arrays of points"""
+        lons = np.asarray(lons, dtype=np.float64)
+        lats = np.asarray(lats, dtype=np.float64)
+        result = np.zeros(len(lons), dtype=bool)
+
+        in_bbox = ((lons >= self.minx) & (lons <= self.maxx) &
+                   (lats >= self.miny) & (lats <= self.maxy))
+        self.bbox_rejects += int(len(lons) - in_bbox.sum())
+
+        idx = np.flatnonzero(in_bbox)
+        if len(idx) == 0:
+            return result
+
+        n = self.resolution
+        ix = np.minimum(((lons[idx] - self.minx) / self.dx).astype(np.int64), n - 1)
+        iy = np.minimum(((lats[idx] - self.miny) / self.dy).astype(np.int64), n - 1)
+        states = self.cells[iy, ix]
+
+        inside = states == CELL_INSIDE
+        boundary = states == CELL_BOUNDARY
+        self.inside_hits += int(inside.sum())
+        self.outside_hits += int((states == CELL_OUTSIDE).sum())
+        self.boundary_tests += int(boundary.sum())
+
+        result[idx[inside]] = True
+        exact = idx[boundary]
+        if len(exact):
+            result[exact] = shapely.contains_xy(self.polygon, lons[exact], lats[exact])
+        return result
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and the fraction resolved without geometry"""
+        total = self.bbox_rejects + self.inside_hits + self.outside_hits + self.boundary_tests
+        resolved = total - self.boundary_tests
+        return {
+            'total_points': total,
+            'bbox_rejects': self.bbox_rejects,
+            'inside_hits': self.inside_hits,
+            'outside_hits': self.outside_hits,
+            'boundary_tests': self.boundary_tests,
+            'resolved_fraction': resolved / total if total else 0.0,
+        }
@@ -0,0 +1,231 @@
+"""
+Runtime instrumentation for the filter and the analyzer
+Per-stage wall and CPU timers, throughput counters and sampled peak memory,
+written as a JSON metrics file and optionally a Prometheus textfile
+"""
+
+import functools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict
+
+try:
+    import resource
+except ImportError:
+    # Windows: no getrusage, peak memory is read from procfs or not sampled
+    resource = None
+
+# Seconds between two memory samples while a stage runs
+DEFAULT_SAMPLE_INTERVAL = 0.05
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        # No procfs: fall back to the peak, which is the best available bound
+        return peak_rss()
+
+
+def peak_rss() -> int:
+    """Peak resident set size of this process so far, in bytes
+
+    0 where neither getrusage nor procfs is available.
+    """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KB, macOS bytes
+        return peak if sys.platform == 'darwin' else peak * 1024
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, IndexError, ValueError):
+        pass
+    return 0
+
+
+class Metrics:
+    """Stage timers, counters and memory peaks of one run
+
+    Stages are timed with stage() (or the timed decorator); a background
+    thread samples the RSS while any stage is active and keeps each stage's
+    peak. Re-entering a stage that is already active is not timed twice.
+    CPU time is that of this process, so work done in pool workers only
+    shows in the wall time. Counters are plain sums; rule match counts are
+    kept per rule.
+    """
+
+    def __init__(self, sample_interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.sample_interval = sample_interval
+        self.stages = {}
+        self.counters = defaultdict(int)
+        self.rule_matches = defaultdict(int)
+        self.stage_rows = defaultdict(int)
+        self._active = {}
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time the enclosed block as stage name"""
+        if name in self._active:
+            yield
+            return
+
+        with self._lock:
+            self._active[name] = current_rss()
+        self._start_sampler()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            with self._lock:
+                peak = max(self._active.pop(name), current_rss())
+            stage = self.stages.setdefault(name, {'calls': 0, 'wall_seconds': 0.0,
+                                                  'cpu_seconds': 0.0, 'peak_rss_bytes': 0})
+            stage['calls'] += 1
+            stage['wall_seconds'] += wall
+            stage['cpu_seconds'] += cpu
+            stage['peak_rss_bytes'] = max(stage['peak_rss_bytes'], peak)
+
+    def _start_sampler(self):
+        if self._sampler is None:
+            self._sampler = threading.Thread(target=self._sample, name='metrics-rss-sampler', daemon=True)
+            self._sampler.start()
+
+    def _sample(self):
+        """Update the peaks of the active stages, for the life of the process"""
+        while True:
+            time.sleep(self.sample_interval)
+            if not self._active:
+                continue
+            rss = current_rss()
+            with self._lock:
+                for name, peak in self._active.items():
+                    if rss > peak:
+                        self._active[name] = rss
+
+    def __getstate__(self):
+        # The lock and sampler thread stay in this process
+        state = self.__dict__.copy()
+        state['_active'], state['_lock'], state['_sampler'] = {}, None, None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def add_rows(self, stage_name: str, rows: int):
+        """Add rows processed by a stage, for its rows/sec"""
+        self.stage_rows[stage_name] += int(rows)
+
+    def count(self, name: str, value: int = 1):
+        """Add value to a counter"""
+        self.counters[name] += int(value)
+
+    def count_rules(self, rule_counts: Dict[str, int]):
+        """Add per-rule match counts"""
+        for name, value in rule_counts.items():
+            self.rule_matches[name] += int(value)
+
+    def to_dict(self) -> Dict:
+        """Metrics as a JSON-serializable dict"""
+        stages = {}
+        for name, stage in self.stages.items():
+            stages[name] = dict(stage, wall_seconds=round(stage['wall_seconds'], 6),
+                                cpu_seconds=round(stage['cpu_seconds'], 6))
+            rows = self.stage_rows.get(name)
+            if rows:
+                stages[name]['rows'] = rows
+                stages[name]['rows_per_sec'] = round(rows / stage['wall_seconds']) if stage['wall_seconds'] > 0 else None
+        return {
+            'stages': stages,
+            'counters': dict(self.counters),
+            'rule_matches': dict(self.rule_matches),
+            'peak_rss_bytes': peak_rss(),
+        }
+
+    def write_json(self, output_file: str):
+        """Write the metrics as JSON"""
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def write_prometheus(self, output_file: str, prefix: str = 'dacia'):
+        """Write the metrics in the Prometheus text exposition format
+
+        Meant for the node_exporter textfile collector, so the file is
+        written under a temporary name and renamed into place.
+        """
+        data = self.to_dict()
+        lines = []
+
+        def metric(name, help_text, kind, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{_escape_label(val)}"' for key, val in labels.items())
+                lines.append(f"{prefix}_{name}{{{label_text}}} {value}" if label_text
+                             else f"{prefix}_{name} {value}")
+
+        stages = data['stages']
+        metric('stage_wall_seconds', "Wall-clock time spent in a stage", 'gauge',
+               [({'stage': name}, s['wall_seconds']) for name, s in stages.items()])
+        metric('stage_cpu_seconds', "CPU time spent in a stage", 'gauge',
+               [({'stage': name}, s['cpu_seconds']) for name, s in stages.items()])
+        metric('stage_peak_rss_bytes', "Peak resident memory sampled during a stage", 'gauge',
+               [({'stage': name}, s['peak_rss_bytes']) for name, s in stages.items()])
+        metric('stage_calls', "Number of times a stage ran", 'gauge',
+               [({'stage': name}, s['calls']) for name, s in stages.items()])
+        metric('stage_rows', "Rows processed by a stage", 'gauge',
+               [({'stage': name}, s['rows']) for name, s in stages.items() if 'rows' in s])
+        for name, value in data['counters'].items():
+            metric(f"{_metric_name(name)}_total", f"Counter {name}", 'counter', [({}, value)])
+        metric('rule_matches_total', "Cities matched per filtering rule", 'counter',
+               [({'rule': name}, value) for name, value in data['rule_matches'].items()])
+        metric('peak_rss_bytes', "Peak resident memory of the process", 'gauge', [({}, data['peak_rss_bytes'])])
+
+        temp_file = f"{output_file}.{os.getpid()}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(temp_file, output_file)
+
+    def write(self, json_file: str = None, prometheus_file: str = None):
+        """Write the JSON metrics file and/or the Prometheus textfile"""
+        if json_file:
+            self.write_json(json_file)
+            print(f"Saved metrics: {json_file}")
+        if prometheus_file:
+            self.write_prometheus(prometheus_file)
+            print(f"Saved Prometheus metrics: {prometheus_file}")
+
+
+def timed(stage_name: str):
+    """Method decorator timing calls as stage_name in self.metrics"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.stage(stage_name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
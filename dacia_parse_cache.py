@@ -0,0 +1,179 @@
+"""
+Binary cache of a parsed GeoNames dump
+Stores the numeric columns of every well-formed line as memory-mapped NumPy
+files, keyed by the source file's size, modification time and hash
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from array import array
+from typing import Dict
+import numpy as np
+
+# Bump when the layout of the cached columns changes
+CACHE_VERSION = 1
+
+# Sentinel stored for lines without a usable elevation value
+ELEVATION_MISSING = np.iinfo(np.int32).min
+
+# Cached columns and their array typecodes
+CACHE_COLUMNS = {
+    'geonameid': 'q',
+    'offset': 'q',
+    'latitude': 'd',
+    'longitude': 'd',
+    'country': 'H',
+    'population': 'q',
+    'elevation': 'i',
+}
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """SHA-256 hex digest of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ParsedDumpCache:
+    """Memory-mapped parsed columns of a GeoNames TSV file
+
+    Only lines that parse_city_line would accept are cached; 'offset' holds
+    the byte offset of each line in the source file so matching rows can be
+    materialized without re-reading the rest. The cache is valid while the
+    source size and mtime match; if only the mtime changed, the content hash
+    decides. Anything else triggers a rebuild.
+    """
+
+    def __init__(self, cities_file: str, cache_dir: str = None):
+        self.cities_file = cities_file
+        self.cache_dir = cache_dir or cities_file + '.cache'
+        self.meta = None
+        self.columns = {}
+
+    @property
+    def meta_file(self) -> str:
+        return os.path.join(self.cache_dir, 'meta.json')
+
+    def _source_stat(self) -> Dict:
+        """Size and modification time of the source file"""
+        stat = os.stat(self.cities_file)
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def is_valid(self) -> bool:
+        """Check whether the cache on disk matches the current source file"""
+        try:
+            with open(self.meta_file, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return False
+
+        if meta.get('version') != CACHE_VERSION:
+            return False
+
+        source = self._source_stat()
+        if meta['size'] != source['size']:
+            return False
+        if meta['mtime_ns'] != source['mtime_ns']:
+            # Touched but maybe unchanged: the content hash decides
+            if file_sha256(self.cities_file) != meta['sha256']:
+                return False
+            meta['mtime_ns'] = source['mtime_ns']
+            with open(self.meta_file, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, indent=2)
+        return True
+
+    def load(self, rebuild: bool = False) -> 'ParsedDumpCache':
+        """Map the cached columns, building the cache first if needed"""
+        if rebuild or not self.is_valid():
+            self.build()
+
+        with open(self.meta_file, 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.columns = {name: np.load(os.path.join(self.cache_dir, f"{name}.npy"), mmap_mode='r')
+                        for name in CACHE_COLUMNS}
+        return self
+
+    def build(self):
+        """Parse the source file and write the cache"""
+        print(f"Building parse cache for {self.cities_file} in {self.cache_dir}...")
+
+        self.clear()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        source = self._source_stat()
+        digest = hashlib.sha256()
+        columns = {name: array(typecode) for name, typecode in CACHE_COLUMNS.items()}
+        country_codes = {}
+        total_lines = 0
+        offset = 0
+
+        with open(self.cities_file, 'rb') as f:
+            for raw in f:
+                digest.update(raw)
+                line_offset = offset
+                offset += len(raw)
+                total_lines += 1
+
+                fields = raw.decode('utf-8').strip().split('\t')
+                if len(fields) < 19:
+                    continue
+                try:
+                    latitude = float(fields[4])
+                    longitude = float(fields[5])
+                    population = int(fields[14]) if fields[14] else 0
+                except ValueError:
+                    continue
+                # Only the columns above decide whether a line is kept
+                try:
+                    geonameid = int(fields[0])
+                except ValueError:
+                    geonameid = -1
+                try:
+                    elevation = int(fields[15]) if fields[15] else ELEVATION_MISSING
+                except ValueError:
+                    elevation = ELEVATION_MISSING
+
+                country = country_codes.setdefault(fields[8], len(country_codes))
+                columns['geonameid'].append(geonameid)
+                columns['offset'].append(line_offset)
+                columns['latitude'].append(latitude)
+                columns['longitude'].append(longitude)
+                columns['country'].append(country)
+                columns['population'].append(population)
+                columns['elevation'].append(elevation)
+
+        for name, values in columns.items():
+            np.save(os.path.join(self.cache_dir, f"{name}.npy"),
+                    np.frombuffer(values, dtype=values.typecode) if len(values)
+                    else np.array([], dtype=values.typecode))
+
+        # The metadata file is written last and marks the cache as complete
+        meta = {
+            'version': CACHE_VERSION,
+            'source': os.path.abspath(self.cities_file),
+            'size': source['size'],
+            'mtime_ns': source['mtime_ns'],
+            'sha256': digest.hexdigest(),
+            'total_lines': total_lines,
+            'rows': len(columns['offset']),
+            'country_codes': list(country_codes),
+        }
+        with open(self.meta_file, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+
+        print(f"Cached {meta['rows']:,} of {total_lines:,} lines")
+
+    def clear(self):
+        """Delete the cache directory"""
+        if os.path.isdir(self.cache_dir):
+            shutil.rmtree(self.cache_dir)
+        self.meta = None
+        self.columns = {}
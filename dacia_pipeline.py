@@ -0,0 +1,229 @@
+"""
+Incremental pipeline runner for the Dacia cities workflow
+Runs border + cities file -> filtered CSVs -> statistics -> charts -> density
+grid, and records the size, mtime and SHA-256 of every stage's inputs and
+outputs in a manifest so a rerun only executes the stages whose inputs
+actually changed
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import Callable, Dict, List
+
+# Bump when the manifest layout changes
+MANIFEST_VERSION = 1
+
+# Source modules each stage depends on, relative to this file
+FILTER_SOURCES = ['filter_dacia_cities.py', 'dacia_grid_index.py', 'dacia_rules.py',
+                  'dacia_streaming.py', 'dacia_city_store.py', 'dacia_readers.py', 'dacia_columnar.py',
+                  'dacia_border_distance.py', 'dacia_ranking.py']
+ANALYZER_SOURCES = ['analyze_dacia_cities.py', 'dacia_city_store.py', 'dacia_stats.py', 'dacia_columnar.py',
+                    'dacia_border_distance.py', 'dacia_admin.py', 'dacia_ranking.py']
+
+_SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def fingerprint(path: str, recorded: Dict = None) -> Dict:
+    """Size, mtime and SHA-256 of a file
+
+    When the size and mtime match the recorded fingerprint, the recorded
+    hash is reused without reading the file.
+    """
+    stat = os.stat(path)
+    if recorded and recorded['size'] == stat.st_size and recorded['mtime_ns'] == stat.st_mtime_ns:
+        return recorded
+    # Imported here: hashing is the only reason to load numpy on a no-op run
+    from dacia_parse_cache import file_sha256
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_sha256(path)}
+
+
+class Stage:
+    """One pipeline step
+
+    run() executes the step and returns the paths of the files it wrote.
+    params are recorded in the manifest too; changing them reruns the step.
+    """
+
+    def __init__(self, name: str, inputs: List[str], run: Callable[[], List[str]], params: Dict = None):
+        self.name = name
+        self.inputs = inputs
+        self.run = run
+        self.params = params or {}
+
+
+class DaciaPipeline:
+    """The filter -> statistics -> charts -> density stage graph
+
+    Stages run in order; each is skipped when its parameters and the
+    content hashes of its inputs and outputs match the manifest. Because a
+    stage's outputs are the next stage's inputs, a filter rerun that writes
+    byte-identical CSVs does not rerun the analysis.
+    """
+
+    def __init__(self, polygon_file: str = 'dacia_border.txt', cities_file: str = 'cities500/cities500.txt',
+                 rules_file: str = 'dacia_rules.json', output_dir: str = '',
+                 manifest_file: str = 'pipeline_manifest.json', image_format: str = 'png',
+                 dpi: int = 300, chart_workers: int = None, density_resolution: float = 0.1,
+                 density_shape: str = 'square', admin1_file: str = 'admin1CodesASCII.txt',
+                 admin2_file: str = 'admin2Codes.txt'):
+        self.polygon_file = polygon_file
+        self.cities_file = cities_file
+        self.rules_file = rules_file
+        self.output_dir = output_dir
+        self.output_file = f"{output_dir}dacia_cities_all.csv"
+        self.manifest_file = manifest_file
+        self.image_format = image_format
+        self.dpi = dpi
+        self.chart_workers = chart_workers
+        self.density_resolution = density_resolution
+        self.density_shape = density_shape
+        self.admin1_file = admin1_file
+        self.admin2_file = admin2_file
+        self._analyzer = None
+        # Optional: the admin rollups are unnamed without them
+        admin_files = [path for path in (admin1_file, admin2_file) if os.path.exists(path)]
+
+        sources = lambda names: [os.path.join(_SOURCE_DIR, name) for name in names]
+        self.stages = [
+            Stage('filter', [polygon_file, cities_file, rules_file] + sources(FILTER_SOURCES),
+                  self._run_filter),
+            Stage('statistics', [self.output_file, polygon_file] + admin_files + sources(ANALYZER_SOURCES),
+                  self._run_statistics),
+            Stage('charts', [self.output_file] + sources(ANALYZER_SOURCES),
+                  self._run_charts, {'image_format': image_format, 'dpi': dpi}),
+            Stage('density', [self.output_file, polygon_file] + sources(ANALYZER_SOURCES + ['dacia_density.py']),
+                  self._run_density, {'resolution': density_resolution, 'shape': density_shape,
+                                      'image_format': image_format, 'dpi': dpi}),
+        ]
+
+    def run(self, force: bool = False) -> Dict[str, str]:
+        """Run every stage that is out of date; returns stage -> 'ran'/'skipped'"""
+        start = time.perf_counter()
+        manifest = self._load_manifest()
+        results = {}
+
+        for stage in self.stages:
+            entry = manifest['stages'].get(stage.name)
+            if not force and self._is_up_to_date(stage, entry):
+                print(f"[{stage.name}] up to date")
+                results[stage.name] = 'skipped'
+                continue
+
+            print(f"[{stage.name}] running...")
+            stage_start = time.perf_counter()
+            inputs = {path: fingerprint(path) for path in stage.inputs}
+            outputs = stage.run()
+            manifest['stages'][stage.name] = {
+                'params': stage.params,
+                'inputs': inputs,
+                'outputs': {path: fingerprint(path) for path in outputs},
+                'seconds': round(time.perf_counter() - stage_start, 4),
+            }
+            # Saved after every stage so a failure later keeps this progress
+            self._save_manifest(manifest)
+            results[stage.name] = 'ran'
+
+        if manifest.pop('dirty', False):
+            self._save_manifest(manifest)
+        print(f"Pipeline finished in {time.perf_counter() - start:.3f}s")
+        return results
+
+    def _is_up_to_date(self, stage: Stage, entry: Dict) -> bool:
+        """Compare a stage's current inputs and outputs with its manifest entry"""
+        if not entry or entry['params'] != stage.params or set(entry['inputs']) != set(stage.inputs):
+            return False
+        for files in (entry['inputs'], entry['outputs']):
+            for path, recorded in files.items():
+                if not os.path.exists(path):
+                    return False
+                current = fingerprint(path, recorded)
+                if current['sha256'] != recorded['sha256']:
+                    return False
+                if current is not recorded:
+                    # Touched but unchanged: remember the new mtime
+                    files[path] = current
+                    self._manifest['dirty'] = True
+        return True
+
+    def _load_manifest(self) -> Dict:
+        manifest = {'version': MANIFEST_VERSION, 'stages': {}}
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                loaded = json.load(f)
+            if loaded.get('version') == MANIFEST_VERSION:
+                manifest = loaded
+        self._manifest = manifest
+        return manifest
+
+    def _save_manifest(self, manifest: Dict):
+        manifest.pop('dirty', None)
+        with open(self.manifest_file, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+
+    def _run_filter(self) -> List[str]:
+        from filter_dacia_cities import DaciaCityFilter
+
+        filter_obj = DaciaCityFilter(self.polygon_file, self.cities_file, rules_file=self.rules_file)
+        filter_obj.load_polygon()
+        filter_obj.filter_cities_batch()
+        filter_obj.calculate_border_distances()
+        summary = filter_obj.write_outputs(self.output_file, self.output_dir)
+        columnar_files = filter_obj.save_columnar(self.output_file)
+        print(filter_obj.generate_summary(summary))
+        return [self.output_file] + [f"{self.output_dir}dacia_cities_{country}.csv"
+                                     for country in sorted(summary.countries)] + columnar_files
+
+    def _analyzer_for_run(self):
+        """Analyzer with loaded data and statistics, shared by the analysis stages"""
+        if self._analyzer is None:
+            from analyze_dacia_cities import DaciaCitiesAnalyzer
+
+            self._analyzer = DaciaCitiesAnalyzer(self.output_file)
+            self._analyzer.load_data()
+            self._analyzer.load_admin_codes(self.admin1_file, self.admin2_file)
+            self._analyzer.calculate_statistics()
+            self._analyzer.calculate_border_statistics(self.polygon_file)
+        return self._analyzer
+
+    def _run_statistics(self) -> List[str]:
+        analyzer = self._analyzer_for_run()
+        json_file = f"{self.output_dir}statistics.json"
+        report_file = f"{self.output_dir}statistics_report.txt"
+        analyzer.save_statistics_report(report_file)
+        analyzer.save_statistics_json(json_file)
+        return [json_file, report_file]
+
+    def _run_density(self) -> List[str]:
+        analyzer = self._analyzer_for_run()
+        grid_file = f"{self.output_dir}density_grid.npz"
+        heatmap_file = f"{self.output_dir}heatmap_population_density.{self.image_format}"
+        analyzer.dpi = self.dpi
+        analyzer.calculate_density_grid(self.density_resolution, self.density_shape, self.polygon_file)
+        analyzer.save_density_grid(grid_file)
+        analyzer.create_density_heatmap(heatmap_file)
+        return [grid_file, heatmap_file]
+
+    def _run_charts(self) -> List[str]:
+        analyzer = self._analyzer_for_run()
+        chart_manifest = f"{self.output_dir}charts_manifest.json"
+        manifest = analyzer.render_charts(parallel=self.chart_workers is not None, workers=self.chart_workers,
+                                          dpi=self.dpi, image_format=self.image_format,
+                                          manifest_file=chart_manifest, output_dir=self.output_dir)
+        charts = [path for path in manifest['charts'] if path.endswith(f".{self.image_format}")]
+        return charts + [chart_manifest]
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Run the Dacia cities pipeline incrementally")
+    parser.add_argument('--force', action='store_true', help="rerun every stage")
+    parser.add_argument('--manifest', default='pipeline_manifest.json')
+    args = parser.parse_args()
+
+    DaciaPipeline(manifest_file=args.manifest).run(force=args.force)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Ranked top-k index of the filtered cities by population
+Keeps the k most populous cities overall and per country in bounded heaps
+as cities are filtered or loaded, so top-N lists, largest cities and "top k
+in country X above population P" queries need no sort of all cities
+"""
+
+import heapq
+from typing import Dict, Iterable, List, Optional
+
+# Cities kept per heap; queries can ask for at most this many
+DEFAULT_TOP_K = 100
+
+
+class RankedIndex:
+    """Top-k cities by population, overall and per country
+
+    Each heap holds (population, -position, city) entries with the smallest
+    on top and never grows beyond k: a city is pushed only when it beats
+    that entry. position is the city's input position, so earlier cities
+    win ties and every result matches a stable sort of all cities by
+    population descending. Positions must be unique.
+    """
+
+    def __init__(self, k: int = DEFAULT_TOP_K):
+        if k < 1:
+            raise ValueError(f"k must be at least 1, got {k}")
+        self.k = k
+        # Number of cities offered to the index
+        self.added = 0
+        self._overall = []
+        # Insertion order is the order in which countries first appear
+        self._countries = {}
+
+    @classmethod
+    def from_cities(cls, cities: Iterable[Dict], k: int = DEFAULT_TOP_K) -> 'RankedIndex':
+        """Index of an iterable of cities, positioned in iteration order"""
+        index = cls(k)
+        for city in cities:
+            index.add(city)
+        return index
+
+    @classmethod
+    def from_columns(cls, populations, groups, codes, cities, k: int = DEFAULT_TOP_K) -> 'RankedIndex':
+        """Index of cities given as arrays, positioned by row
+
+        codes[groups[i]] is the country of row i and populations[i] its
+        population; cities[i] is looked up only for the rows pushed.
+        """
+        index = cls(k)
+        index.add_columns(populations, groups, codes, cities)
+        return index
+
+    def add(self, city: Dict, position: int = None):
+        """Add a city; position defaults to the number of cities added before"""
+        if position is None:
+            position = self.added
+        self.added += 1
+        self._insert(city, position)
+
+    def _insert(self, city: Dict, position: int):
+        entry = (city['population'], -position, city)
+        self._push(self._overall, entry)
+        heap = self._countries.get(city['country_code'])
+        if heap is None:
+            heap = self._countries[city['country_code']] = []
+        self._push(heap, entry)
+
+    def add_columns(self, populations, groups, codes, cities, start: int = 0):
+        """Add rows given as arrays, row i at position start + i
+
+        Per country, only the rows whose population reaches the country's
+        k-th largest (found with np.partition, no sort) and can still beat
+        its heap are pushed, so the heaps see about k rows per country.
+        """
+        # Imported here: the heaps themselves need only the standard library
+        import numpy as np
+
+        populations = np.asarray(populations)
+        groups = np.asarray(groups, dtype=np.int64)
+        self.added += len(populations)
+        # One stable grouping pass: each country's rows are a block of order,
+        # still in row order
+        order = np.argsort(groups, kind='stable')
+        ends = np.cumsum(np.bincount(groups, minlength=len(codes))[:len(codes)])
+        for g, country in enumerate(codes):
+            rows = order[ends[g - 1] if g else 0:ends[g]]
+            if not len(rows):
+                continue
+            country_pops = populations[rows]
+            if len(rows) > self.k:
+                threshold = np.partition(country_pops, len(rows) - self.k)[len(rows) - self.k]
+                heap = self._countries.get(str(country))
+                if heap is not None and len(heap) == self.k:
+                    threshold = max(threshold, heap[0][0])
+                rows = rows[country_pops >= threshold]
+            for row in rows.tolist():
+                self._insert(cities[row], start + row)
+
+    def _push(self, heap: List, entry):
+        if len(heap) < self.k:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+
+    def top(self, k: int = None, country: str = None, min_population: int = None) -> List[Dict]:
+        """The k most populous cities, largest first
+
+        country restricts them to one country and min_population to cities
+        with at least that population, so fewer than k may be returned. k
+        defaults to, and may not exceed, the index's k.
+        """
+        if k is None:
+            k = self.k
+        if k > self.k:
+            raise ValueError(f"The index keeps the top {self.k} cities, {k} were requested")
+        heap = self._overall if country is None else self._countries.get(country, [])
+        ranked = heapq.nlargest(k, heap)
+        if min_population is not None:
+            ranked = [entry for entry in ranked if entry[0] >= min_population]
+        return [city for _, _, city in ranked]
+
+    def largest(self, country: str = None) -> Optional[Dict]:
+        """Most populous city overall or of one country (the first on ties), None if there is none"""
+        heap = self._overall if country is None else self._countries.get(country)
+        return max(heap)[2] if heap else None
+
+    def countries(self) -> List[str]:
+        """Countries in order of first appearance"""
+        return list(self._countries)
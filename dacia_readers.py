@@ -0,0 +1,301 @@
+"""
+Input readers for GeoNames dumps
+Streams lines from plain files or straight out of .zip, .gz and .zst
+archives, and scans newline-delimited byte records with NumPy so only the
+coordinate columns are decoded before a row is known to be worth parsing
+"""
+
+import gzip
+import io
+import mmap
+import os
+import zipfile
+from typing import Iterator, Tuple
+import numpy as np
+
+# Extensions read through a decompressor
+COMPRESSED_EXTENSIONS = ('.zip', '.gz', '.zst')
+
+# Bytes scanned per NumPy pass; lines are never split across passes
+DEFAULT_WINDOW_SIZE = 64 << 20
+
+# Minimum tabs of a line parse_city_line accepts (19 fields)
+MIN_TABS = 18
+
+# Longest coordinate field converted in the vectorized path
+MAX_FLOAT_WIDTH = 24
+
+# Digits of a decimal converted exactly with integer arithmetic (< 2**53)
+MAX_EXACT_DIGITS = 15
+
+# Exact powers of ten, float(10 ** k) for k up to MAX_EXACT_DIGITS
+_POWERS_OF_TEN = np.array([float(10 ** k) for k in range(MAX_EXACT_DIGITS + 1)])
+
+# First and last bytes of a line that str.strip() leaves alone
+_PLAIN_BYTES = np.zeros(256, dtype=bool)
+_PLAIN_BYTES[33:127] = True
+
+
+def is_compressed(path: str) -> bool:
+    """Whether path is read through a decompressor"""
+    return path.lower().endswith(COMPRESSED_EXTENSIONS)
+
+
+def open_binary(path: str, member: str = None):
+    """Open a plain or compressed cities file as a binary stream
+
+    For a .zip archive, member names the file inside it; by default it is
+    the member named like the archive (cities500.zip -> cities500.txt), or
+    the only .txt member that is not a readme.
+    """
+    lower = path.lower()
+    if lower.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if lower.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(f"Reading {path} requires the zstandard package (pip install zstandard)")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    if lower.endswith('.zip'):
+        # The member keeps the archive's file open until it is closed itself
+        with zipfile.ZipFile(path) as archive:
+            return archive.open(member or _zip_member(archive, path))
+    return open(path, 'rb')
+
+
+def _zip_member(archive: zipfile.ZipFile, path: str) -> str:
+    """Name of the cities member of a zip archive"""
+    names = [info.filename for info in archive.infolist() if not info.is_dir()]
+    expected = os.path.splitext(os.path.basename(path))[0] + '.txt'
+    if expected in names:
+        return expected
+    candidates = [name for name in names
+                  if name.lower().endswith('.txt') and 'readme' not in name.lower()]
+    if len(candidates) != 1:
+        raise ValueError(f"Cannot tell which member of {path} to read, pass member= ({names})")
+    return candidates[0]
+
+
+def open_text(path: str, member: str = None) -> io.TextIOBase:
+    """Open a plain or compressed cities file like open(path, 'r', encoding='utf-8')"""
+    if not is_compressed(path):
+        return open(path, 'r', encoding='utf-8')
+    return io.TextIOWrapper(open_binary(path, member), encoding='utf-8')
+
+
+class LineChunk:
+    """Consecutive lines of a byte buffer, decoded only on access
+
+    Supports len() and indexing like the list of lines read in text mode
+    (without the newline). coordinates holds the indices of the lines
+    parse_city_line would accept and their longitudes and latitudes, so the
+    containment test runs before any line is decoded.
+    """
+
+    def __init__(self, data, starts: np.ndarray, ends: np.ndarray,
+                 coordinates: Tuple[np.ndarray, np.ndarray, np.ndarray]):
+        self.data = data
+        # Lists: indexing them is much cheaper than indexing arrays
+        self.starts = starts.tolist()
+        self.ends = ends.tolist()
+        self.coordinates = coordinates
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, i: int) -> str:
+        return self.data[self.starts[i]:self.ends[i]].decode('utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        return (self[i] for i in range(len(self)))
+
+
+def iter_line_chunks(path: str, chunk_size: int, member: str = None,
+                     window_size: int = DEFAULT_WINDOW_SIZE) -> Iterator[LineChunk]:
+    """Yield the lines of a cities file as LineChunks of at most chunk_size lines
+
+    Plain files are memory-mapped and scanned in place. Compressed files,
+    and plain files containing carriage returns, are read as a stream with
+    newlines translated like text mode does, so the lines are always the
+    ones open(path, 'r') would give.
+    """
+    if not is_compressed(path):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data.find(b'\r') < 0:
+                    yield from _iter_mapped_chunks(data, chunk_size, window_size)
+                    return
+
+    with open_binary(path, member) as stream:
+        carry = b''
+        for block in _read_blocks(stream, window_size):
+            buffer = carry + block if carry else block
+            consumed = yield from _scan_lines(buffer, 0, len(buffer), chunk_size, final=False)
+            carry = buffer[consumed:]
+        if carry:
+            yield from _scan_lines(carry, 0, len(carry), chunk_size, final=True)
+
+
+def _iter_mapped_chunks(data: mmap.mmap, chunk_size: int, window_size: int) -> Iterator[LineChunk]:
+    """Scan a mapped file window by window, each ending at a newline"""
+    size = len(data)
+    position = 0
+    while position < size:
+        stop = min(position + window_size, size)
+        consumed = yield from _scan_lines(data, position, stop, chunk_size, final=stop == size)
+        if consumed == position:
+            # No newline in the window: a single line longer than it
+            window_size *= 2
+        position = consumed
+
+
+def _read_blocks(stream, block_size: int) -> Iterator[bytes]:
+    """Read a binary stream in blocks with \\r\\n and \\r translated to \\n"""
+    pending = b''
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            if pending:
+                yield b'\n'
+            return
+        block = pending + block
+        pending = b''
+        # A \r at the end may be the first half of a \r\n
+        if block.endswith(b'\r'):
+            block, pending = block[:-1], b'\r'
+        if b'\r' in block:
+            block = block.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+        yield block
+
+
+def _scan_lines(data, start: int, stop: int, chunk_size: int, final: bool):
+    """Yield LineChunks of the complete lines in data[start:stop]
+
+    One pass finds every tab and newline; a line's tabs are the separators
+    between its newline and the previous one. With final=True the bytes
+    after the last newline form a line too. Returns the offset after the
+    last line yielded.
+    """
+    view = np.frombuffer(data, dtype=np.uint8, count=stop - start, offset=start)
+    separators = np.flatnonzero(view <= 10)
+    kinds = view[separators]
+    separators = separators[kinds >= 9]
+    newlines = np.flatnonzero(kinds[kinds >= 9] == 10)
+    if final and len(view) and view[-1] != 10:
+        # The last line has no newline: end it at the end of the data
+        separators = np.append(separators, len(view))
+        newlines = np.append(newlines, len(separators) - 1)
+    if len(newlines) == 0:
+        return start
+
+    ends = separators[newlines]
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    first_tabs = np.empty_like(newlines)
+    first_tabs[0] = 0
+    first_tabs[1:] = newlines[:-1] + 1
+    n_tabs = newlines - first_tabs
+
+    for first in range(0, len(ends), chunk_size):
+        lines = slice(first, first + chunk_size)
+        coordinates = _scan_coordinates(data, view, separators, first_tabs[lines], n_tabs[lines],
+                                        starts[lines], ends[lines], start)
+        yield LineChunk(data, starts[lines] + start, ends[lines] + start, coordinates)
+
+    return min(start + int(ends[-1]) + 1, stop)
+
+
+def _scan_coordinates(data, view: np.ndarray, separators: np.ndarray, first_tabs: np.ndarray,
+                      n_tabs: np.ndarray, starts: np.ndarray, ends: np.ndarray,
+                      base: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Indices, longitudes and latitudes of the lines parse_city_line accepts
+
+    Fields are located from the tab positions alone. Lines whose first or
+    last byte str.strip() could remove are decoded and split like the text
+    path; for all others only fields 4 and 5 are converted.
+    """
+    candidates = np.flatnonzero(n_tabs >= MIN_TABS)
+    # Lines with 18+ tabs are never empty
+    plain = (_PLAIN_BYTES[view[starts[candidates]]] &
+             _PLAIN_BYTES[view[ends[candidates] - 1]])
+
+    regular = candidates[plain]
+    field_tabs = separators[first_tabs[regular, None] + np.arange(3, 6)]
+    lats, lat_ok = _parse_float_fields(data, view, field_tabs[:, 0] + 1, field_tabs[:, 1], base)
+    lons, lon_ok = _parse_float_fields(data, view, field_tabs[:, 1] + 1, field_tabs[:, 2], base)
+    ok = lat_ok & lon_ok
+    indices, lons, lats = regular[ok], lons[ok], lats[ok]
+
+    stripped = candidates[~plain]
+    if len(stripped):
+        extra = []
+        for i in stripped:
+            fields = data[base + starts[i]:base + ends[i]].decode('utf-8').strip().split('\t')
+            if len(fields) < 19:
+                continue
+            try:
+                extra.append((i, float(fields[5]), float(fields[4])))
+            except ValueError:
+                continue
+        if extra:
+            extra_indices, extra_lons, extra_lats = (np.array(column) for column in zip(*extra))
+            order = np.argsort(np.concatenate([indices, extra_indices]), kind='stable')
+            indices = np.concatenate([indices, extra_indices])[order]
+            lons = np.concatenate([lons, extra_lons])[order]
+            lats = np.concatenate([lats, extra_lats])[order]
+
+    return indices.astype(np.int64), lons.astype(np.float64), lats.astype(np.float64)
+
+
+def _parse_float_fields(data, view: np.ndarray, starts: np.ndarray, ends: np.ndarray,
+                        base: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Convert byte fields to floats exactly like float(); returns values and a valid mask
+
+    Plain decimals ([-+]digits[.digits], at most 15 digits) are converted
+    with integer arithmetic: the digits form an exact int64 mantissa and
+    dividing it by an exact power of ten rounds once, like float() does.
+    Anything else goes through float() itself.
+    """
+    n = len(starts)
+    values = np.zeros(n, dtype=np.float64)
+    ok = np.zeros(n, dtype=bool)
+    if n == 0:
+        return values, ok
+
+    lengths = ends - starts
+    width = int(min(max(lengths.max(), 1), MAX_FLOAT_WIDTH))
+    # Reading past a field stays inside the buffer: a tab always follows it
+    matrix = view[np.minimum(starts[:, None] + np.arange(width), len(view) - 1)]
+    inside = np.arange(width) < lengths[:, None]
+    digit = (matrix >= 48) & (matrix <= 57) & inside
+    dot = (matrix == 46) & inside
+    sign = ((matrix == 45) | (matrix == 43)) & inside
+    n_digits = digit.sum(axis=1)
+    simple = ((lengths <= width) & (n_digits >= 1) & (n_digits <= MAX_EXACT_DIGITS) &
+              ((digit | dot | sign) == inside).all(axis=1) & (dot.sum(axis=1) <= 1) &
+              ~sign[:, 1:].any(axis=1))
+
+    mantissa = np.zeros(n, dtype=np.int64)
+    scale = np.zeros(n, dtype=np.int64)
+    after_dot = np.zeros(n, dtype=bool)
+    for column in range(width):
+        is_digit = digit[:, column]
+        mantissa = np.where(is_digit, mantissa * 10 + (matrix[:, column].astype(np.int64) - 48), mantissa)
+        after_dot |= dot[:, column]
+        scale += is_digit & after_dot
+    converted = mantissa / _POWERS_OF_TEN[np.minimum(scale, MAX_EXACT_DIGITS)]
+    converted[matrix[:, 0] == 45] *= -1
+    values[simple] = converted[simple]
+    ok[simple] = True
+
+    for i in np.flatnonzero(~simple):
+        try:
+            values[i] = float(data[base + starts[i]:base + ends[i]].decode('utf-8'))
+            ok[i] = True
+        except (ValueError, UnicodeDecodeError):
+            pass
+    return values, ok
@@ -0,0 +1,212 @@
+"""
+Declarative exclusion and population adjustment rules for the city filter
+Rules are read from JSON (or YAML when PyYAML is installed), compiled once and
+evaluated either per city or as NumPy masks over a whole chunk
+"""
+
+import json
+import re
+from typing import Dict, List, Tuple
+import numpy as np
+
+# The rules that used to be hardcoded in DaciaCityFilter.filter_cities
+DEFAULT_RULES = [
+    {
+        'name': 'exclude_ro_sectors',
+        'description': "Romanian 'Sector' cities excluded",
+        'action': 'exclude',
+        'when': {'country': ['RO'], 'name_contains': 'sector'},
+    },
+    {
+        'name': 'exclude_ro_hu_low_population',
+        'description': "RO/HU cities with pop < 1000 excluded",
+        'action': 'exclude',
+        'when': {'country': ['RO', 'HU'], 'population_lt': 1000},
+    },
+    {
+        'name': 'scale_ro_hu_population',
+        'description': "RO/HU cities under 300,000 with population scaled by 0.85",
+        'action': 'scale',
+        'factor': 0.85,
+        'when': {'country': ['RO', 'HU'], 'population_lt': 300000},
+    },
+]
+
+ACTIONS = ('exclude', 'scale')
+
+PREDICATES = ('country', 'country_not', 'name_contains', 'name_regex',
+              'population_lt', 'population_gte', 'feature_code')
+
+
+class Rule:
+    """One compiled rule: predicates joined by AND plus an action
+
+    Predicates:
+        country / country_not   list of country codes
+        name_contains           case-insensitive substring of the name
+        name_regex              regular expression searched in the name
+        population_lt / _gte    bounds on the current population
+        feature_code            list of GeoNames feature codes
+    Actions:
+        exclude                 drop the city
+        scale                   population = int(population * factor)
+    """
+
+    def __init__(self, name: str, action: str, when: Dict = None, factor: float = None,
+                 description: str = None):
+        if action not in ACTIONS:
+            raise ValueError(f"Rule '{name}': unknown action '{action}'")
+        if action == 'scale' and factor is None:
+            raise ValueError(f"Rule '{name}': scale rules need a factor")
+        when = when or {}
+        unknown = set(when) - set(PREDICATES)
+        if unknown:
+            raise ValueError(f"Rule '{name}': unknown predicates {sorted(unknown)}")
+
+        self.name = name
+        self.action = action
+        self.factor = factor
+        self.description = description or name
+
+        # Compile every predicate once
+        self.countries = frozenset(when['country']) if 'country' in when else None
+        self.excluded_countries = frozenset(when['country_not']) if 'country_not' in when else None
+        self.name_contains = when['name_contains'].lower() if 'name_contains' in when else None
+        self.name_regex = re.compile(when['name_regex']) if 'name_regex' in when else None
+        self.population_lt = when.get('population_lt')
+        self.population_gte = when.get('population_gte')
+        self.feature_codes = frozenset(when['feature_code']) if 'feature_code' in when else None
+
+    def matches(self, city: Dict) -> bool:
+        """Check the predicates against a single city"""
+        if self.countries is not None and city['country_code'] not in self.countries:
+            return False
+        if self.excluded_countries is not None and city['country_code'] in self.excluded_countries:
+            return False
+        if self.population_lt is not None and not city['population'] < self.population_lt:
+            return False
+        if self.population_gte is not None and not city['population'] >= self.population_gte:
+            return False
+        if self.feature_codes is not None and city['feature_code'] not in self.feature_codes:
+            return False
+        if self.name_contains is not None and self.name_contains not in city['name'].lower():
+            return False
+        if self.name_regex is not None and not self.name_regex.search(city['name']):
+            return False
+        return True
+
+    def mask(self, columns: Dict[str, np.ndarray], populations: np.ndarray,
+             candidates: np.ndarray) -> np.ndarray:
+        """Vectorized predicates over the candidate rows of a chunk
+
+        columns holds 'country_code', 'name' and 'feature_code' arrays,
+        populations the current populations. The cheap array predicates run
+        first so the name predicates only look at the remaining rows.
+        """
+        mask = candidates.copy()
+        if self.countries is not None:
+            mask &= np.isin(columns['country_code'], list(self.countries))
+        if self.excluded_countries is not None:
+            mask &= ~np.isin(columns['country_code'], list(self.excluded_countries))
+        if self.population_lt is not None:
+            mask &= populations < self.population_lt
+        if self.population_gte is not None:
+            mask &= populations >= self.population_gte
+        if self.feature_codes is not None:
+            mask &= np.isin(columns['feature_code'], list(self.feature_codes))
+
+        if self.name_contains is not None or self.name_regex is not None:
+            rows = np.flatnonzero(mask)
+            names = columns['name'][rows]
+            if self.name_contains is not None and len(rows):
+                # str.lower, not np.char.lower: a lowercased name can be longer
+                # than the fixed-width dtype of the chunk and would be cut off
+                found = np.fromiter((self.name_contains in n.lower() for n in names),
+                                    dtype=bool, count=len(names))
+                rows, names = rows[found], names[found]
+                mask[:] = False
+                mask[rows] = True
+            if self.name_regex is not None and len(rows):
+                found = np.fromiter((self.name_regex.search(n) is not None for n in names),
+                                    dtype=bool, count=len(names))
+                mask[:] = False
+                mask[rows[found]] = True
+        return mask
+
+    def scale(self, population: int) -> int:
+        """Apply the scale factor to one population"""
+        return int(population * self.factor)
+
+
+class RuleSet:
+    """Ordered list of rules applied one after the other
+
+    Each rule only sees the cities that earlier rules kept, with the
+    populations as adjusted by earlier scale rules. Every evaluation adds
+    the number of matching cities per rule to the given counts.
+    """
+
+    def __init__(self, rules: List[Rule]):
+        self.rules = rules
+
+    @classmethod
+    def from_config(cls, config) -> 'RuleSet':
+        """Compile rules from a list of dicts or {'rules': [...]}"""
+        if isinstance(config, dict):
+            config = config.get('rules', [])
+        return cls([Rule(**rule) for rule in config])
+
+    @classmethod
+    def from_file(cls, rules_file: str) -> 'RuleSet':
+        """Load and compile a JSON or YAML rule file"""
+        with open(rules_file, 'r', encoding='utf-8') as f:
+            if rules_file.endswith(('.yaml', '.yml')):
+                try:
+                    import yaml
+                except ImportError:
+                    raise ImportError("PyYAML is required for YAML rule files: pip install pyyaml")
+                config = yaml.safe_load(f)
+            else:
+                config = json.load(f)
+        return cls.from_config(config)
+
+    @classmethod
+    def default(cls) -> 'RuleSet':
+        """The built-in RO/HU rules"""
+        return cls.from_config(DEFAULT_RULES)
+
+    def new_counts(self) -> Dict[str, int]:
+        """Zeroed per-rule match counts, in rule order"""
+        return {rule.name: 0 for rule in self.rules}
+
+    def apply(self, city: Dict, counts: Dict[str, int]) -> bool:
+        """Apply the rules to one city; returns False if it is excluded"""
+        for rule in self.rules:
+            if rule.matches(city):
+                counts[rule.name] += 1
+                if rule.action == 'exclude':
+                    return False
+                city['population'] = rule.scale(city['population'])
+        return True
+
+    def apply_arrays(self, columns: Dict[str, np.ndarray], populations: np.ndarray,
+                     counts: Dict[str, int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Apply the rules to a chunk given as arrays
+
+        Returns the mask of kept rows and the adjusted populations.
+        """
+        keep = np.ones(len(populations), dtype=bool)
+        populations = np.asarray(populations, dtype=np.int64)
+        for rule in self.rules:
+            matched = rule.mask(columns, populations, keep)
+            counts[rule.name] += int(matched.sum())
+            if rule.action == 'exclude':
+                keep &= ~matched
+            else:
+                # Same float multiply and truncation toward zero as int()
+                populations = np.where(matched, (populations * rule.factor).astype(np.int64), populations)
+        return keep, populations
+
+    def descriptions(self) -> Dict[str, str]:
+        """Rule name to description"""
+        return {rule.name: rule.description for rule in self.rules}
@@ -0,0 +1,288 @@
+"""
+Spatial query index over filtered cities
+Radius and k-nearest-neighbour searches with haversine distances, backed by
+a fixed lat/lon cell grid that can be saved to and loaded from a .npz file
+"""
+
+import csv
+import math
+from typing import Dict, Iterable, List
+import numpy as np
+
+# Mean Earth radius in kilometers
+EARTH_RADIUS_KM = 6371.0088
+
+# Default grid cell size in degrees
+DEFAULT_CELL_DEG = 0.25
+
+
+def haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Great-circle distance in km between points given in degrees"""
+    lat1, lon1, lat2, lon2 = (np.radians(v) for v in (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2 +
+         np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class CitySpatialIndex:
+    """Grid index over city coordinates for radius and kNN queries
+
+    Cities are bucketed into cells of cell_deg x cell_deg degrees and stored
+    sorted by cell, so a query only computes distances for the cities in
+    the cells overlapping its search circle. Queries can be restricted to a
+    minimum population and a set of countries.
+    """
+
+    def __init__(self, geonameid: np.ndarray, names: np.ndarray, country_codes: np.ndarray,
+                 latitude: np.ndarray, longitude: np.ndarray, population: np.ndarray,
+                 cell_deg: float = DEFAULT_CELL_DEG):
+        self.cell_deg = cell_deg
+        self.n_cols = int(math.ceil(360 / cell_deg))
+
+        keys = self._cell_keys(np.asarray(latitude, dtype=np.float64),
+                               np.asarray(longitude, dtype=np.float64))
+        order = np.argsort(keys, kind='stable')
+
+        self.geonameid = np.asarray(geonameid)[order]
+        self.names = np.asarray(names)[order]
+        self.country_codes = np.asarray(country_codes)[order]
+        self.latitude = np.asarray(latitude, dtype=np.float64)[order]
+        self.longitude = np.asarray(longitude, dtype=np.float64)[order]
+        self.population = np.asarray(population, dtype=np.int64)[order]
+        self.cell_keys, self.cell_starts = np.unique(keys[order], return_index=True)
+        self.cell_ends = np.append(self.cell_starts[1:], len(order))
+
+    @classmethod
+    def from_cities(cls, cities: Iterable[Dict], cell_deg: float = DEFAULT_CELL_DEG) -> 'CitySpatialIndex':
+        """Build from city dicts, e.g. DaciaCityFilter.cities_in_polygon"""
+        cities = list(cities)
+        return cls(np.array([str(c['geonameid']) for c in cities]),
+                   np.array([c['name'] for c in cities]),
+                   np.array([c['country_code'] for c in cities]),
+                   np.array([float(c['latitude']) for c in cities]),
+                   np.array([float(c['longitude']) for c in cities]),
+                   np.array([int(c['population']) if c['population'] else 0 for c in cities]),
+                   cell_deg)
+
+    @classmethod
+    def from_csv(cls, csv_file: str, cell_deg: float = DEFAULT_CELL_DEG) -> 'CitySpatialIndex':
+        """Build from a dacia_cities CSV file"""
+        with open(csv_file, 'r', encoding='utf-8') as f:
+            return cls.from_cities(csv.DictReader(f), cell_deg)
+
+    def save(self, index_file: str):
+        """Serialize the index to a .npz file"""
+        np.savez(index_file, cell_deg=self.cell_deg, geonameid=self.geonameid, names=self.names,
+                 country_codes=self.country_codes, latitude=self.latitude,
+                 longitude=self.longitude, population=self.population,
+                 cell_keys=self.cell_keys, cell_starts=self.cell_starts)
+
+    @classmethod
+    def load(cls, index_file: str) -> 'CitySpatialIndex':
+        """Load an index written by save without rebuilding it"""
+        data = np.load(index_file)
+        index = cls.__new__(cls)
+        index.cell_deg = float(data['cell_deg'])
+        index.n_cols = int(math.ceil(360 / index.cell_deg))
+        for name in ('geonameid', 'names', 'country_codes', 'latitude', 'longitude',
+                     'population', 'cell_keys', 'cell_starts'):
+            setattr(index, name, data[name])
+        index.cell_ends = np.append(index.cell_starts[1:], len(index.latitude))
+        return index
+
+    def __len__(self) -> int:
+        return len(self.latitude)
+
+    def _cell_keys(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        """Cell key of each coordinate"""
+        rows = np.floor((lat + 90) / self.cell_deg).astype(np.int64)
+        cols = np.floor((lon + 180) / self.cell_deg).astype(np.int64) % self.n_cols
+        return rows * self.n_cols + cols
+
+    def _candidates(self, lat: float, lon: float, radius_km: float) -> np.ndarray:
+        """Indices of the cities in all cells overlapping the search circle"""
+        dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+        min_row = int(math.floor((max(lat - dlat, -90) + 90) / self.cell_deg))
+        max_row = int(math.floor((min(lat + dlat, 90) + 90) / self.cell_deg))
+
+        # Widest longitude span of the circle, over the latitudes it covers
+        max_abs_lat = min(abs(lat) + dlat, 90)
+        cos_lat = math.cos(math.radians(max_abs_lat))
+        if max_abs_lat >= 89.9 or dlat / max(cos_lat, 1e-12) >= 180:
+            cols = np.arange(self.n_cols)
+        else:
+            dlon = dlat / cos_lat
+            first = int(math.floor((lon - dlon + 180) / self.cell_deg))
+            last = int(math.floor((lon + dlon + 180) / self.cell_deg))
+            cols = np.unique(np.arange(first, last + 1) % self.n_cols)
+
+        keys = (np.arange(min_row, max_row + 1)[:, None] * self.n_cols + cols[None, :]).ravel()
+        pos = np.searchsorted(self.cell_keys, keys)
+        found = pos < len(self.cell_keys)
+        pos, keys = pos[found], keys[found]
+        pos = pos[self.cell_keys[pos] == keys]
+        if len(pos) == 0:
+            return np.array([], dtype=np.int64)
+        return np.concatenate([np.arange(self.cell_starts[p], self.cell_ends[p]) for p in pos])
+
+    def _filter(self, idx: np.ndarray, min_population: int, countries) -> np.ndarray:
+        """Apply the population and country predicates to candidate indices"""
+        if min_population is not None:
+            idx = idx[self.population[idx] >= min_population]
+        if countries is not None:
+            idx = idx[np.isin(self.country_codes[idx], list(countries))]
+        return idx
+
+    def _results(self, idx: np.ndarray, distances: np.ndarray) -> List[Dict]:
+        """Result dicts for indices already ordered by distance"""
+        return [{
+            'geonameid': str(self.geonameid[i]),
+            'name': str(self.names[i]),
+            'country_code': str(self.country_codes[i]),
+            'latitude': float(self.latitude[i]),
+            'longitude': float(self.longitude[i]),
+            'population': int(self.population[i]),
+            'distance_km': float(d),
+        } for i, d in zip(idx, distances)]
+
+    def radius(self, lat: float, lon: float, radius_km: float,
+               min_population: int = None, countries=None) -> List[Dict]:
+        """Cities within radius_km of a point, nearest first"""
+        idx = self._filter(self._candidates(lat, lon, radius_km), min_population, countries)
+        distances = haversine_km(lat, lon, self.latitude[idx], self.longitude[idx])
+        inside = distances <= radius_km
+        idx, distances = idx[inside], distances[inside]
+        order = np.argsort(distances, kind='stable')
+        return self._results(idx[order], distances[order])
+
+    def nearest(self, lat: float, lon: float, k: int,
+                min_population: int = None, countries=None) -> List[Dict]:
+        """The k cities nearest to a point, nearest first"""
+        radius_km = self.cell_deg * 111.0
+        max_radius_km = math.pi * EARTH_RADIUS_KM
+        while True:
+            idx = self._filter(self._candidates(lat, lon, radius_km), min_population, countries)
+            distances = haversine_km(lat, lon, self.latitude[idx], self.longitude[idx])
+            # Every city within radius_km is a candidate, so once k of them
+            # are inside the circle they are the k nearest
+            if np.count_nonzero(distances <= radius_km) >= k or radius_km >= max_radius_km:
+                order = np.argsort(distances, kind='stable')[:k]
+                return self._results(idx[order], distances[order])
+            radius_km = min(radius_km * 2, max_radius_km)
+
+    def _batch_candidates(self, lats: np.ndarray, lons: np.ndarray, radii: np.ndarray,
+                          min_population: int, countries):
+        """Candidate cities of many search circles at once
+
+        Same cells as _candidates, computed for all points in one step.
+        Cities are sorted by cell, so the cells of one grid row that a circle
+        covers are one slice of cities, or two when the circle wraps around
+        the antimeridian. Returns (point, city) index pairs grouped by point,
+        in the order _candidates lists them, and their distances in km.
+        """
+        dlat = np.degrees(radii / EARTH_RADIUS_KM)
+        min_row = np.floor((np.maximum(lats - dlat, -90) + 90) / self.cell_deg).astype(np.int64)
+        max_row = np.floor((np.minimum(lats + dlat, 90) + 90) / self.cell_deg).astype(np.int64)
+
+        max_abs_lat = np.minimum(np.abs(lats) + dlat, 90)
+        cos_lat = np.cos(np.radians(max_abs_lat))
+        all_cols = (max_abs_lat >= 89.9) | (dlat / np.maximum(cos_lat, 1e-12) >= 180)
+        dlon = np.where(all_cols, 0, dlat / np.where(all_cols, 1, cos_lat))
+        first = np.floor((lons - dlon + 180) / self.cell_deg).astype(np.int64)
+        last = np.floor((lons + dlon + 180) / self.cell_deg).astype(np.int64)
+        all_cols |= last - first + 1 >= self.n_cols
+        first, last = first % self.n_cols, last % self.n_cols
+        wraps = ~all_cols & (first > last)
+
+        # Column ranges per point: [lo, hi] and, when wrapping, a second one
+        # (the low columns come first, as in _candidates)
+        lo = np.column_stack([np.where(all_cols | wraps, 0, first), first])
+        hi = np.column_stack([np.where(all_cols, self.n_cols - 1, last),
+                              np.full(len(lats), self.n_cols - 1)])
+        used = np.column_stack([np.ones(len(lats), dtype=bool), wraps])
+
+        # City slices of every (point, row, range), in that order
+        point, offset = _expand(np.arange(len(lats)), max_row - min_row + 1)
+        row_base = ((min_row[point] + offset) * self.n_cols)[:, None]
+        bounds = np.append(self.cell_starts, len(self.latitude))
+        starts = bounds[np.searchsorted(self.cell_keys, row_base + lo[point], side='left')]
+        ends = bounds[np.searchsorted(self.cell_keys, row_base + hi[point], side='right')]
+        counts = np.where(used[point], ends - starts, 0).ravel()
+
+        point, offset = _expand(np.repeat(point, 2), counts)
+        idx = np.repeat(starts.ravel(), counts) + offset
+        if min_population is not None:
+            keep = self.population[idx] >= min_population
+            point, idx = point[keep], idx[keep]
+        if countries is not None:
+            keep = np.isin(self.country_codes[idx], list(countries))
+            point, idx = point[keep], idx[keep]
+        distances = haversine_km(lats[point], lons[point], self.latitude[idx], self.longitude[idx])
+        return point, idx, distances
+
+    def query_radius(self, lats, lons, radius_km: float, min_population: int = None,
+                     countries=None) -> List[List[Dict]]:
+        """Batched radius queries, one result list per point
+
+        All points are answered with one set of array operations over the
+        grid cells, with the same results as calling radius for each point.
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        point, idx, distances = self._batch_candidates(
+            lats, lons, np.full(len(lats), radius_km, dtype=np.float64), min_population, countries)
+        inside = distances <= radius_km
+        point, idx, distances = point[inside], idx[inside], distances[inside]
+        return self._split_results(len(lats), point, idx, distances)
+
+    def query_nearest(self, lats, lons, k: int, min_population: int = None,
+                      countries=None) -> List[List[Dict]]:
+        """Batched k-nearest queries, one result list per point
+
+        Like nearest, the search radius doubles until k cities are inside
+        it, but every round handles all unfinished points at once.
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        results = [None] * len(lats)
+        max_radius_km = math.pi * EARTH_RADIUS_KM
+        pending = np.arange(len(lats))
+        radii = np.full(len(lats), self.cell_deg * 111.0)
+        while len(pending):
+            point, idx, distances = self._batch_candidates(
+                lats[pending], lons[pending], radii, min_population, countries)
+            within = np.bincount(point[distances <= radii[point]], minlength=len(pending))
+            done = (within >= k) | (radii >= max_radius_km)
+
+            keep = done[point]
+            point, idx, distances = point[keep], idx[keep], distances[keep]
+            # Nearest first within each point, the first k of each
+            order = np.lexsort((distances, point))
+            point, idx, distances = point[order], idx[order], distances[order]
+            starts = np.searchsorted(point, point, side='left')
+            first_k = np.arange(len(point)) - starts < k
+            finished = self._split_results(len(pending), point[first_k], idx[first_k],
+                                           distances[first_k], presorted=True)
+            for i in np.flatnonzero(done):
+                results[pending[i]] = finished[i]
+
+            pending, radii = pending[~done], np.minimum(radii[~done] * 2, max_radius_km)
+        return results
+
+    def _split_results(self, n_points: int, point: np.ndarray, idx: np.ndarray,
+                       distances: np.ndarray, presorted: bool = False) -> List[List[Dict]]:
+        """One nearest-first result list per point from (point, city) pairs"""
+        if not presorted:
+            order = np.lexsort((distances, point))
+            point, idx, distances = point[order], idx[order], distances[order]
+        bounds = np.searchsorted(point, np.arange(n_points + 1))
+        return [self._results(idx[a:b], distances[a:b]) for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def _expand(groups: np.ndarray, counts: np.ndarray):
+    """Repeat each group counts times, with a 0..count-1 offset per copy"""
+    counts = np.asarray(counts, dtype=np.int64)
+    repeated = np.repeat(groups, counts)
+    starts = np.cumsum(counts) - counts
+    offset = np.arange(len(repeated), dtype=np.int64) - np.repeat(starts, counts)
+    return repeated, offset
@@ -0,0 +1,293 @@
+"""
+Mergeable streaming statistics for the city analyzer
+Running count/sum/min/max accumulators and a deterministic quantile sketch
+with a tracked rank error bound, so statistics can be computed chunk by chunk
+and combined across file shards and worker processes
+"""
+
+from typing import Dict, List, Sequence
+import numpy as np
+
+# Sketch compactor capacity: larger is more accurate and uses more memory
+DEFAULT_SKETCH_CAPACITY = 2048
+
+# Up to this many values a sketch keeps everything and is exact
+DEFAULT_EXACT_LIMIT = 1_000_000
+
+# Population thresholds of the overall cities_over_* counts
+OVER_THRESHOLDS = (100000, 50000, 10000)
+
+
+class RunningStats:
+    """Count, sum, min and max of a stream of integers"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add_array(self, values: np.ndarray):
+        """Add a chunk of values"""
+        if len(values) == 0:
+            return
+        self.count += len(values)
+        self.total += int(values.sum())
+        low, high = int(values.min()), int(values.max())
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+    def merge(self, other: 'RunningStats') -> 'RunningStats':
+        """Fold another accumulator into this one"""
+        if other.count:
+            self.count += other.count
+            self.total += other.total
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    @property
+    def mean(self) -> float:
+        """Mean value; the sum is exact, so this matches np.mean"""
+        return self.total / self.count if self.count else 0.0
+
+
+class QuantileSketch:
+    """Deterministic multi-level compactor sketch (KLL/MRL family)
+
+    Values are buffered at level 0. Once more than exact_limit values were
+    seen, any level holding capacity or more items is sorted and halved,
+    keeping every other item (alternating the offset) and promoting them to
+    the next level with twice the weight. Halving a sorted level of weight w
+    moves any rank by at most w, so rank_error, the sum of those weights, is
+    a hard bound on the absolute rank error of every quantile. Until the
+    first compaction the sketch is exact.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_SKETCH_CAPACITY, exact_limit: int = DEFAULT_EXACT_LIMIT):
+        self.capacity = capacity
+        self.exact_limit = exact_limit
+        self.count = 0
+        self.rank_error = 0
+        self.levels = [[]]
+        self._offsets = [0]
+
+    def add_array(self, values: np.ndarray):
+        """Add a chunk of values"""
+        if len(values) == 0:
+            return
+        self.levels[0].append(np.asarray(values, dtype=np.int64))
+        self.count += len(values)
+        self._compress()
+
+    def merge(self, other: 'QuantileSketch') -> 'QuantileSketch':
+        """Fold another sketch into this one"""
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+            self._offsets.append(0)
+        for h, parts in enumerate(other.levels):
+            self.levels[h].extend(parts)
+        self.count += other.count
+        self.rank_error += other.rank_error
+        self._compress()
+        return self
+
+    @property
+    def is_exact(self) -> bool:
+        return self.rank_error == 0
+
+    @property
+    def error_bound(self) -> float:
+        """Bound on the rank error as a fraction of the count"""
+        return self.rank_error / self.count if self.count else 0.0
+
+    def _level(self, h: int) -> np.ndarray:
+        """Items of level h as one array"""
+        parts = self.levels[h]
+        if len(parts) != 1:
+            self.levels[h] = parts = [np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)]
+        return parts[0]
+
+    def _compress(self):
+        """Halve every level at or over capacity, once past the exact limit"""
+        if self.count <= self.exact_limit:
+            return
+        h = 0
+        while h < len(self.levels):
+            items = self._level(h)
+            if len(items) >= self.capacity:
+                items = np.sort(items)
+                # With an odd size the smallest item stays at this level
+                keep, items = items[:len(items) % 2], items[len(items) % 2:]
+                if h + 1 == len(self.levels):
+                    self.levels.append([])
+                    self._offsets.append(0)
+                self.levels[h + 1].append(items[self._offsets[h]::2])
+                self._offsets[h] ^= 1
+                self.levels[h] = [keep]
+                self.rank_error += 1 << h
+            h += 1
+
+    def _weighted_items(self):
+        """All items sorted by value, with their weights"""
+        values = [self._level(h) for h in range(len(self.levels))]
+        weights = [np.full(len(v), 1 << h, dtype=np.int64) for h, v in enumerate(values)]
+        values = np.concatenate(values)
+        order = np.argsort(values, kind='stable')
+        return values[order], np.concatenate(weights)[order]
+
+    def median(self) -> int:
+        """Median as int(np.median) would give it, within the rank error"""
+        if self.count == 0:
+            return 0
+        values, weights = self._weighted_items()
+        if self.is_exact:
+            n = len(values)
+            return int((float(values[(n - 1) // 2]) + float(values[n // 2])) / 2)
+        return self.quantile(0.5)
+
+    def quantile(self, q: float) -> int:
+        """Value at rank q * count"""
+        if self.count == 0:
+            return 0
+        values, weights = self._weighted_items()
+        cumulative = np.cumsum(weights)
+        index = np.searchsorted(cumulative, q * self.count, side='right')
+        return int(values[min(index, len(values) - 1)])
+
+
+class GroupStatistics:
+    """Population and elevation accumulators of one country"""
+
+    def __init__(self, capacity: int, exact_limit: int):
+        self.population = RunningStats()
+        self.population_sketch = QuantileSketch(capacity, exact_limit)
+        self.elevation = RunningStats()
+        self.largest_population = None
+        self.largest_city = 'N/A'
+
+    def add_arrays(self, populations: np.ndarray, elevations: np.ndarray, names: Sequence[str]):
+        """Add one chunk of a country's cities"""
+        self.population.add_array(populations)
+        self.population_sketch.add_array(populations)
+        self.elevation.add_array(elevations[elevations > 0])
+        if len(populations):
+            i = int(np.argmax(populations))
+            self._offer_largest(int(populations[i]), names[i])
+
+    def merge(self, other: 'GroupStatistics') -> 'GroupStatistics':
+        """Fold in the statistics of a later shard"""
+        self.population.merge(other.population)
+        self.population_sketch.merge(other.population_sketch)
+        self.elevation.merge(other.elevation)
+        if other.largest_population is not None:
+            self._offer_largest(other.largest_population, other.largest_city)
+        return self
+
+    def _offer_largest(self, population: int, name: str):
+        # Strictly greater, so the earliest city wins ties like max() does
+        if self.largest_population is None or population > self.largest_population:
+            self.largest_population = population
+            self.largest_city = name
+
+    def to_dict(self) -> Dict:
+        """Entry in the layout of statistics.json['countries']"""
+        population, elevation = self.population, self.elevation
+        return {
+            'city_count': population.count,
+            'total_population': population.total,
+            'avg_population': int(population.mean),
+            'median_population': self.population_sketch.median(),
+            'median_population_error': self.population_sketch.error_bound,
+            'max_population': population.max or 0,
+            'min_population': population.min or 0,
+            'avg_elevation': int(elevation.mean),
+            'max_elevation': elevation.max or 0,
+            'largest_city': self.largest_city
+        }
+
+
+class StatisticsAccumulator:
+    """Mergeable accumulator of everything in statistics.json
+
+    Chunks are added in file order; merge folds in the accumulator of a
+    later shard, so shards processed in separate processes and merged in
+    order give the same country order and largest cities as one pass.
+    """
+
+    def __init__(self, bucket_edges: List[float], capacity: int = DEFAULT_SKETCH_CAPACITY,
+                 exact_limit: int = DEFAULT_EXACT_LIMIT):
+        self.capacity = capacity
+        self.exact_limit = exact_limit
+        self.bucket_edges = list(bucket_edges)
+        self.countries = {}
+        self.population = RunningStats()
+        self.population_sketch = QuantileSketch(capacity, exact_limit)
+        self.elevation = RunningStats()
+        self.over_counts = np.zeros(len(OVER_THRESHOLDS), dtype=np.int64)
+        self.bucket_counts = np.zeros(len(self.bucket_edges) - 1, dtype=np.int64)
+
+    def add_chunk(self, country_codes: Sequence[str], populations: np.ndarray,
+                  elevations: np.ndarray, names: Sequence[str]):
+        """Add a chunk of cities given as parallel columns"""
+        country_codes = np.asarray(country_codes, dtype=str)
+        if len(country_codes) == 0:
+            return
+        codes, first, groups = np.unique(country_codes, return_index=True, return_inverse=True)
+        groups = groups.ravel()
+        order = np.argsort(groups, kind='stable')
+        bounds = np.cumsum(np.bincount(groups, minlength=len(codes)))[:-1]
+        rows_by_group = np.split(order, bounds)
+
+        # Countries in order of first appearance within the chunk
+        for g in np.argsort(first):
+            rows = rows_by_group[g]
+            country = self.countries.get(str(codes[g]))
+            if country is None:
+                country = self.countries[str(codes[g])] = GroupStatistics(self.capacity, self.exact_limit)
+            country.add_arrays(populations[rows], elevations[rows], [names[i] for i in rows])
+
+        self.population.add_array(populations)
+        self.population_sketch.add_array(populations)
+        self.elevation.add_array(elevations[elevations > 0])
+
+        sorted_pops = np.sort(populations)
+        self.over_counts += len(sorted_pops) - np.searchsorted(sorted_pops, OVER_THRESHOLDS, side='right')
+        self.bucket_counts += np.diff(np.searchsorted(sorted_pops, self.bucket_edges))
+
+    def merge(self, other: 'StatisticsAccumulator') -> 'StatisticsAccumulator':
+        """Fold in the accumulator of a later shard"""
+        for code, group in other.countries.items():
+            if code in self.countries:
+                self.countries[code].merge(group)
+            else:
+                self.countries[code] = group
+        self.population.merge(other.population)
+        self.population_sketch.merge(other.population_sketch)
+        self.elevation.merge(other.elevation)
+        self.over_counts += other.over_counts
+        self.bucket_counts += other.bucket_counts
+        return self
+
+    def to_statistics(self) -> Dict:
+        """Statistics in the layout of statistics.json, with median errors
+
+        The median_population_error entries bound the rank error of the
+        median as a fraction of the city count; 0.0 means exact.
+        """
+        population, elevation = self.population, self.elevation
+        return {
+            'total_cities': population.count,
+            'total_population': population.total,
+            'countries': {code: group.to_dict() for code, group in self.countries.items()},
+            'overall': {
+                'avg_population': int(population.mean),
+                'median_population': self.population_sketch.median(),
+                'median_population_error': self.population_sketch.error_bound,
+                'avg_elevation': int(elevation.mean),
+                'max_elevation': elevation.max or 0,
+                'cities_over_100k': int(self.over_counts[0]),
+                'cities_over_50k': int(self.over_counts[1]),
+                'cities_over_10k': int(self.over_counts[2]),
+            }
+        }
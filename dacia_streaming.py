@@ -0,0 +1,200 @@
+"""
+Constant-memory building blocks for the streaming filter pipeline
+Sorted CSV sinks that spill to disk and incrementally maintained summaries
+"""
+
+import csv
+import heapq
+import os
+import tempfile
+from typing import Dict, Iterable, List
+from dacia_ranking import RankedIndex
+
+# Columns written to the output CSV files
+CSV_FIELDNAMES = [
+    'geonameid', 'name', 'asciiname', 'country_code',
+    'latitude', 'longitude', 'population', 'elevation',
+    'admin1_code', 'admin2_code'
+]
+
+# Columns appended once border distances are calculated (see dacia_border_distance)
+BORDER_FIELDNAMES = ['border_distance_km', 'border_band']
+
+# Rows buffered per sink before a sorted run is spilled to disk
+DEFAULT_RUN_SIZE = 20000
+
+# Number of cities listed in the summary report
+SUMMARY_TOP_N = 20
+
+
+class SortedCsvSink:
+    """CSV writer that orders rows by population (descending) in bounded memory
+
+    Rows are buffered and spilled to temporary files as sorted runs, then
+    merged into the output file on close. The merge is stable, so ties keep
+    their input order exactly like sorted(cities, key=lambda x: -x['population']).
+    """
+
+    def __init__(self, output_file: str, temp_dir: str, run_size: int = DEFAULT_RUN_SIZE,
+                 fieldnames: List[str] = CSV_FIELDNAMES):
+        self.output_file = output_file
+        self.fieldnames = fieldnames
+        self.temp_dir = temp_dir
+        self.run_size = run_size
+        self.count = 0
+        self._buffer = []
+        self._runs = []
+
+    def write(self, city: Dict):
+        """Add a city to the sink"""
+        row = [city[field] for field in self.fieldnames]
+        self._buffer.append(row)
+        self.count += 1
+        if len(self._buffer) >= self.run_size:
+            self._spill()
+
+    def _spill(self):
+        """Write the sorted buffer to a temporary run file"""
+        self._buffer.sort(key=_descending_population)
+        fd, path = tempfile.mkstemp(suffix='.csv', dir=self.temp_dir)
+        with os.fdopen(fd, 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows(self._buffer)
+        self._runs.append(path)
+        self._buffer = []
+
+    def close(self):
+        """Merge all runs into the output file and remove them"""
+        self._buffer.sort(key=_descending_population)
+        run_files = [open(path, 'r', newline='', encoding='utf-8') for path in self._runs]
+        try:
+            # Earlier runs come first, so heapq.merge keeps ties in input order
+            runs = [csv.reader(f) for f in run_files] + [iter(self._buffer)]
+            with open(self.output_file, 'w', newline='', encoding='utf-8', buffering=1 << 20) as f:
+                writer = csv.writer(f)
+                writer.writerow(self.fieldnames)
+                writer.writerows(heapq.merge(*runs, key=_descending_population))
+        finally:
+            for f in run_files:
+                f.close()
+            for path in self._runs:
+                os.remove(path)
+        self._buffer = []
+        self._runs = []
+
+
+def _descending_population(row: List) -> int:
+    """Sort key of a buffered row: population, largest first"""
+    return -int(row[6])
+
+
+def concatenate_csv_files(output_file: str, input_files: Iterable[str]):
+    """Write the header once followed by the rows of each input file in order"""
+    with open(output_file, 'wb') as out:
+        header_written = False
+        for path in input_files:
+            with open(path, 'rb') as f:
+                header = f.readline()
+                if not header_written:
+                    out.write(header)
+                    header_written = True
+                while True:
+                    block = f.read(1 << 20)
+                    if not block:
+                        break
+                    out.write(block)
+
+
+class CitySummary:
+    """Incrementally maintained aggregates behind the filter summary report
+
+    Holds the city count, per-country count and total, and a RankedIndex
+    of the top_n cities overall and per country, which gives the top list
+    and each country's largest city. The report is produced without
+    keeping or sorting the cities.
+    """
+
+    def __init__(self, top_n: int = SUMMARY_TOP_N):
+        self.top_n = top_n
+        self.total_cities = 0
+        # Insertion order is the order in which countries first appear
+        self.countries = {}
+        self.ranked = RankedIndex(top_n)
+
+    @classmethod
+    def from_cities(cls, cities: Iterable[Dict], top_n: int = SUMMARY_TOP_N) -> 'CitySummary':
+        """Build a summary from an iterable of cities"""
+        summary = cls(top_n)
+        for city in cities:
+            summary.add(city)
+        return summary
+
+    @classmethod
+    def from_groups(cls, groups: Dict[str, List], top_n: int = SUMMARY_TOP_N) -> 'CitySummary':
+        """Build a summary from cities already grouped and sorted by country
+
+        groups maps each country, in order of first appearance, to its
+        (input position, city) pairs sorted by population descending with
+        ties in input order, as produced by DaciaCityFilter.group_cities.
+        No further sorting of the cities is needed.
+        """
+        summary = cls(top_n)
+        for country, cities in groups.items():
+            summary.total_cities += len(cities)
+            summary.countries[country] = {
+                'city_count': len(cities),
+                'total_population': sum(city['population'] for _, city in cities),
+            }
+            # Only the first top_n cities of a country can reach either top
+            for seq, city in cities[:top_n]:
+                summary.ranked.add(city, seq)
+        return summary
+
+    def add(self, city: Dict):
+        """Add one city to the aggregates"""
+        seq = self.total_cities
+        self.total_cities += 1
+
+        country = self.countries.get(city['country_code'])
+        if country is None:
+            self.countries[city['country_code']] = {'city_count': 1, 'total_population': city['population']}
+        else:
+            country['city_count'] += 1
+            country['total_population'] += city['population']
+
+        # Earlier cities win ties, matching a stable sort by -population
+        self.ranked.add(city, seq)
+
+    def top_cities(self) -> List[Dict]:
+        """Top cities by population, largest first"""
+        return self.ranked.top(self.top_n)
+
+    def sorted_countries(self) -> List:
+        """(country, aggregates) pairs ordered by number of cities"""
+        return sorted(self.countries.items(), key=lambda x: x[1]['city_count'], reverse=True)
+
+    def render(self) -> str:
+        """Format the summary report"""
+        summary = []
+        summary.append("\n" + "="*70)
+        summary.append("DACIA CITIES SUMMARY REPORT")
+        summary.append("="*70)
+        summary.append(f"\nTotal cities in Dacia region: {self.total_cities:,}")
+        summary.append(f"Number of countries: {len(self.countries)}")
+
+        summary.append("\n" + "-"*70)
+        summary.append("Top cities by population:")
+        summary.append("-"*70)
+
+        for i, city in enumerate(self.top_cities(), 1):
+            summary.append(f"{i:2d}. {city['name']:30s} ({city['country_code']}) - Pop: {city['population']:,}")
+
+        summary.append("\n" + "-"*70)
+        summary.append("Cities by country:")
+        summary.append("-"*70)
+
+        for country, data in self.sorted_countries():
+            summary.append(f"{country}: {data['city_count']:4d} cities, "
+                           f"Total pop: {data['total_population']:10,}, "
+                           f"Largest: {self.ranked.largest(country)['name']}")
+
+        return "\n".join(summary)
@@ -3,32 +3,111 @@ Filter cities from cities500.txt that fall within the Dacia border polygon
 Categorizes cities by country and saves to CSV
 """
 
+import io
+import os
+import re
 import json
 import csv
+import mmap
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
 from typing import List, Tuple, Dict
-from shapely.geometry import Point, Polygon
+import numpy as np
+import shapely
+from shapely.geometry import Point, Polygon, shape
+from shapely.strtree import STRtree
 from collections import defaultdict
+from dacia_grid_index import PolygonGridIndex, DEFAULT_GRID_RESOLUTION
+from dacia_streaming import (SortedCsvSink, CitySummary, concatenate_csv_files,
+                             CSV_FIELDNAMES, BORDER_FIELDNAMES, DEFAULT_RUN_SIZE)
+from dacia_city_store import CityStore
+from dacia_parse_cache import ParsedDumpCache
+from dacia_rules import RuleSet
+from dacia_metrics import Metrics, timed
+from dacia_readers import open_text, iter_line_chunks, is_compressed
+from dacia_columnar import columnar_path, write_columnar
+from dacia_border_distance import BorderDistanceIndex, DEFAULT_BORDER_BANDS, band_labels, band_indices
+
+# Default number of lines classified per vectorized containment call
+DEFAULT_CHUNK_SIZE = 100000
+
+# Selection of cities500.txt: populated places with at least this many
+# inhabitants, plus administrative seats of any size
+CITIES500_MIN_POPULATION = 500
+CITIES500_SEAT_CODES = frozenset({'PPLA', 'PPLA2', 'PPLA3', 'PPLA4', 'PPLC'})
+
+
+def is_cities500_place(city: Dict) -> bool:
+    """Whether a parsed GeoNames row belongs to the cities500 selection"""
+    if city['feature_class'] != 'P':
+        return False
+    return city['population'] >= CITIES500_MIN_POPULATION or city['feature_code'] in CITIES500_SEAT_CODES
 
 
 class DaciaCityFilter:
     """Filter cities within the Dacia border polygon"""
     
-    def __init__(self, polygon_file: str, cities_file: str):
+    def __init__(self, polygon_file: str, cities_file: str,
+                 grid_resolution: int = DEFAULT_GRID_RESOLUTION, rules_file: str = None,
+                 metrics: Metrics = None, quiet: bool = False):
         self.polygon_file = polygon_file
         self.cities_file = cities_file
+        self.grid_resolution = grid_resolution
+        # Exclusion and population rules, see dacia_rules.py
+        self.rules = RuleSet.from_file(rules_file) if rules_file else RuleSet.default()
         self.polygon = None
+        self.grid_index = None
         self.cities_in_polygon = []
+        self.city_store = None
+        self.regions = {}
+        self.region_tree = None
+        self.cities_by_region = {}
+        # Set by calculate_border_distances; the CSV outputs then carry
+        # the border_distance_km and border_band columns
+        self.border_index = None
+        self.border_bands = None
+        # Stage timers and counters, see dacia_metrics.py; quiet drops the
+        # progress lines printed while filtering
+        self.metrics = metrics or Metrics()
+        self.quiet = quiet
         
+    @timed('load_polygon')
     def load_polygon(self) -> Polygon:
         """Load the Dacia border polygon from JSON or TXT file"""
         print("Loading Dacia border polygon...")
         
+        polygon_coords = self._read_polygon_coords(self.polygon_file)
+        
+        if not polygon_coords:
+            raise ValueError("No valid coordinates found in polygon file")
+        
+        self.polygon = Polygon(polygon_coords)
+        print(f"Polygon loaded with {len(polygon_coords)} vertices")
+        print(f"Polygon bounds: {self.polygon.bounds}")
+        
+        # Build the grid acceptance index used by the containment tests
+        self._build_grid_index()
+        if self.grid_index is not None:
+            print(f"Grid index built: {self.grid_resolution}x{self.grid_resolution} cells")
+        
+        return self.polygon
+    
+    def _build_grid_index(self):
+        """Build the grid acceptance index for the current polygon"""
+        if self.grid_resolution:
+            self.grid_index = PolygonGridIndex(self.polygon, self.grid_resolution)
+        else:
+            self.grid_index = None
+    
+    def _read_polygon_coords(self, polygon_file: str) -> List[Tuple[float, float]]:
+        """Read (lon, lat) pairs from a JSON or TXT polygon file"""
         polygon_coords = []
         
         # Try to load as JSON first
-        if self.polygon_file.endswith('.json'):
+        if polygon_file.endswith('.json'):
             try:
-                with open(self.polygon_file, 'r', encoding='utf-8') as f:
+                with open(polygon_file, 'r', encoding='utf-8') as f:
                     # Try to parse as proper JSON
                     data = json.load(f)
                     if 'coordinates' in data:
@@ -37,7 +116,7 @@ class DaciaCityFilter:
             except json.JSONDecodeError:
                 # If JSON parsing fails, try reading as coordinate pairs
                 print("JSON parsing failed, trying as coordinate pairs...")
-                with open(self.polygon_file, 'r', encoding='utf-8') as f:
+                with open(polygon_file, 'r', encoding='utf-8') as f:
                     for line in f:
                         line = line.strip()
                         if line and not line.startswith('{') and not line.startswith('['):
@@ -50,7 +129,7 @@ class DaciaCityFilter:
                                     continue
         else:
             # Load from TXT file (coordinate pairs)
-            with open(self.polygon_file, 'r', encoding='utf-8') as f:
+            with open(polygon_file, 'r', encoding='utf-8') as f:
                 for line in f:
                     line = line.strip()
                     if line:
@@ -62,14 +141,65 @@ class DaciaCityFilter:
                             except ValueError:
                                 continue
         
-        if not polygon_coords:
-            raise ValueError("No valid coordinates found in polygon file")
+        return polygon_coords
+    
+    @timed('load_regions')
+    def load_regions(self, source: str) -> Dict[str, Polygon]:
+        """Load named region polygons for multi-region tagging
         
-        self.polygon = Polygon(polygon_coords)
-        print(f"Polygon loaded with {len(polygon_coords)} vertices")
-        print(f"Polygon bounds: {self.polygon.bounds}")
+        source can be a directory of polygon files (.json, .geojson, .txt),
+        named after each file, or a single GeoJSON file. Features of a
+        FeatureCollection are named by their "name" property.
+        """
+        print(f"Loading regions from {source}...")
         
-        return self.polygon
+        regions = {}
+        if os.path.isdir(source):
+            for filename in sorted(os.listdir(source)):
+                stem, ext = os.path.splitext(filename)
+                if ext.lower() in ('.json', '.geojson', '.txt'):
+                    regions.update(self._read_region_file(os.path.join(source, filename), stem))
+        else:
+            stem = os.path.splitext(os.path.basename(source))[0]
+            regions.update(self._read_region_file(source, stem))
+        
+        if not regions:
+            raise ValueError(f"No region polygons found in {source}")
+        
+        self.regions = regions
+        self.region_tree = STRtree(list(regions.values()))
+        for name, region in regions.items():
+            print(f"  {name}: bounds {region.bounds}")
+        print(f"Loaded {len(regions)} regions")
+        
+        return regions
+    
+    def _read_region_file(self, path: str, default_name: str) -> Dict[str, Polygon]:
+        """Read one or more named polygons from a region file"""
+        if path.endswith(('.json', '.geojson')):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except json.JSONDecodeError:
+                data = None
+            
+            if isinstance(data, dict):
+                if data.get('type') == 'FeatureCollection':
+                    regions = {}
+                    for i, feature in enumerate(data.get('features', [])):
+                        name = (feature.get('properties') or {}).get('name') or f"{default_name}_{i + 1}"
+                        regions[str(name)] = shape(feature['geometry'])
+                    return regions
+                if data.get('type') == 'Feature':
+                    name = (data.get('properties') or {}).get('name') or default_name
+                    return {str(name): shape(data['geometry'])}
+                if data.get('type') in ('Polygon', 'MultiPolygon'):
+                    return {default_name: shape(data)}
+        
+        polygon_coords = self._read_polygon_coords(path)
+        if not polygon_coords:
+            raise ValueError(f"No valid coordinates found in {path}")
+        return {default_name: Polygon(polygon_coords)}
     
     def parse_city_line(self, line: str) -> Dict:
         """Parse a line from cities500.txt"""
@@ -79,6 +209,7 @@ class DaciaCityFilter:
             return None
         
         try:
+            self._check_integer_fields(fields)
             city_data = {
                 'geonameid': fields[0],
                 'name': fields[1],
@@ -104,60 +235,602 @@ class DaciaCityFilter:
         except (ValueError, IndexError) as e:
             return None
     
+    @staticmethod
+    def _check_integer_fields(fields: List[str]):
+        """Raise ValueError unless geonameid and elevation are integers
+        
+        Both stay text in the city dicts, but the compact CityStore stores
+        them as integers, so the two modes drop the same malformed rows.
+        """
+        int(fields[0])
+        if fields[15]:
+            int(fields[15])
+    
     def point_in_polygon(self, lat: float, lon: float) -> bool:
         """Check if a point is within the polygon"""
+        if self.grid_index is not None:
+            return self.grid_index.contains(lon, lat)
         point = Point(lon, lat)  # Shapely uses (x, y) = (lon, lat)
         return self.polygon.contains(point)
     
+    @timed('filter')
     def filter_cities(self) -> List[Dict]:
         """Filter cities that fall within the Dacia polygon"""
         print(f"\nProcessing cities from {self.cities_file}...")
         
+        if self.grid_index is not None:
+            self.grid_index.reset_counters()
+        
         cities_in_polygon = []
         total_cities = 0
-        excluded_sectors = 0
-        excluded_low_pop = 0
+        parsed = 0
+        contained = 0
+        rule_counts = self.rules.new_counts()
+        progress = not self.quiet
         
-        with open(self.cities_file, 'r', encoding='utf-8') as f:
+        with open_text(self.cities_file) as f:
             for line in f:
                 total_cities += 1
                 
                 city = self.parse_city_line(line)
                 if not city:
                     continue
+                parsed += 1
                 
                 # Check if city is within polygon
                 if self.point_in_polygon(city['latitude'], city['longitude']):
-                    # Exclude Romanian cities containing "Sector" in the name
-                    if city['country_code'] == 'RO' and 'sector' in city['name'].lower():
-                        excluded_sectors += 1
+                    contained += 1
+                    # Exclusion rules and population adjustments
+                    if not self.rules.apply(city, rule_counts):
                         continue
                     
-                    # Exclude Romanian and Hungarian cities with population < 900
-                    if city['country_code'] in ['RO', 'HU'] and city['population'] < 1000:
-                        excluded_low_pop += 1
-                        continue
-                    
-                    # Decrease population by 15% for RO/HU cities under 300,000
-                    if city['country_code'] in ['RO', 'HU'] and city['population'] < 300000:
-                        city['population'] = int(city['population'] * 0.85)
-                    
                     cities_in_polygon.append(city)
                 
                 # Progress indicator
-                if total_cities % 10000 == 0:
+                if progress and total_cities % 10000 == 0:
                     print(f"Processed {total_cities:,} cities, found {len(cities_in_polygon)} in polygon...")
         
+        self.metrics.count('lines_parsed', parsed)
+        self.metrics.count('cities_contained', contained)
         self.cities_in_polygon = cities_in_polygon
-        print(f"\nTotal cities processed: {total_cities:,}")
-        print(f"Cities in Dacia polygon: {len(cities_in_polygon):,}")
-        if excluded_sectors > 0:
-            print(f"Romanian 'Sector' cities excluded: {excluded_sectors}")
-        if excluded_low_pop > 0:
-            print(f"RO/HU cities with pop < 900 excluded: {excluded_low_pop}")
+        self._print_filter_totals(total_cities, rule_counts)
+        
+        return cities_in_polygon
+    
+    @timed('filter')
+    def filter_cities_batch(self, chunk_size: int = DEFAULT_CHUNK_SIZE, compact: bool = False) -> List[Dict]:
+        """Filter cities in chunks using one vectorized containment call per chunk
+        
+        Produces exactly the same cities (and order) as filter_cities, but
+        parses coordinates into NumPy arrays and classifies a whole chunk
+        against the prepared polygon at once. Only rows inside the polygon
+        are fully parsed.
+        
+        With compact=True the kept cities are stored in a CityStore (only the
+        CSV columns, in typed arrays) instead of one dict per city. The store
+        becomes cities_in_polygon and city_store.
+        """
+        print(f"\nProcessing cities from {self.cities_file} in chunks of {chunk_size:,}...")
+        
+        counts = self._new_counts()
+        if compact:
+            store = CityStore()
+            for lines in self._iter_line_chunks(chunk_size, counts):
+                n_kept = self._filter_chunk_compact(lines, store, counts['rules'])
+                self._count_chunk(counts, n_kept)
+            self.city_store = store
+            cities_in_polygon = store
+        else:
+            self.city_store = None
+            cities_in_polygon = list(self._iter_filtered_cities(chunk_size, counts))
+        
+        self.cities_in_polygon = cities_in_polygon
+        self._print_filter_totals(counts['lines'], counts['rules'])
         
         return cities_in_polygon
     
+    @timed('filter')
+    def filter_cities_streaming(self, output_file: str = 'dacia_cities_all.csv', output_dir: str = None,
+                                chunk_size: int = DEFAULT_CHUNK_SIZE,
+                                run_size: int = DEFAULT_RUN_SIZE, border_bands=None) -> CitySummary:
+        """Filter cities and write the CSV outputs in constant memory
+        
+        Cities flow from the batch filter straight into one sorted sink per
+        country, and the summary aggregates are updated as they pass, so
+        nothing is accumulated in cities_in_polygon. The files written are
+        identical to save_to_csv and save_by_country. Returns the summary,
+        which generate_summary accepts. With border_bands (see
+        calculate_border_distances) every chunk's cities get their border
+        distance before they are written.
+        """
+        print(f"\nStreaming cities from {self.cities_file} in chunks of {chunk_size:,}...")
+        
+        if output_dir is None:
+            output_dir = ""
+        if border_bands is not None:
+            self._prepare_border_index(border_bands)
+        
+        summary = CitySummary()
+        counts = self._new_counts()
+        sinks = {}
+        
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_file))) as temp_dir:
+            for city in self._iter_filtered_cities(chunk_size, counts, border_bands is not None):
+                sink = sinks.get(city['country_code'])
+                if sink is None:
+                    filename = f"{output_dir}dacia_cities_{city['country_code']}.csv"
+                    sink = sinks[city['country_code']] = SortedCsvSink(filename, temp_dir, run_size,
+                                                                       self.output_fieldnames)
+                sink.write(city)
+                summary.add(city)
+            
+            self._print_country_counts((country, data['city_count'])
+                                       for country, data in summary.sorted_countries())
+            
+            print(f"\nSaving individual country CSV files...")
+            for country, _ in summary.sorted_countries():
+                sinks[country].close()
+                print(f"  Saved {sinks[country].count:,} cities to {sinks[country].output_file}")
+        
+        # The combined file is sorted by country, then population, which is
+        # the country files one after another in country code order
+        print(f"\nSaving cities to {output_file}...")
+        if sinks:
+            concatenate_csv_files(output_file, [sinks[c].output_file for c in sorted(sinks)])
+            print(f"Successfully saved {summary.total_cities:,} cities to {output_file}")
+        else:
+            print("No cities to save!")
+        
+        self.cities_in_polygon = []
+        self._print_filter_totals(counts['lines'], counts['rules'], kept_cities=counts['kept'])
+        
+        return summary
+    
+    def _iter_filtered_cities(self, chunk_size: int, counts: Dict[str, int], border_distances: bool = False):
+        """Yield the kept cities of the batch filter chunk by chunk
+        
+        counts (see _new_counts) is updated in place with the lines read,
+        cities kept and the per-rule match counts. With border_distances
+        each chunk's cities get their distance to the border.
+        """
+        for lines in self._iter_line_chunks(chunk_size, counts):
+            cities = self._filter_chunk(lines, counts['rules'])
+            if border_distances and cities:
+                self._add_border_distances(cities)
+            self._count_chunk(counts, len(cities))
+            yield from cities
+    
+    def _iter_line_chunks(self, chunk_size: int, counts: Dict[str, int]):
+        """Yield chunks of at most chunk_size lines of the cities file
+        
+        The chunks come from dacia_readers: plain files are memory-mapped,
+        .zip/.gz/.zst files are decompressed on the fly, and each chunk
+        carries its parsed coordinates so lines are only decoded on access.
+        """
+        # Preparing builds the polygon's spatial index once for all chunks
+        shapely.prepare(self.polygon)
+        if self.grid_index is not None:
+            self.grid_index.reset_counters()
+        
+        for lines in iter_line_chunks(self.cities_file, chunk_size):
+            counts['lines'] += len(lines)
+            yield lines
+    
+    def _new_counts(self) -> Dict:
+        """Running counts of a chunked filtering pass"""
+        return {'lines': 0, 'kept': 0, 'rules': self.rules.new_counts()}
+    
+    def _count_chunk(self, counts: Dict, n_kept: int):
+        """Add a chunk's kept cities to the running counts and report progress"""
+        counts['kept'] += n_kept
+        
+        # Progress indicator
+        if not self.quiet:
+            print(f"Processed {counts['lines']:,} cities, found {counts['kept']} in polygon...")
+    
+    @timed('filter')
+    def filter_cities_cached(self, cache_dir: str = None, rebuild: bool = False,
+                             chunk_size: int = DEFAULT_CHUNK_SIZE) -> List[Dict]:
+        """Filter cities from a memory-mapped parse cache of the cities file
+        
+        The first run parses the cities file into binary columns (see
+        ParsedDumpCache); later runs map them and classify all coordinates
+        with vectorized containment, then read back only the matching lines.
+        A stale cache is rebuilt automatically, rebuild=True forces it.
+        The result is the same as filter_cities.
+        """
+        print(f"\nProcessing cities from {self.cities_file} via parse cache...")
+        self._require_plain_file('filter_cities_cached')
+        
+        cache = ParsedDumpCache(self.cities_file, cache_dir).load(rebuild=rebuild)
+        lons = cache.columns['longitude']
+        lats = cache.columns['latitude']
+        offsets = cache.columns['offset']
+        
+        shapely.prepare(self.polygon)
+        if self.grid_index is not None:
+            self.grid_index.reset_counters()
+        
+        cities_in_polygon = []
+        rule_counts = self.rules.new_counts()
+        self.metrics.count('lines_parsed', cache.meta['rows'])
+        
+        with open(self.cities_file, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for start in range(0, len(offsets), chunk_size):
+                chunk_lons = np.asarray(lons[start:start + chunk_size])
+                chunk_lats = np.asarray(lats[start:start + chunk_size])
+                if self.grid_index is not None:
+                    inside = self.grid_index.contains_xy(chunk_lons, chunk_lats)
+                else:
+                    inside = shapely.contains_xy(self.polygon, chunk_lons, chunk_lats)
+                self.metrics.count('cities_contained', np.count_nonzero(inside))
+                
+                # Materialize only the matching lines
+                cities = []
+                for offset in offsets[start:start + chunk_size][inside]:
+                    end = data.find(b'\n', offset)
+                    line = data[offset:end if end >= 0 else len(data)].decode('utf-8')
+                    city = self.parse_city_line(line)
+                    if city:
+                        cities.append(city)
+                
+                cities_in_polygon.extend(self._apply_rules_to_cities(cities, rule_counts))
+        
+        self.cities_in_polygon = cities_in_polygon
+        self._print_filter_totals(cache.meta['total_lines'], rule_counts)
+        
+        return cities_in_polygon
+    
+    def clear_parse_cache(self, cache_dir: str = None):
+        """Delete the parse cache of the cities file"""
+        ParsedDumpCache(self.cities_file, cache_dir).clear()
+    
+    @timed('filter')
+    def filter_cities_parallel(self, workers: int = None, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                               shards_per_worker: int = 4) -> List[Dict]:
+        """Filter cities on a process pool, one newline-aligned byte range per task
+        
+        Each worker receives the polygon once when it starts and runs the
+        batch parse, containment and rules over its byte ranges. Shard
+        results are merged in file order, so the cities, their order and the
+        exclusion counts are the same as with filter_cities.
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        
+        self._require_plain_file('filter_cities_parallel')
+        ranges = self._byte_ranges(workers * shards_per_worker)
+        print(f"\nProcessing cities from {self.cities_file} with {workers} workers "
+              f"({len(ranges)} shards)...")
+        
+        if self.grid_index is not None:
+            self.grid_index.reset_counters()
+        
+        cities_in_polygon = []
+        total_cities = 0
+        rule_counts = self.rules.new_counts()
+        
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_filter_worker,
+                                 initargs=(self.polygon, self.cities_file, self.grid_resolution,
+                                           self.rules)) as executor:
+            shard_results = executor.map(_filter_byte_range, ranges, [chunk_size] * len(ranges))
+            
+            # map yields results in submission order, which is file order
+            for cities, n_lines, shard_rule_counts, grid_counters, shard_counters in shard_results:
+                cities_in_polygon.extend(cities)
+                total_cities += n_lines
+                for name, count in shard_counters.items():
+                    self.metrics.count(name, count)
+                for name, count in shard_rule_counts.items():
+                    rule_counts[name] += count
+                if self.grid_index is not None:
+                    for name, value in grid_counters.items():
+                        setattr(self.grid_index, name, getattr(self.grid_index, name) + value)
+                
+                # Progress indicator
+                if not self.quiet:
+                    print(f"Processed {total_cities:,} cities, found {len(cities_in_polygon)} in polygon...")
+        
+        self.cities_in_polygon = cities_in_polygon
+        self._print_filter_totals(total_cities, rule_counts)
+        
+        return cities_in_polygon
+    
+    def _require_plain_file(self, method: str):
+        """Byte offsets only exist in an uncompressed cities file"""
+        if is_compressed(self.cities_file):
+            raise ValueError(f"{method} needs an uncompressed cities file, got {self.cities_file}; "
+                             f"use filter_cities_batch or extract it first")
+    
+    def _byte_ranges(self, shards: int) -> List[Tuple[int, int]]:
+        """Split the cities file into newline-aligned (start, end) byte ranges"""
+        size = os.path.getsize(self.cities_file)
+        boundaries = [0]
+        
+        with open(self.cities_file, 'rb') as f:
+            for i in range(1, shards):
+                # Move to the start of the line after the approximate offset
+                f.seek(max(size * i // shards - 1, 0))
+                f.readline()
+                position = f.tell()
+                if boundaries[-1] < position < size:
+                    boundaries.append(position)
+        
+        boundaries.append(size)
+        return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+    
+    def _filter_chunk(self, lines: List[str], rule_counts: Dict[str, int]) -> List[Dict]:
+        """Classify a chunk of lines and apply the exclusion/population rules
+        
+        Returns the kept cities; rule_counts is updated in place.
+        """
+        indices, lons, lats = self._parse_chunk_coordinates(lines)
+        if len(indices) == 0:
+            return []
+        
+        if self.grid_index is not None:
+            inside = self.grid_index.contains_xy(lons, lats)
+        else:
+            inside = shapely.contains_xy(self.polygon, lons, lats)
+        self.metrics.count('lines_parsed', len(indices))
+        self.metrics.count('cities_contained', np.count_nonzero(inside))
+        
+        # Fully parse only the rows inside the polygon
+        cities = []
+        for i in indices[inside]:
+            city = self.parse_city_line(lines[i])
+            if city:
+                cities.append(city)
+        
+        return self._apply_rules_to_cities(cities, rule_counts)
+    
+    def _filter_chunk_compact(self, lines: List[str], store: CityStore,
+                              rule_counts: Dict[str, int]) -> int:
+        """Like _filter_chunk, but appends the kept rows to a CityStore
+        
+        Only the output columns of rows inside the polygon are extracted, no
+        city dicts are created. Returns the number of kept rows.
+        """
+        indices, lons, lats = self._parse_chunk_coordinates(lines)
+        if len(indices) == 0:
+            return 0
+        
+        if self.grid_index is not None:
+            inside = self.grid_index.contains_xy(lons, lats)
+        else:
+            inside = shapely.contains_xy(self.polygon, lons, lats)
+        self.metrics.count('lines_parsed', len(indices))
+        self.metrics.count('cities_contained', np.count_nonzero(inside))
+        
+        rows = []
+        for i in indices[inside]:
+            fields = lines[i].strip().split('\t')
+            try:
+                self._check_integer_fields(fields)
+                population = int(fields[14]) if fields[14] else 0
+            except ValueError:
+                continue
+            rows.append((fields, population))
+        
+        if not rows:
+            return 0
+        
+        columns = {
+            'country_code': np.array([fields[8] for fields, _ in rows]),
+            'name': np.array([fields[1] for fields, _ in rows]),
+            'feature_code': np.array([fields[7] for fields, _ in rows]),
+        }
+        keep, populations = self.rules.apply_arrays(
+            columns, np.array([population for _, population in rows], dtype=np.int64), rule_counts)
+        
+        kept = np.flatnonzero(keep)
+        for i in kept:
+            fields = rows[i][0]
+            store.append(fields[0], fields[1], fields[2], fields[8], float(fields[4]), float(fields[5]),
+                         int(populations[i]), fields[15], fields[10], fields[11])
+        
+        return len(kept)
+    
+    def _parse_chunk_coordinates(self, lines: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Parse only the coordinates of each line in a chunk
+        
+        Returns the indices of the well-formed lines and their longitudes and
+        latitudes as arrays. Chunks from dacia_readers come with them already.
+        """
+        if hasattr(lines, 'coordinates'):
+            return lines.coordinates
+        
+        indices = []
+        lats = []
+        lons = []
+        for i, line in enumerate(lines):
+            fields = line.strip().split('\t')
+            if len(fields) < 19:
+                continue
+            try:
+                lat, lon = float(fields[4]), float(fields[5])
+            except ValueError:
+                continue
+            indices.append(i)
+            lats.append(lat)
+            lons.append(lon)
+        
+        return (np.array(indices, dtype=np.int64),
+                np.array(lons, dtype=np.float64),
+                np.array(lats, dtype=np.float64))
+    
+    def _apply_rules_to_cities(self, cities: List[Dict], rule_counts: Dict[str, int]) -> List[Dict]:
+        """Apply the exclusion/population rules to parsed cities as array masks"""
+        if not cities:
+            return []
+        
+        columns = {
+            'country_code': np.array([c['country_code'] for c in cities]),
+            'name': np.array([c['name'] for c in cities]),
+            'feature_code': np.array([c['feature_code'] for c in cities]),
+        }
+        keep, populations = self.rules.apply_arrays(
+            columns, np.array([c['population'] for c in cities], dtype=np.int64), rule_counts)
+        
+        kept = []
+        for i in np.flatnonzero(keep):
+            city = cities[i]
+            city['population'] = int(populations[i])
+            kept.append(city)
+        
+        return kept
+    
+    @timed('filter')
+    def filter_regions(self, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, List[Dict]]:
+        """Tag every city with all loaded regions containing it in one pass
+        
+        Uses the STRtree over the region polygons built by load_regions, so
+        each point is only tested against regions whose bounds it falls in.
+        Every kept city gets a 'regions' list; cities_in_polygon holds the
+        cities found in at least one region.
+        """
+        if self.region_tree is None:
+            raise ValueError("No regions loaded, call load_regions first")
+        
+        print(f"\nTagging cities from {self.cities_file} with {len(self.regions)} regions...")
+        
+        if self.grid_index is not None:
+            self.grid_index.reset_counters()
+        
+        region_names = list(self.regions)
+        cities_in_polygon = []
+        total_cities = 0
+        rule_counts = self.rules.new_counts()
+        
+        for lines in iter_line_chunks(self.cities_file, chunk_size):
+            total_cities += len(lines)
+            
+            indices, lons, lats = self._parse_chunk_coordinates(lines)
+            if len(indices) == 0:
+                continue
+            
+            point_idx, region_idx = self.region_tree.query(
+                shapely.points(lons, lats), predicate='within')
+            
+            # Group the matching regions of each point, in region order
+            order = np.lexsort((region_idx, point_idx))
+            point_idx = point_idx[order]
+            region_idx = region_idx[order]
+            points, starts = np.unique(point_idx, return_index=True)
+            ends = np.append(starts[1:], len(point_idx))
+            self.metrics.count('lines_parsed', len(indices))
+            self.metrics.count('cities_contained', len(points))
+            
+            cities = []
+            for point, start, end in zip(points, starts, ends):
+                city = self.parse_city_line(lines[indices[point]])
+                if city:
+                    city['regions'] = [region_names[r] for r in region_idx[start:end]]
+                    cities.append(city)
+            
+            cities_in_polygon.extend(self._apply_rules_to_cities(cities, rule_counts))
+            
+            # Progress indicator
+            if not self.quiet:
+                print(f"Processed {total_cities:,} cities, found {len(cities_in_polygon)} in regions...")
+        
+        cities_by_region = {name: [] for name in region_names}
+        for city in cities_in_polygon:
+            for name in city['regions']:
+                cities_by_region[name].append(city)
+        
+        self.cities_in_polygon = cities_in_polygon
+        self.cities_by_region = cities_by_region
+        self._print_filter_totals(total_cities, rule_counts, label="any region")
+        for name, cities in cities_by_region.items():
+            print(f"  {name}: {len(cities):,} cities")
+        
+        return cities_by_region
+    
+    def _print_filter_totals(self, total_cities: int, rule_counts: Dict[str, int],
+                             label: str = "Dacia polygon", kept_cities: int = None):
+        """Print the totals of a filtering pass and add them to the metrics"""
+        if kept_cities is None:
+            kept_cities = len(self.cities_in_polygon)
+        self._record_filter_metrics(total_cities, rule_counts, kept_cities)
+        print(f"\nTotal cities processed: {total_cities:,}")
+        print(f"Cities in {label}: {kept_cities:,}")
+        descriptions = self.rules.descriptions()
+        for name, count in rule_counts.items():
+            if count > 0:
+                print(f"{descriptions.get(name, name)}: {count}")
+        if self.grid_index is not None and self.grid_index.stats()['total_points']:
+            stats = self.grid_index.stats()
+            print(f"Grid index: {stats['bbox_rejects']:,} bbox rejects, "
+                  f"{stats['inside_hits']:,} inside hits, {stats['outside_hits']:,} outside hits, "
+                  f"{stats['boundary_tests']:,} exact tests "
+                  f"({stats['resolved_fraction']:.1%} resolved without geometry)")
+    
+    def _record_filter_metrics(self, total_cities: int, rule_counts: Dict[str, int], kept_cities: int):
+        """Add the totals of a filtering pass to the metrics counters"""
+        self.metrics.count('lines_read', total_cities)
+        self.metrics.count('cities_kept', kept_cities)
+        self.metrics.count_rules(rule_counts)
+        self.metrics.add_rows('filter', total_cities)
+        if self.grid_index is not None:
+            stats = self.grid_index.stats()
+            for name in ('bbox_rejects', 'inside_hits', 'outside_hits', 'boundary_tests'):
+                self.metrics.count(f"grid_{name}", stats[name])
+    
+    @timed('border_distance')
+    def calculate_border_distances(self, bands=DEFAULT_BORDER_BANDS) -> np.ndarray:
+        """Calculate every kept city's distance to the polygon boundary at once
+        
+        Distances are great-circle km to the nearest polygon edge, computed
+        for all cities in one vectorized pass over an index of the edges
+        (see dacia_border_distance.py). Each city gets 'border_distance_km'
+        (rounded to metres) and 'border_band', the label of the band of
+        bands (upper edges in km) it falls in, and the CSV outputs written
+        afterwards carry both columns. Returns the distances.
+        """
+        if isinstance(self.cities_in_polygon, CityStore):
+            raise ValueError("Border distances need city dicts, filter with compact=False")
+        
+        print(f"\nCalculating border distances for {len(self.cities_in_polygon):,} cities...")
+        self._prepare_border_index(bands)
+        distances = self._add_border_distances(self.cities_in_polygon)
+        self.metrics.add_rows('border_distance', len(distances))
+        
+        counts = np.bincount(band_indices(distances, self.border_bands), minlength=len(self.border_bands) + 1)
+        for label, count in zip(band_labels(self.border_bands), counts):
+            print(f"  {label:>12s}: {count:,} cities")
+        
+        return distances
+    
+    def _prepare_border_index(self, bands):
+        """Build the border distance index for the current polygon"""
+        if self.border_index is None:
+            self.border_index = BorderDistanceIndex.from_polygon(self.polygon)
+        self.border_bands = tuple(float(band) for band in bands)
+    
+    def _add_border_distances(self, cities: List[Dict]) -> np.ndarray:
+        """Set border_distance_km and border_band on each city; returns the distances"""
+        n = len(cities)
+        lons = np.fromiter((c['longitude'] for c in cities), dtype=np.float64, count=n)
+        lats = np.fromiter((c['latitude'] for c in cities), dtype=np.float64, count=n)
+        distances = self.border_index.distances_km(lons, lats)
+        
+        labels = band_labels(self.border_bands)
+        bands = band_indices(distances, self.border_bands).tolist()
+        for city, distance, band in zip(cities, distances.tolist(), bands):
+            city['border_distance_km'] = round(distance, 3)
+            city['border_band'] = labels[band]
+        return distances
+    
+    @property
+    def output_fieldnames(self) -> List[str]:
+        """Columns of the CSV outputs"""
+        if self.border_bands is None:
+            return CSV_FIELDNAMES
+        return CSV_FIELDNAMES + BORDER_FIELDNAMES
+    
     def categorize_by_country(self) -> Dict[str, List[Dict]]:
         """Categorize cities by country code"""
         by_country = defaultdict(list)
@@ -170,14 +843,20 @@ class DaciaCityFilter:
                                       key=lambda x: len(x[1]), 
                                       reverse=True))
         
+        self._print_country_counts((country, len(cities)) for country, cities in sorted_countries.items())
+        
+        return sorted_countries
+    
+    @staticmethod
+    def _print_country_counts(country_counts):
+        """Print (country, number of cities) pairs"""
         print("\n" + "="*60)
         print("Cities by Country:")
         print("="*60)
-        for country, cities in sorted_countries.items():
-            print(f"{country}: {len(cities):,} cities")
-        
-        return sorted_countries
+        for country, count in country_counts:
+            print(f"{country}: {count:,} cities")
     
+    @timed('write')
     def save_to_csv(self, output_file: str):
         """Save filtered cities to CSV"""
         print(f"\nSaving cities to {output_file}...")
@@ -186,15 +865,18 @@ class DaciaCityFilter:
             print("No cities to save!")
             return
         
+        if isinstance(self.cities_in_polygon, CityStore):
+            store = self.cities_in_polygon
+            store.write_csv(output_file, store.sorted_indices())
+            print(f"Successfully saved {len(store):,} cities to {output_file}")
+            return
+        
         # Sort by country, then by population (descending)
         sorted_cities = sorted(self.cities_in_polygon, 
                               key=lambda x: (x['country_code'], -x['population']))
         
         # Only save selected fields
-        fieldnames = [
-            'geonameid', 'name', 'asciiname', 'country_code',
-            'latitude', 'longitude', 'population', 'elevation'
-        ]
+        fieldnames = self.output_fieldnames
         
         with open(output_file, 'w', newline='', encoding='utf-8') as f:
             writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
@@ -203,8 +885,13 @@ class DaciaCityFilter:
         
         print(f"Successfully saved {len(sorted_cities):,} cities to {output_file}")
     
+    @timed('write')
     def save_by_country(self, output_dir: str = None):
         """Save separate CSV files for each country"""
+        if isinstance(self.cities_in_polygon, CityStore):
+            self._save_store_by_country(self.cities_in_polygon, output_dir)
+            return
+        
         by_country = self.categorize_by_country()
         
         if output_dir is None:
@@ -219,10 +906,7 @@ class DaciaCityFilter:
             sorted_cities = sorted(cities, key=lambda x: -x['population'])
             
             # Only save selected fields
-            fieldnames = [
-                'geonameid', 'name', 'asciiname', 'country_code',
-                'latitude', 'longitude', 'population', 'elevation'
-            ]
+            fieldnames = self.output_fieldnames
             
             with open(filename, 'w', newline='', encoding='utf-8') as f:
                 writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
@@ -231,38 +915,376 @@ class DaciaCityFilter:
             
             print(f"  Saved {len(cities):,} cities to {filename}")
     
-    def generate_summary(self) -> str:
-        """Generate a summary report"""
+    @timed('write')
+    def save_columnar(self, csv_file: str = 'dacia_cities_all.csv', fmt: str = None) -> List[str]:
+        """Save the cities in the typed columnar layout next to csv_file
+        
+        Parquet when pyarrow is installed (or fmt='parquet'), otherwise a
+        directory of memory-mappable arrays; see dacia_columnar.py. Rows are
+        sorted like csv_file with one row group per country, and cities whose
+        elevation is not a number are dropped, as load_data does. Call it
+        after writing csv_file so the analyzer can tell the two match.
+        Returns the files written.
+        """
+        output_path = columnar_path(csv_file, fmt)
+        print(f"\nSaving columnar copy to {output_path}...")
+        
+        if isinstance(self.cities_in_polygon, CityStore):
+            store = self.cities_in_polygon
+        else:
+            store = CityStore()
+            for city in self.cities_in_polygon:
+                try:
+                    store.append_city(city)
+                except ValueError:
+                    continue
+        
+        files = write_columnar(store, output_path, source_file=csv_file if os.path.exists(csv_file) else None)
+        print(f"Successfully saved {len(store):,} cities to {output_path}")
+        return files
+    
+    def group_cities(self) -> Dict[str, List[Tuple[int, Dict]]]:
+        """Group cities by country and sort each country once
+        
+        Returns {country: [(input position, city), ...]} with countries in
+        order of first appearance and each list sorted by population
+        descending, ties in input order.
+        """
+        groups = defaultdict(list)
+        for seq, city in enumerate(self.cities_in_polygon):
+            groups[city['country_code']].append((seq, city))
+        
+        for cities in groups.values():
+            cities.sort(key=lambda x: -x[1]['population'])
+        
+        return dict(groups)
+    
+    @timed('write')
+    def write_outputs(self, output_file: str = 'dacia_cities_all.csv', output_dir: str = None,
+                      threads: int = 1, columnar: bool = False) -> CitySummary:
+        """Write the combined and per-country CSV files from one grouping pass
+        
+        Produces the same bytes as save_to_csv followed by save_by_country,
+        but groups and sorts the cities only once. Country files are written
+        on a thread pool of the given size (1 writes them in turn) and the
+        combined file is their concatenation in country code order. With
+        columnar=True save_columnar writes the typed copy as well. Returns
+        the summary built from the same grouping, for generate_summary.
+        """
+        if isinstance(self.cities_in_polygon, CityStore):
+            self.save_to_csv(output_file)
+            self.save_by_country(output_dir)
+            if columnar:
+                self.save_columnar(output_file)
+            return CitySummary.from_cities(self.cities_in_polygon)
+        
+        if output_dir is None:
+            output_dir = ""
+        
+        groups = self.group_cities()
+        by_size = sorted(groups.items(), key=lambda x: len(x[1]), reverse=True)
+        self._print_country_counts((country, len(cities)) for country, cities in by_size)
+        
+        print(f"\nSaving individual country CSV files...")
+        filenames = {country: f"{output_dir}dacia_cities_{country}.csv" for country in groups}
+        jobs = [(filenames[country], cities, self.output_fieldnames) for country, cities in by_size]
+        if threads and threads > 1 and len(jobs) > 1:
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                list(executor.map(lambda job: _write_city_rows(*job), jobs))
+        else:
+            for job in jobs:
+                _write_city_rows(*job)
+        for country, cities in by_size:
+            print(f"  Saved {len(cities):,} cities to {filenames[country]}")
+        
+        # Sorted by country, then population: the country files in code order
+        print(f"\nSaving cities to {output_file}...")
+        if groups:
+            concatenate_csv_files(output_file, [filenames[country] for country in sorted(groups)])
+            print(f"Successfully saved {len(self.cities_in_polygon):,} cities to {output_file}")
+        else:
+            print("No cities to save!")
+        
+        if columnar:
+            self.save_columnar(output_file)
+        
+        return CitySummary.from_groups(groups)
+    
+    @timed('daily_update')
+    def apply_daily_update(self, modifications_file: str = None, deletes_file: str = None,
+                           output_file: str = 'dacia_cities_all.csv', output_dir: str = None,
+                           statistics_file: str = 'statistics.json') -> Dict[str, List[Dict]]:
+        """Apply a GeoNames daily delta to the existing filtered dataset
+        
+        Reads the filtered cities from output_file, removes the geonameids of
+        deletes_file (deletes-YYYY-MM-DD.txt) and re-tests the rows of
+        modifications_file (modifications-YYYY-MM-DD.txt, same format as
+        cities500.txt) against the polygon and rules. The modifications
+        cover all GeoNames features, so only rows of the cities500 selection
+        (see is_cities500_place) are re-tested; a known city whose new row
+        is not part of it is removed like a deletion. Only the country files
+        touched by the delta are rewritten; the combined file is rebuilt from
+        the country files, and statistics_file is updated for the affected
+        countries. Cities whose populations tie may be ordered differently
+        than after a full run, since the original input order is not known.
+        
+        Returns the updated cities grouped by country.
+        """
+        print(f"\nApplying daily update to {output_file}...")
+        
+        if output_dir is None:
+            output_dir = ""
+        
+        # Existing filtered dataset, grouped by country in file order
         by_country = defaultdict(list)
-        for city in self.cities_in_polygon:
+        with open(output_file, 'r', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                row['population'] = int(row['population']) if row['population'] else 0
+                by_country[row['country_code']].append(row)
+            # Rewritten files keep the existing columns
+            fieldnames = reader.fieldnames or CSV_FIELDNAMES
+        country_of = {city['geonameid']: country
+                      for country, cities in by_country.items() for city in cities}
+        
+        affected = set()
+        removed_ids = set()
+        
+        if deletes_file:
+            with open(deletes_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    geonameid = line.split('\t', 1)[0].strip()
+                    if geonameid in country_of:
+                        removed_ids.add(geonameid)
+                        affected.add(country_of[geonameid])
+            print(f"Deleted cities in dataset: {len(removed_ids):,}")
+        
+        modified = []
+        if modifications_file:
+            with open(modifications_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    city = self.parse_city_line(line)
+                    if not city:
+                        continue
+                    if city['geonameid'] in country_of:
+                        removed_ids.add(city['geonameid'])
+                        affected.add(country_of[city['geonameid']])
+                    # The delta covers every GeoNames feature; a known city
+                    # that left the cities500 selection stays removed
+                    if not is_cities500_place(city):
+                        continue
+                    if self.point_in_polygon(city['latitude'], city['longitude']):
+                        modified.append(city)
+            rule_counts = self.rules.new_counts()
+            modified = self._apply_rules_to_cities(modified, rule_counts)
+            if 'border_distance_km' in fieldnames and modified:
+                self._prepare_border_index(self.border_bands or DEFAULT_BORDER_BANDS)
+                self._add_border_distances(modified)
+            print(f"Modified cities in polygon after rules: {len(modified):,}")
+        
+        # Modified cities replace their previous row in place, new ones are appended
+        replacements = {city['geonameid']: city for city in modified}
+        for city in modified:
+            affected.add(city['country_code'])
+        for country in affected:
+            cities = []
+            for city in by_country.get(country, []):
+                if city['geonameid'] in replacements:
+                    replacement = replacements[city['geonameid']]
+                    if replacement['country_code'] == country:
+                        cities.append(replacements.pop(city['geonameid']))
+                elif city['geonameid'] not in removed_ids:
+                    cities.append(city)
+            by_country[country] = cities
+        for city in replacements.values():
             by_country[city['country_code']].append(city)
         
-        summary = []
-        summary.append("\n" + "="*70)
-        summary.append("DACIA CITIES SUMMARY REPORT")
-        summary.append("="*70)
-        summary.append(f"\nTotal cities in Dacia region: {len(self.cities_in_polygon):,}")
-        summary.append(f"Number of countries: {len(by_country)}")
+        print(f"\nRewriting {len(affected)} affected country files...")
+        for country in sorted(affected):
+            filename = f"{output_dir}dacia_cities_{country}.csv"
+            cities = sorted(by_country[country], key=lambda x: -x['population'])
+            by_country[country] = cities
+            if not cities:
+                del by_country[country]
+                if os.path.exists(filename):
+                    os.remove(filename)
+                print(f"  Removed {filename}")
+                continue
+            with open(filename, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
+                writer.writeheader()
+                writer.writerows(cities)
+            print(f"  Saved {len(cities):,} cities to {filename}")
+        
+        # The combined file is the country files in country code order
+        countries = sorted(by_country)
+        concatenate_csv_files(output_file, [f"{output_dir}dacia_cities_{c}.csv" for c in countries])
+        self.cities_in_polygon = [city for c in countries for city in by_country[c]]
+        print(f"Successfully saved {len(self.cities_in_polygon):,} cities to {output_file}")
+        
+        if statistics_file and os.path.exists(statistics_file):
+            self._update_statistics_file(statistics_file, affected)
+        
+        return {c: by_country[c] for c in countries}
+    
+    def _update_statistics_file(self, statistics_file: str, countries):
+        """Recompute statistics_file for the given countries from cities_in_polygon"""
+        # Imported here so the filter does not pull in matplotlib otherwise
+        from analyze_dacia_cities import DaciaCitiesAnalyzer
+        
+        analyzer = DaciaCitiesAnalyzer(statistics_file)
+        with open(statistics_file, 'r', encoding='utf-8') as f:
+            analyzer.stats = json.load(f)
+        # Same field conversion as DaciaCitiesAnalyzer.load_data
+        analyzer.cities = [dict(city, elevation=int(city['elevation']) if city['elevation'] else 0,
+                                latitude=float(city['latitude']), longitude=float(city['longitude']))
+                           for city in self.cities_in_polygon]
+        border = analyzer.stats.get('border')
+        if 'admin1' in analyzer.stats:
+            analyzer.load_admin_codes()
+        analyzer.update_statistics(countries)
+        if border:
+            analyzer.calculate_border_statistics(self.polygon_file, border['bands_km'])
+        analyzer.save_statistics_json(statistics_file)
+    
+    def _save_store_by_country(self, store: CityStore, output_dir: str = None):
+        """save_by_country for cities held in a CityStore"""
+        by_country = store.indices_by_country()
+        by_country = dict(sorted(by_country.items(), key=lambda x: len(x[1]), reverse=True))
+        self._print_country_counts((country, len(indices)) for country, indices in by_country.items())
+        
+        if output_dir is None:
+            output_dir = ""
         
-        summary.append("\n" + "-"*70)
-        summary.append("Top cities by population:")
-        summary.append("-"*70)
+        print(f"\nSaving individual country CSV files...")
+        
+        populations = store.column('population')
+        for country_code, indices in by_country.items():
+            filename = f"{output_dir}dacia_cities_{country_code}.csv"
+            
+            # Sort by population descending
+            order = indices[np.argsort(-populations[indices], kind='stable')]
+            store.write_csv(filename, order)
+            
+            print(f"  Saved {len(indices):,} cities to {filename}")
+    
+    @timed('write')
+    def save_by_region(self, output_dir: str = None):
+        """Save a CSV file for each region tagged by filter_regions"""
+        if output_dir is None:
+            output_dir = ""
         
-        top_cities = sorted(self.cities_in_polygon, key=lambda x: -x['population'])[:20]
-        for i, city in enumerate(top_cities, 1):
-            summary.append(f"{i:2d}. {city['name']:30s} ({city['country_code']}) - Pop: {city['population']:,}")
+        print(f"\nSaving individual region CSV files...")
         
-        summary.append("\n" + "-"*70)
-        summary.append("Cities by country:")
-        summary.append("-"*70)
+        for region, cities in self.cities_by_region.items():
+            safe_name = re.sub(r'[^\w.-]+', '_', region)
+            filename = f"{output_dir}dacia_cities_region_{safe_name}.csv"
+            
+            # Sort by country, then by population (descending)
+            sorted_cities = sorted(cities, key=lambda x: (x['country_code'], -x['population']))
+            
+            with open(filename, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=self.output_fieldnames, extrasaction='ignore')
+                writer.writeheader()
+                writer.writerows(sorted_cities)
+            
+            print(f"  Saved {len(cities):,} cities to {filename}")
+    
+    def generate_region_summary(self) -> str:
+        """Generate a summary report for every tagged region"""
+        summary = []
+        summary.append("\n" + "="*70)
+        summary.append("DACIA REGIONS SUMMARY REPORT")
+        summary.append("="*70)
+        summary.append(f"\nCities in at least one region: {len(self.cities_in_polygon):,}")
+        summary.append(f"Number of regions: {len(self.cities_by_region)}")
         
-        sorted_countries = sorted(by_country.items(), key=lambda x: len(x[1]), reverse=True)
-        for country, cities in sorted_countries:
+        for region, cities in self.cities_by_region.items():
+            summary.append("\n" + "-"*70)
+            summary.append(f"Region: {region}")
+            summary.append("-"*70)
             total_pop = sum(c['population'] for c in cities)
+            summary.append(f"Cities: {len(cities):,}, Total pop: {total_pop:,}")
+            if not cities:
+                continue
             largest = max(cities, key=lambda x: x['population'])
-            summary.append(f"{country}: {len(cities):4d} cities, Total pop: {total_pop:10,}, Largest: {largest['name']}")
+            summary.append(f"Largest: {largest['name']} ({largest['country_code']}) - Pop: {largest['population']:,}")
+            
+            by_country = defaultdict(int)
+            for city in cities:
+                by_country[city['country_code']] += 1
+            countries = sorted(by_country.items(), key=lambda x: x[1], reverse=True)
+            summary.append("Countries: " + ", ".join(f"{c} ({n:,})" for c, n in countries))
         
         return "\n".join(summary)
+    
+    def generate_summary(self, summary: CitySummary = None) -> str:
+        """Generate a summary report
+        
+        Uses the given aggregates (e.g. from filter_cities_streaming) or
+        builds them from cities_in_polygon.
+        """
+        if summary is None:
+            summary = CitySummary.from_cities(self.cities_in_polygon)
+        return summary.render()
+
+
+def _write_city_rows(filename: str, cities: List[Tuple[int, Dict]], fieldnames: List[str] = CSV_FIELDNAMES):
+    """Write (position, city) pairs as a CSV file through a large buffer"""
+    with open(filename, 'w', newline='', encoding='utf-8', buffering=1 << 20) as f:
+        writer = csv.writer(f)
+        writer.writerow(fieldnames)
+        writer.writerows([city[field] for field in fieldnames] for _, city in cities)
+
+
+# Filter instance of each process pool worker, set up once by _init_filter_worker
+_worker_filter = None
+
+
+def _init_filter_worker(polygon: Polygon, cities_file: str, grid_resolution: int, rules: RuleSet):
+    """Process pool initializer: keep one polygon and grid index per worker"""
+    global _worker_filter
+    _worker_filter = DaciaCityFilter('', cities_file, grid_resolution)
+    _worker_filter.rules = rules
+    _worker_filter.polygon = polygon
+    shapely.prepare(polygon)
+    _worker_filter._build_grid_index()
+
+
+def _filter_byte_range(byte_range: Tuple[int, int], chunk_size: int):
+    """Run the batch filter over one byte range of the cities file
+    
+    Returns the kept cities, the number of lines read, the per-rule match
+    counts, the grid index counters and the metrics counters for this range.
+    """
+    start, end = byte_range
+    with open(_worker_filter.cities_file, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    
+    if _worker_filter.grid_index is not None:
+        _worker_filter.grid_index.reset_counters()
+    _worker_filter.metrics.counters.clear()
+    
+    cities = []
+    n_lines = 0
+    rule_counts = _worker_filter.rules.new_counts()
+    
+    # Decode like open(..., 'r') so lines match the serial path exactly
+    text = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8')
+    while True:
+        lines = list(islice(text, chunk_size))
+        if not lines:
+            break
+        n_lines += len(lines)
+        cities.extend(_worker_filter._filter_chunk(lines, rule_counts))
+    
+    grid_counters = {}
+    if _worker_filter.grid_index is not None:
+        grid_counters = {name: getattr(_worker_filter.grid_index, name)
+                         for name in ('bbox_rejects', 'inside_hits', 'outside_hits', 'boundary_tests')}
+    
+    return cities, n_lines, rule_counts, grid_counters, dict(_worker_filter.metrics.counters)
 
 
 def main():
@@ -274,25 +1296,33 @@ def main():
     # File paths
     polygon_file = 'dacia_border.txt'  # Can also use dacia_border.json
     cities_file = 'cities500/cities500.txt'
+    if not os.path.exists(cities_file) and os.path.exists('cities500.zip'):
+        # Read straight from the downloaded archive
+        cities_file = 'cities500.zip'
     output_file = 'dacia_cities_all.csv'
+    rules_file = 'dacia_rules.json'
     
     # Create filter instance
-    filter_obj = DaciaCityFilter(polygon_file, cities_file)
+    filter_obj = DaciaCityFilter(polygon_file, cities_file, rules_file=rules_file)
     
     # Load polygon
     filter_obj.load_polygon()
     
-    # Filter cities
-    filter_obj.filter_cities()
+    # Filter cities (vectorized containment, same result as filter_cities)
+    filter_obj.filter_cities_batch()
     
-    # Save all cities to one CSV
-    filter_obj.save_to_csv(output_file)
+    # Distance of every city to the border, written as extra CSV columns
+    filter_obj.calculate_border_distances()
     
-    # Save separate CSV files by country
-    filter_obj.save_by_country()
+    # Save all cities to one CSV and separate CSV files by country, plus
+    # the typed columnar copy the analyzer loads instead of the CSV
+    summary = filter_obj.write_outputs(output_file, columnar=True)
     
     # Print summary
-    print(filter_obj.generate_summary())
+    print(filter_obj.generate_summary(summary))
+    
+    # Stage timings and counters
+    filter_obj.metrics.write_json('filter_metrics.json')
     
     print("\n" + "="*70)
     print("PROCESSING COMPLETE")
@@ -0,0 +1,36 @@
+"""
+Shared fixtures for the Dacia cities tests
+"""
+
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+POLYGON_FILE = os.path.join(ROOT, 'dacia_border.txt')
+
+
+@pytest.fixture
+def data_file():
+    """Path of a file in tests/data"""
+    return lambda name: os.path.join(DATA_DIR, name)
+
+
+@pytest.fixture
+def filtered_sample(tmp_path, data_file):
+    """Filter tests/data/cities_sample.txt into tmp_path
+
+    Returns the filter and the path of the combined CSV; the country CSVs
+    are written next to it.
+    """
+    from filter_dacia_cities import DaciaCityFilter
+
+    filter_obj = DaciaCityFilter(POLYGON_FILE, data_file('cities_sample.txt'), quiet=True)
+    filter_obj.load_polygon()
+    filter_obj.filter_cities_batch()
+    output_file = str(tmp_path / 'dacia_cities_all.csv')
+    filter_obj.write_outputs(output_file, str(tmp_path) + os.sep)
+    return filter_obj, output_file
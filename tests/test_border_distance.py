@@ -0,0 +1,38 @@
+"""
+Tests for dacia_border_distance.py
+"""
+
+import math
+import numpy as np
+from dacia_border_distance import EARTH_RADIUS_KM, BorderDistanceIndex, band_indices, band_labels, unit_vectors
+
+KM_PER_DEG = math.radians(1) * EARTH_RADIUS_KM
+
+
+def test_band_edges():
+    distances = np.array([0.0, 9.999, 10.0, 24.999, 25.0, 49.999, 50.0, 1000.0])
+    # Every band includes its lower edge
+    assert band_indices(distances).tolist() == [0, 0, 1, 1, 2, 2, 3, 3]
+    assert band_labels() == ['0-10 km', '10-25 km', '25-50 km', '50+ km']
+    assert band_labels((2.5, 5)) == ['0-2.5 km', '2.5-5 km', '5+ km']
+    assert band_indices(np.array([2.5, 7.0]), (2.5, 5)).tolist() == [1, 2]
+
+
+def test_distances_to_arc_and_end_points():
+    # Square on the equator; the western edge runs along the prime meridian
+    index = BorderDistanceIndex([[(0, -1), (0, 1), (2, 1), (2, -1)]], cell_deg=0.25)
+    lons = np.array([0.5, 0.0, -0.5, 0.0])
+    lats = np.array([0.0, 0.0, 0.0, 2.0])
+    expected = [0.5 * KM_PER_DEG, 0.0, 0.5 * KM_PER_DEG, 1.0 * KM_PER_DEG]
+    np.testing.assert_allclose(index.distances_km(lons, lats), expected, atol=1e-6)
+
+
+def test_grid_matches_all_edges():
+    rng = np.random.default_rng(0)
+    ring = [(16.5, 43.0), (22.0, 42.6), (29.5, 44.8), (30.8, 48.2), (24.0, 49.1), (17.0, 47.5)]
+    index = BorderDistanceIndex([ring], cell_deg=0.2)
+    # Points inside and around the bounds, some off the grid
+    lons = rng.uniform(14, 33, 5000)
+    lats = rng.uniform(41, 51, 5000)
+    brute = index._distances(unit_vectors(lons, lats), np.arange(len(index))).min(axis=1) * EARTH_RADIUS_KM
+    np.testing.assert_allclose(index.distances_km(lons, lats, chunk_size=999), brute, rtol=0, atol=1e-9)
@@ -0,0 +1,105 @@
+"""
+Tests for the typed columnar output in dacia_columnar.py
+"""
+
+import os
+import pytest
+from dacia_city_store import CityStore
+from dacia_columnar import columnar_path, find_columnar, pyarrow_available, read_columnar, write_columnar
+
+FORMATS = ['npy', pytest.param('parquet', marks=pytest.mark.skipif(not pyarrow_available(),
+                                                                   reason="pyarrow is not installed"))]
+
+CITIES = [
+    ('1', 'Orhei', 'MD', 25641, '100', '68', ''),
+    ('2', 'Cluj-Napoca', 'RO', 324576, '340', '13', '54'),
+    ('3', 'Szeged', 'HU', 160766, '', '06', ''),
+    ('4', 'Chișinău', 'MD', 635994, '85', '57', ''),
+    ('5', 'Brașov', 'RO', 253200, '600', '04', '40'),
+    ('6', 'İstanbul Sector', 'RO', 1200, '-2', '13', ''),
+]
+
+
+def sample_store():
+    return CityStore.from_cities({
+        'geonameid': geonameid, 'name': name, 'asciiname': name.encode('ascii', 'replace').decode(),
+        'country_code': country, 'latitude': 45.0 + i / 10, 'longitude': 25.0 - i / 10,
+        'population': population, 'elevation': elevation, 'admin1_code': admin1, 'admin2_code': admin2,
+    } for i, (geonameid, name, country, population, elevation, admin1, admin2) in enumerate(CITIES))
+
+
+def expected_rows(country=None):
+    """Rows of sample_store in dacia_cities_all.csv order, as read back"""
+    rows = [dict(row, elevation=row['elevation'] if row['elevation'] != '' else 0)
+            for row in sample_store()]
+    rows.sort(key=lambda row: (row['country_code'], -row['population']))
+    return [row for row in rows if country in (None, row['country_code'])]
+
+
+@pytest.mark.parametrize('fmt', FORMATS)
+def test_round_trip(tmp_path, fmt):
+    path = columnar_path(str(tmp_path / 'cities.csv'), fmt)
+    write_columnar(sample_store(), path)
+
+    assert list(read_columnar(path)) == expected_rows()
+    assert list(read_columnar(path, missing_elevation='')) == [
+        dict(row, elevation='' if row['geonameid'] == '3' else row['elevation']) for row in expected_rows()]
+
+
+@pytest.mark.parametrize('fmt', FORMATS)
+def test_read_single_country(tmp_path, fmt):
+    path = columnar_path(str(tmp_path / 'cities.csv'), fmt)
+    write_columnar(sample_store(), path)
+
+    for country in ('HU', 'MD', 'RO'):
+        store = read_columnar(path, country)
+        assert list(store) == expected_rows(country)
+        # Only the names of the slice are decoded
+        assert len(store.names) <= 2 * len(store)
+    assert len(read_columnar(path, 'UA')) == 0
+
+
+def test_empty_store(tmp_path):
+    path = columnar_path(str(tmp_path / 'cities.csv'), 'npy')
+    write_columnar(CityStore(), path)
+    assert len(read_columnar(path)) == 0
+
+
+def test_find_columnar_staleness(tmp_path):
+    csv_file = str(tmp_path / 'cities.csv')
+    store = sample_store()
+    store.write_csv(csv_file)
+    path = columnar_path(csv_file, 'npy')
+    write_columnar(store, path, source_file=csv_file)
+    assert find_columnar(csv_file) == path
+
+    # Same bytes with a new mtime: the content hash keeps it current
+    stat = os.stat(csv_file)
+    os.utime(csv_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert find_columnar(csv_file) == path
+
+    # Same size, different content
+    with open(csv_file, 'r+', encoding='utf-8') as f:
+        content = f.read()
+        f.seek(0)
+        f.write(content.replace('Orhei', 'Orhej'))
+    os.utime(csv_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10**9))
+    assert find_columnar(csv_file) is None
+
+    # A copy written without a source record is never current for a CSV
+    write_columnar(store, path)
+    assert find_columnar(csv_file) is None
+    # Only the columnar copy was kept
+    os.remove(csv_file)
+    write_columnar(store, path, source_file=__file__)
+    assert find_columnar(csv_file) == path
+    assert find_columnar(path) == path
+
+
+def test_save_columnar_matches_csv(filtered_sample):
+    filter_obj, output_file = filtered_sample
+    (path,) = {os.path.dirname(p) for p in filter_obj.save_columnar(output_file, 'npy')}
+    assert find_columnar(output_file) == path
+    assert list(read_columnar(path)) == list(CityStore.from_csv(output_file))
+    assert list(read_columnar(path, 'RO')) == [row for row in CityStore.from_csv(output_file)
+                                               if row['country_code'] == 'RO']
@@ -0,0 +1,48 @@
+"""
+Tests for DaciaCityFilter.apply_daily_update
+"""
+
+import csv
+import os
+from filter_dacia_cities import is_cities500_place
+
+
+def read_rows(csv_file):
+    with open(csv_file, 'r', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+def test_is_cities500_place():
+    place = {'feature_class': 'P', 'feature_code': 'PPL', 'population': 500}
+    assert is_cities500_place(place)
+    assert not is_cities500_place(dict(place, population=499))
+    # Seats belong to cities500 at any population
+    assert is_cities500_place(dict(place, population=0, feature_code='PPLA4'))
+    assert not is_cities500_place(dict(place, feature_class='T', feature_code='MT'))
+
+
+def test_daily_update(tmp_path, data_file, filtered_sample):
+    filter_obj, output_file = filtered_sample
+    before = {row['geonameid']: row for row in read_rows(output_file)}
+    assert set(before) == {'683506', '683844', '667268', '618426', '618605'}
+
+    groups = filter_obj.apply_daily_update(data_file('modifications-2024-05-01.txt'),
+                                           data_file('deletes-2024-05-01.txt'),
+                                           output_file, str(tmp_path) + os.sep, statistics_file=None)
+
+    rows = read_rows(output_file)
+    by_id = {row['geonameid']: row for row in rows}
+    # Hoverla (mountain), Nistru (river) and Hamlet (pop 30) are not
+    # cities500 places; Sibiu became one of those and Balti was deleted
+    assert set(by_id) == {'683506', '683844', '618426', '617077'}
+    # Brasov is modified in place, with the RO/HU scale rule applied
+    assert by_id['683844']['population'] == str(int(260000 * 0.85))
+    assert by_id['683844']['population'] != before['683844']['population']
+    assert by_id['683506'] == before['683506']
+
+    assert sorted(groups) == ['MD', 'RO']
+    assert [row['geonameid'] for row in read_rows(tmp_path / 'dacia_cities_MD.csv')] == ['618426', '617077']
+    assert [row['geonameid'] for row in read_rows(tmp_path / 'dacia_cities_RO.csv')] == ['683506', '683844']
+    assert not os.path.exists(tmp_path / 'dacia_cities_UA.csv')
+    # The combined file is the country files in country code order
+    assert [row['country_code'] for row in rows] == ['MD', 'MD', 'RO', 'RO']
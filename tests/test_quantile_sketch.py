@@ -0,0 +1,73 @@
+"""
+Tests for the mergeable QuantileSketch
+"""
+
+import numpy as np
+import pytest
+from dacia_stats import QuantileSketch
+
+QUANTILES = np.linspace(0, 1, 41)
+
+
+def assert_within_bound(sketch, data):
+    """Every quantile's true rank is within rank_error of q * count"""
+    data = np.sort(data)
+    for q in QUANTILES:
+        value = sketch.quantile(q)
+        below = np.searchsorted(data, value, side='left')
+        at_or_below = np.searchsorted(data, value, side='right')
+        target = q * len(data)
+        assert below - sketch.rank_error <= target <= at_or_below + sketch.rank_error, q
+
+
+def heavy_tailed(seed, n):
+    rng = np.random.default_rng(seed)
+    return (rng.pareto(1.1, n) * 400).astype(np.int64)
+
+
+def test_exact_below_limit():
+    data = heavy_tailed(0, 5001)
+    sketch = QuantileSketch(capacity=64, exact_limit=len(data))
+    for chunk in np.array_split(data, 7):
+        sketch.add_array(chunk)
+    assert sketch.is_exact
+    assert sketch.median() == int(np.median(data))
+    assert sketch.quantile(0) == data.min()
+    assert sketch.quantile(1) == data.max()
+
+
+@pytest.mark.parametrize('capacity', [16, 64, 256])
+def test_rank_error_bound(capacity):
+    data = heavy_tailed(1, 200_000)
+    sketch = QuantileSketch(capacity=capacity, exact_limit=1000)
+    for chunk in np.array_split(data, 37):
+        sketch.add_array(chunk)
+    assert not sketch.is_exact
+    assert sketch.count == len(data)
+    # Compaction keeps the total weight
+    assert sum(len(sketch._level(h)) << h for h in range(len(sketch.levels))) == len(data)
+    assert_within_bound(sketch, data)
+
+
+def test_merge_keeps_bound():
+    shards = [heavy_tailed(seed, n) for seed, n in ((2, 60_000), (3, 1), (4, 0), (5, 90_001))]
+    sketches = []
+    for shard in shards:
+        sketch = QuantileSketch(capacity=64, exact_limit=500)
+        for chunk in np.array_split(shard, 5):
+            sketch.add_array(chunk)
+        sketches.append(sketch)
+
+    merged = sketches[0]
+    for sketch in sketches[1:]:
+        merged.merge(sketch)
+    data = np.concatenate(shards)
+    assert merged.count == len(data)
+    assert_within_bound(merged, data)
+
+
+def test_empty():
+    sketch = QuantileSketch()
+    assert sketch.median() == 0
+    assert sketch.quantile(0.9) == 0
+    assert sketch.error_bound == 0.0